@@ -0,0 +1,234 @@
+"""Module to run a local stand-in for the Okta users API"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+USER_PATH = re.compile(r"^/api/v1/users/([^/]+)$")
+DEACTIVATE_PATH = re.compile(r"^/api/v1/users/([^/]+)/lifecycle/deactivate$")
+FILTER_TERM = re.compile(r'(profile\.email|status) eq "((?:[^"\\]|\\.)*)"')
+
+
+class MockOktaState:
+    """Class to hold the emulated directory and the per-endpoint rate limit windows.
+
+    Users are kept as id -> [status, email]. Each endpoint family gets `limit` requests per
+    `window_seconds`, answered with X-Rate-Limit-* headers, and a 429 once it is used up.
+    """
+
+    def __init__(self, users: dict = None, limit: int = 600, window_seconds: float = 60, latency: float = 0.0):
+        self.users = {okta_id: list(user) for okta_id, user in (users or {}).items()}
+        self.emails = {}
+        for okta_id, (_, email) in self.users.items():
+            if email:
+                self.emails.setdefault(email.casefold(), []).append(okta_id)
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.requests = {}
+        # Filter results are kept between pages, until a lifecycle call changes the directory
+        self.listings = {}
+
+    def take(self, bucket: str):
+        """Function to use one request of a bucket, returns (allowed, headers)"""
+        now = time.time()
+        with self.lock:
+            self.requests[bucket] = self.requests.get(bucket, 0) + 1
+            reset, used = self.windows.get(bucket, (0, 0))
+            if now >= reset:
+                reset, used = int(now + self.window_seconds) + 1, 0
+            allowed = used < self.limit
+            if allowed:
+                used += 1
+            self.windows[bucket] = (reset, used)
+        headers = {
+            "X-Rate-Limit-Limit": str(self.limit),
+            "X-Rate-Limit-Remaining": str(self.limit - used),
+            "X-Rate-Limit-Reset": str(reset),
+        }
+        return allowed, headers
+
+    def get_user(self, okta_id: str):
+        with self.lock:
+            user = self.users.get(okta_id)
+            return None if user is None else _user(okta_id, user)
+
+    def deactivate_user(self, okta_id: str) -> int:
+        with self.lock:
+            user = self.users.get(okta_id)
+            if user is None:
+                return 404
+            if user[0] == "DEPROVISIONED":
+                return 403
+            user[0] = "DEPROVISIONED"
+            self.listings.clear()
+            return 200
+
+    def delete_user(self, okta_id: str) -> int:
+        with self.lock:
+            user = self.users.get(okta_id)
+            if user is None:
+                return 404
+            # Like Okta, deleting a user that is not deprovisioned only deactivates them
+            self.listings.clear()
+            if user[0] != "DEPROVISIONED":
+                user[0] = "DEPROVISIONED"
+                return 204
+            del self.users[okta_id]
+            if user[1]:
+                self.emails[user[1].casefold()].remove(okta_id)
+            return 204
+
+    def list_users(self, expression: str, after: str, limit: int):
+        """Function to run a filter expression, returns a page of users and the cursor of the next page"""
+        emails, statuses = set(), set()
+        for field, value in FILTER_TERM.findall(expression or ""):
+            value = value.replace('\\"', '"').replace("\\\\", "\\")
+            (emails if field == "profile.email" else statuses).add(value.casefold() if field == "profile.email" else value)
+
+        with self.lock:
+            okta_ids = self.listings.get(expression)
+            if okta_ids is None and emails:
+                okta_ids = sorted(okta_id for email in emails for okta_id in self.emails.get(email, ()))
+            elif okta_ids is None:
+                # Like Okta, deprovisioned users are only listed when asked for by status
+                okta_ids = sorted(
+                    okta_id
+                    for okta_id, user in self.users.items()
+                    if (user[0] in statuses if statuses else user[0] != "DEPROVISIONED")
+                )
+                self.listings[expression] = okta_ids
+            start = int(after or 0)
+            page = [_user(okta_id, self.users[okta_id]) for okta_id in okta_ids[start:start + limit]]
+        next_after = start + limit if start + limit < len(okta_ids) else None
+        return page, next_after
+
+
+def _user(okta_id: str, user: list) -> dict:
+    return {"id": okta_id, "status": user[0], "profile": {"email": user[1]}}
+
+
+class MockOktaHandler(BaseHTTPRequestHandler):
+    """Class to answer the users API requests the tool makes"""
+
+    protocol_version = "HTTP/1.1"
+    # Send each response in one write, a separate headers/body write stalls on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    server: "MockOktaServer"
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+    def do_GET(self):  # pylint: disable=C0103
+        url = urlparse(self.path)
+        match = USER_PATH.match(url.path)
+        if match:
+            if self._throttled("GET /users/{id}"):
+                return
+            user = self.server.state.get_user(match.group(1))
+            if user is None:
+                self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found"})
+            else:
+                self._send(200, user)
+        elif url.path == "/api/v1/users":
+            if self._throttled("GET /users"):
+                return
+            query = parse_qs(url.query)
+            limit = int(query.get("limit", ["200"])[0])
+            page, next_after = self.server.state.list_users(query.get("filter", [""])[0], query.get("after", [None])[0], limit)
+            links = {}
+            if next_after is not None:
+                params = {key: values[0] for key, values in query.items()}
+                params["after"] = next_after
+                links["Link"] = f'<http://{self.headers["Host"]}{url.path}?{urlencode(params)}>; rel="next"'
+            self._send(200, page, links)
+        else:
+            self._send(404, {"errorCode": "E0000022", "errorSummary": "Not found"})
+
+    def do_POST(self):  # pylint: disable=C0103
+        self._drain()
+        match = DEACTIVATE_PATH.match(urlparse(self.path).path)
+        if not match:
+            self._send(404, {"errorCode": "E0000022", "errorSummary": "Not found"})
+            return
+        if self._throttled("POST /users/{id}/lifecycle/deactivate"):
+            return
+        status_code = self.server.state.deactivate_user(match.group(1))
+        if status_code == 200:
+            self._send(200, {})
+        elif status_code == 403:
+            self._send(403, {"errorCode": "E0000038", "errorSummary": "This operation is not allowed in the user's current status."})
+        else:
+            self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found"})
+
+    def do_DELETE(self):  # pylint: disable=C0103
+        match = USER_PATH.match(urlparse(self.path).path)
+        if not match:
+            self._send(404, {"errorCode": "E0000022", "errorSummary": "Not found"})
+            return
+        if self._throttled("DELETE /users/{id}"):
+            return
+        if self.server.state.delete_user(match.group(1)) == 204:
+            self._send(204, None)
+        else:
+            self._send(404, {"errorCode": "E0000007", "errorSummary": "Not found"})
+
+    def _throttled(self, bucket: str) -> bool:
+        state = self.server.state
+        if state.latency:
+            time.sleep(state.latency)
+        allowed, self.rate_limit_headers = state.take(bucket)
+        if not allowed:
+            self._send(429, {"errorCode": "E0000047", "errorSummary": "API call exceeded rate limit due to too many requests."})
+        return not allowed
+
+    def _drain(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _send(self, status_code: int, body, headers: dict = None) -> None:
+        content = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status_code)
+        for key, value in {**getattr(self, "rate_limit_headers", {}), **(headers or {})}.items():
+            self.send_header(key, value)
+        # The handler is reused for every request on a keep-alive connection
+        self.rate_limit_headers = {}
+        if content:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class MockOktaServer(ThreadingHTTPServer):
+    """Class to serve a MockOktaState on a local port from a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, state: MockOktaState, port: int = 0):
+        super().__init__(("127.0.0.1", port), MockOktaHandler)
+        self.state = state
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        """Function to get the URL to use as OKTA_BASE_URL"""
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v1"
+
+    def start(self) -> "MockOktaServer":
+        """Function to start serving in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name="mock-okta", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Function to stop serving"""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,129 @@
+"""Module to microbenchmark the Okta request core without any network.
+
+Usage:
+    python -m benchmarks.okta_api [--calls 200000]
+
+Times `Okta._api` on canned responses (user lookups, deactivations and 204 deletes) against
+the previous implementation, which decoded every body and parsed the Link header eagerly and
+retried 429s by recursing.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Read when the utilities are imported; nothing is sent anywhere
+os.environ.setdefault("OKTA_API_KEY", "benchmark")
+os.environ.setdefault("OKTA_DOMAIN", "benchmark.okta.com")
+os.environ.setdefault("LOG_LEVEL", "WARN")
+
+from src.app.utilities.stats_util import increment  # pylint: disable=C0413
+from src.app.utilities.metrics_util import METRICS  # pylint: disable=C0413
+from src.app.utilities.okta_util import DEACTIVATE_USER_BUCKET, DELETE_USER_BUCKET, GET_USER_BUCKET, Okta, _json  # pylint: disable=C0413
+from src.app.utilities.rate_limit_util import RateLimiterPool  # pylint: disable=C0413
+
+USER = {
+    "id": "00ub0oNGTSWTBKOLGLNR",
+    "status": "ACTIVE",
+    "created": "2013-06-24T16:39:18.000Z",
+    "lastLogin": "2013-06-24T17:39:19.000Z",
+    "profile": {"firstName": "Isaac", "lastName": "Brock", "email": "isaac.brock@example.com", "login": "isaac.brock@example.com"},
+    "credentials": {"provider": {"type": "OKTA", "name": "OKTA"}},
+    "_links": {"self": {"href": "https://example.okta.com/api/v1/users/00ub0oNGTSWTBKOLGLNR"}},
+}
+
+
+class LegacyOkta(Okta):
+    """The request core as it was before it was reworked, kept to compare against"""
+
+    def _api(self, url: str, method: str, data=None, bucket: str = GET_USER_BUCKET):
+        rate_limiter = self.rate_limiters.get(bucket)
+        rate_limiter.acquire()
+        started = time.monotonic()
+        response = self.http.api(url, method, data)
+        latency = time.monotonic() - started
+        increment("WORK_TIME", latency)
+        increment("TOTAL_OKTA_API_CALLS")
+        METRICS.observe("okta_request_seconds", latency, endpoint=bucket, status=response.status_code)
+        METRICS.mark("okta_requests")
+        rate_limiter.update(response.headers)
+        if response.status_code == 429 and rate_limiter.seconds_until_reset() > 0:
+            rate_limiter.exhaust()
+            return self._api(url, method, data, bucket)
+        return {
+            "status_code": response.status_code,
+            "json": _json(response),
+            "next": response.links.get("next", {}).get("url"),
+        }
+
+
+class CannedHttp:
+    """Answers every request with the same prebuilt response"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def api(self, url, method, data=None):
+        return self.response
+
+
+def make_response(status_code: int, body=None) -> requests.Response:
+    """Function to build a requests.Response the way the session would return it"""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b"" if body is None else json.dumps(body).encode()  # pylint: disable=W0212
+    response.headers = CaseInsensitiveDict(
+        {
+            "Content-Type": "application/json",
+            "X-Rate-Limit-Limit": "1000000",
+            "X-Rate-Limit-Remaining": "999999",
+            # A window that already reset, so the headers are parsed but the limiter never paces
+            "X-Rate-Limit-Reset": str(int(time.time()) - 1),
+        }
+    )
+    return response
+
+
+SCENARIOS = {
+    "get_user": (lambda okta: okta.get_user("00ub0oNGTSWTBKOLGLNR")["json"], make_response(200, USER), GET_USER_BUCKET),
+    "deactivate_user": (lambda okta: okta.deactivate_user("00ub0oNGTSWTBKOLGLNR"), make_response(200, {}), DEACTIVATE_USER_BUCKET),
+    "delete_user": (lambda okta: okta.delete_user("00ub0oNGTSWTBKOLGLNR"), make_response(204), DELETE_USER_BUCKET),
+}
+
+
+def time_calls(okta_class, scenario: str, calls: int) -> float:
+    """Function to time one scenario, returns microseconds per call"""
+    call, response, _ = SCENARIOS[scenario]
+    okta = okta_class(rate_limiters=RateLimiterPool(pool_minimum=0))
+    okta.http = CannedHttp(response)
+    call(okta)
+    started = time.perf_counter()
+    for _ in range(calls):
+        call(okta)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main(argv=None) -> list:
+    """Function to time every scenario with the previous and the current request core"""
+    parser = argparse.ArgumentParser(description="Microbenchmark Okta._api against the previous implementation")
+    parser.add_argument("--calls", type=int, default=200000, help="Calls timed per scenario")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scenario in SCENARIOS:
+        legacy = time_calls(LegacyOkta, scenario, args.calls)
+        current = time_calls(Okta, scenario, args.calls)
+        results.append({"scenario": scenario, "legacy_us": round(legacy, 2), "current_us": round(current, 2), "speedup": round(legacy / current, 2)})
+
+    print(f"{'scenario':>20}  {'legacy us/call':>16}  {'current us/call':>16}  {'speedup':>8}")
+    for result in results:
+        print(f"{result['scenario']:>20}  {result['legacy_us']:>16}  {result['current_us']:>16}  {result['speedup']:>8}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
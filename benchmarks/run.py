@@ -0,0 +1,179 @@
+"""Module to benchmark the tool end to end against the local mock Okta server.
+
+Usage:
+    python -m benchmarks.run --users 1000,100000,1000000 [--latency 0.02] [--limit 600] [--env CONCURRENCY=8]
+
+Each size runs `main` in a fresh child process, against a mock directory holding that many
+users, and reports rows/min, Okta API calls/min, time throttled, the child's peak RSS and how
+long importing the app took.
+"""
+
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_okta import MockOktaServer, MockOktaState
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def make_users(count: int) -> dict:
+    """Function to build a mock directory: every tenth user already deprovisioned"""
+    return {
+        f"00ubench{index:07d}": ("DEPROVISIONED" if index % 10 == 0 else "ACTIVE", f"user{index}@bench.example.com")
+        for index in range(count)
+    }
+
+
+def write_inputs(work_dir: str, users: dict, kind: str) -> None:
+    """Function to write the input CSV (every user plus 1% unknown values) and an empty exclude CSV"""
+    folder = "okta_emails" if kind == "emails" else "okta_ids"
+    path = os.path.join(work_dir, "data", "input", folder, f"test_{kind}.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        for okta_id, (_, email) in users.items():
+            writer.writerow([email if kind == "emails" else okta_id])
+        for index in range(max(1, len(users) // 100)):
+            writer.writerow([f"missing{index}@bench.example.com" if kind == "emails" else f"00umissing{index:07d}"])
+    open(os.path.join(work_dir, "data", "input", "test_exclude.csv"), "w", encoding="utf-8").close()
+
+
+def run_size(count: int, args) -> dict:
+    """Function to run main once against a mock directory of `count` users"""
+    users = make_users(count)
+    state = MockOktaState(users, limit=args.limit, window_seconds=args.window, latency=args.latency)
+    server = MockOktaServer(state).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="okta-benchmark-") as work_dir:
+            write_inputs(work_dir, users, args.kind)
+            del users
+            env = {
+                key: value
+                for key, value in os.environ.items()
+                if key not in ("TARGET_S3_BUCKET", "RESUME", "SHARD_COUNT")
+            }
+            env.update(
+                {
+                    "ENVIRONMENT": "test",
+                    "OKTA_DOMAIN": "mock-okta",
+                    "OKTA_API_KEY": "benchmark",
+                    "OKTA_BASE_URL": server.base_url,
+                    "LOG_LEVEL": "WARN",
+                }
+            )
+            env.update(dict(item.split("=", 1) for item in args.env))
+            started = time.monotonic()
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", "--child", work_dir],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            elapsed = time.monotonic() - started
+    finally:
+        server.stop()
+
+    lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"Benchmark run for {count} users failed:\n{completed.stderr[-4000:]}")
+
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    minutes = max(result["run_seconds"], 1e-9) / 60
+    return {
+        "users": count,
+        "rows": result["TOTAL_ROWS"],
+        "seconds": round(result["run_seconds"], 2),
+        "import_ms": round(result["import_seconds"] * 1000, 1),
+        "boto3_loaded": result["boto3_loaded"],
+        "wall_seconds": round(elapsed, 2),
+        "rows_per_minute": round(result["TOTAL_ROWS"] / minutes),
+        "api_calls": result["TOTAL_OKTA_API_CALLS"],
+        "api_calls_per_minute": round(result["TOTAL_OKTA_API_CALLS"] / minutes),
+        "throttle_seconds": round(result["THROTTLE_TIME"], 2),
+        "peak_rss_mb": round(result["peak_rss_kb"] / 1024, 1),
+        "users_left": len(state.users),
+        "deleted": result["TOTAL_USERS_DELETED"],
+        "errors": result["DEACTIVATION_ERROR_COUNT"] + result["DELETE_ERROR_COUNT"],
+    }
+
+
+def run_child(work_dir: str) -> None:
+    """Function to run main with its data directory pointed at the benchmark's work directory"""
+    # Has to happen before anything else reads the data paths at import time
+    from src.app.utilities.config_util import CONFIG  # pylint: disable=C0415
+
+    CONFIG["SRC_PATH"] = work_dir.rstrip("/") + "/"
+
+    import_started = time.monotonic()
+    from src.app.main import main  # pylint: disable=C0415
+
+    import_seconds = time.monotonic() - import_started
+
+    from src.app.utilities.logging_util import Logger  # pylint: disable=C0415
+    from src.app.utilities.stats_util import STATS  # pylint: disable=C0415
+
+    started = time.monotonic()
+    main()
+    run_seconds = time.monotonic() - started
+    Logger.flush()
+
+    keys = (
+        "TOTAL_ROWS",
+        "TOTAL_OKTA_API_CALLS",
+        "THROTTLE_TIME",
+        "TOTAL_USERS_DELETED",
+        "DEACTIVATION_ERROR_COUNT",
+        "DELETE_ERROR_COUNT",
+    )
+    stats = STATS.snapshot()
+    result = {key: stats[key] for key in keys}
+    result["run_seconds"] = run_seconds
+    result["import_seconds"] = import_seconds
+    # Local runs should never load boto3
+    result["boto3_loaded"] = "boto3" in sys.modules
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tool against the local mock Okta server")
+    parser.add_argument("--users", default="1000", help="Comma separated directory sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--kind", choices=("ids", "emails"), default="ids", help="Input CSV to benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the mock server waits before answering")
+    parser.add_argument("--limit", type=int, default=1000000, help="Requests per endpoint family per rate limit window")
+    parser.add_argument("--window", type=float, default=60, help="Length of a rate limit window in seconds")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE settings for the run, e.g. CONCURRENCY=8")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> list:
+    """Function to run the benchmark for every requested size and print a summary table"""
+    args = parse_args(argv)
+    if args.child:
+        run_child(args.child)
+        return []
+
+    results = [run_size(int(count), args) for count in args.users.split(",")]
+    columns = ["users", "rows", "seconds", "import_ms", "rows_per_minute", "api_calls_per_minute", "throttle_seconds", "peak_rss_mb", "errors"]
+    print("  ".join(f"{column:>20}" for column in columns))
+    for result in results:
+        print("  ".join(f"{result[column]:>20}" for column in columns))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,35 @@
 
 # pylint: disable= C0301, W0718, C0103, C0411, W0621, W0612
 
-import csv
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 
-from .utilities.okta_util import Okta
+from .utilities.okta_util import OKTA_RATE_LIMIT_POOL_MINIMUM, Okta, is_already_deprovisioned
 from .utilities.logging_util import Logger
 from .utilities.env_util import Env
 from .utilities.s3_util import S3Util
 from .utilities.config_util import CONFIG
 from .utilities.reporting_util import ReportingUtil
-from .utilities.error_util import record_failed_attempt
+from .utilities.stats_util import STATS, increment
+from .utilities.error_util import (
+    OktaApiError,
+    flush_failed_attempts,
+    record_failed_attempt,
+    record_recovered_attempt,
+    take_failed_attempts,
+)
+from .utilities.checkpoint_util import Checkpoint
+from .utilities.exclude_util import ExcludeIndex
+from .utilities.ingest_util import InputStream, find_input_path, input_fingerprint, local_parts, s3_parts
+from .utilities.snapshot_util import SNAPSHOT_STATUSES, UnlistedUsers, build_snapshot
+from .utilities.plan_util import PlanWriter, load_plan
+from .utilities.concurrency_util import AdaptiveConcurrency
+from .utilities.result_cache_util import close_result_cache, is_known_gone, open_result_cache, record_result
+from .utilities.pipeline_util import Pipeline, Stage
+from .utilities.rate_limit_util import RateLimiterPool
+from .utilities.shard_util import LocalShardStore, S3ShardStore, ShardCoordinator
+from .utilities.metrics_util import METRICS, METRICS_S3_SECONDS, MetricsExporter
 
 LOG = Logger("main.py")
 
@@ -20,215 +40,919 @@ INPUT_IDS_CSV_PATH = CONFIG["INPUT_IDS_CSV_PATH"]
 INPUT_EMAILS_CSV_PATH = CONFIG["INPUT_EMAILS_CSV_PATH"]
 
 
-def check_total_rows(path: str) -> None:
-    """Function to check the total number of rows in the input CSV file"""
-    with open(SRC_PATH + path, mode="r", encoding="utf-8-sig") as csv_file:
-        total_rows = sum(
-            1 for row in csv.reader(csv_file)
-        )  # Count the number of rows in the CSV file
-        LOG.info("Total rows in input CSV: " + str(total_rows) + "\n")
-        CONFIG["TOTAL_ROWS"] = total_rows
-        return total_rows
-
-
 def check_for_file() -> None:
     """Function to check if a file exists"""
-    try:
-        LOG.info("Checking if input CSV file exists: " + INPUT_IDS_CSV_PATH)
-        with open(
-            SRC_PATH + INPUT_IDS_CSV_PATH, mode="r", encoding="utf-8-sig"
-        ) as csv_file:
-            pass
+    LOG.info("Checking if input CSV file exists: " + INPUT_IDS_CSV_PATH)
+    if find_input_path(SRC_PATH + INPUT_IDS_CSV_PATH):
         return "ids"
-    except FileNotFoundError:
-        LOG.error("Input CSV file not found: " + INPUT_IDS_CSV_PATH)
-        try:
-            LOG.info(
-                "Checking if input Emails CSV file exists: " + INPUT_EMAILS_CSV_PATH
-            )
-            with open(
-                SRC_PATH + INPUT_EMAILS_CSV_PATH, mode="r", encoding="utf-8-sig"
-            ) as csv_file:
-                pass
-            return "emails"
-        except Exception as e:
-            LOG.error(e)
-            LOG.error("Input CSV files not found. Exiting.")
-            return None
 
+    LOG.error("Input CSV file not found: " + INPUT_IDS_CSV_PATH)
+    LOG.info("Checking if input Emails CSV file exists: " + INPUT_EMAILS_CSV_PATH)
+    if find_input_path(SRC_PATH + INPUT_EMAILS_CSV_PATH):
+        return "emails"
 
-def download_data_files(s3: S3Util) -> None:
-    """Function to download the input CSV files from S3"""
+    LOG.error("Input CSV files not found. Exiting.")
+    return None
+
+
+def download_exclude_file(s3: S3Util) -> None:
+    """Function to download the exclude values CSV file from S3"""
     try:
         s3.download_file(
             CONFIG["INPUT_EXCLUDE_VALUES_CSV_PATH"],
             f"{SRC_PATH}{CONFIG['INPUT_EXCLUDE_VALUES_CSV_PATH']}",
         )
-        try:
-            s3.download_file(INPUT_IDS_CSV_PATH, f"{SRC_PATH}{INPUT_IDS_CSV_PATH}")
-            return "ids"
-        except Exception as e:
-            LOG.error("Error downloading input Okta IDs CSV file from S3: " + str(e))
-            try:
-                s3.download_file(
-                    INPUT_EMAILS_CSV_PATH, f"{SRC_PATH}{INPUT_EMAILS_CSV_PATH}"
-                )
-                return "emails"
-            except Exception as e:
-                LOG.error("Error downloading input Okta Emails CSV file from S3: " + str(e))
-                raise e
     except Exception as e:
         LOG.error("Error downloading input Exclude Values CSV file from S3: " + str(e))
         raise e
 
+
+def download_data_files(s3: S3Util) -> None:
+    """Function to download the input CSV files from S3"""
+    download_exclude_file(s3)
+    try:
+        s3.download_file(INPUT_IDS_CSV_PATH, f"{SRC_PATH}{INPUT_IDS_CSV_PATH}")
+        return "ids"
+    except Exception as e:
+        LOG.error("Error downloading input Okta IDs CSV file from S3: " + str(e))
+        try:
+            s3.download_file(
+                INPUT_EMAILS_CSV_PATH, f"{SRC_PATH}{INPUT_EMAILS_CSV_PATH}"
+            )
+            return "emails"
+        except Exception as e:
+            LOG.error("Error downloading input Okta Emails CSV file from S3: " + str(e))
+            raise e
+
+
+def find_s3_input(s3: S3Util):
+    """Function to find the input CSV in S3 without downloading it, returns the input type and its parts"""
+    for check_type, input_path in (("ids", INPUT_IDS_CSV_PATH), ("emails", INPUT_EMAILS_CSV_PATH)):
+        LOG.info("Checking if input CSV exists in S3: " + input_path)
+        parts = s3_parts(s3, input_path)
+        if parts:
+            return check_type, parts
+    LOG.error("Input CSV files not found in S3.")
+    return None, None
+
 def upload_logs_to_s3(s3: S3Util, log_file_path: str) -> None:
     """Function to upload the log file to S3"""
+    # Make sure every queued message is in the file before it is uploaded
+    Logger.flush()
     local_log_file_path = f"{SRC_PATH}{log_file_path}"
     with open(local_log_file_path, "rb") as data:
         s3.upload_fileobj(log_file_path, data)
 
 
-def delete_deprovisioned_user(okta: Okta, user_id: str):
-    """Function to delete a deprovisioned user"""
+def deactivate_user(okta: Okta, user_id: str, optimistic: bool = False) -> bool:
+    """Function to deactivate a user, returns False when an optimistic call finds the user is already gone"""
+    try:
+        okta.deactivate_user(user_id)
+    except Exception as err:
+        return handle_deactivate_error(user_id, err, optimistic)
+    increment("TOTAL_USERS_DEACTIVATED")
+    record_result(user_id, "deactivated", user_id)
+    return True
+
+
+def delete_user(okta: Okta, user_id: str, optimistic: bool = False) -> None:
+    """Function to delete a deactivated user"""
     try:
         okta.delete_user(user_id)
-        CONFIG["TOTAL_USERS_DELETED"] += 1
     except Exception as err:
-        CONFIG["DELETE_ERROR_COUNT"] += 1
-        record_failed_attempt(user_id, CONFIG["FAILED_SECOND_CALL_CSV_PATH"])
-        raise err
+        handle_delete_error(user_id, err, optimistic)
+        return
+    increment("TOTAL_USERS_DELETED")
+    record_result(user_id, "deleted", user_id)
+
+
+async def off_loop(function, *args):
+    """Function to run blocking work (failure and checkpoint uploads, result cache reads and writes, input reads)
+    on a worker thread, so one slow call does not stall every request in flight on the event loop"""
+    import asyncio  # pylint: disable=C0415
+
+    return await asyncio.to_thread(function, *args)
+
+
+async def deactivate_user_async(okta, user_id: str, optimistic: bool = False) -> bool:
+    """Function to deactivate a user with the async client"""
+    try:
+        await okta.deactivate_user(user_id)
+    except Exception as err:
+        return await off_loop(handle_deactivate_error, user_id, err, optimistic)
+    increment("TOTAL_USERS_DEACTIVATED")
+    await off_loop(record_result, user_id, "deactivated", user_id)
+    return True
 
 
-def deactivate_and_delete_user(okta: Okta, user_id: str):
-    """Function to deactivate and delete a user"""
+async def delete_user_async(okta, user_id: str, optimistic: bool = False) -> None:
+    """Function to delete a deactivated user with the async client"""
     try:
-        okta.deactivate_user(user_id)
-        CONFIG["TOTAL_USERS_DEACTIVATED"] += 1
+        await okta.delete_user(user_id)
     except Exception as err:
-        CONFIG["DEACTIVATION_ERROR_COUNT"] += 1
-        record_failed_attempt(user_id, CONFIG["FAILED_FIRST_CALL_CSV_PATH"])
-        raise err
+        await off_loop(handle_delete_error, user_id, err, optimistic)
+        return
+    increment("TOTAL_USERS_DELETED")
+    await off_loop(record_result, user_id, "deleted", user_id)
+
+
+def row_finished() -> None:
+    """Function to count a finished row for the report and the live throughput"""
+    increment("TOTAL_ROWS_PROCESSED")
+    METRICS.mark("rows_processed")
+
+
+def email_users_deleted(email: str, users: list) -> None:
+    """Function to remember that every user of an email is gone, so a rerun of the same list does not search for it again"""
+    if users:
+        record_result(email, "deleted")
+
+
+def user_not_found(value: str) -> None:
+    """Function to count an ID or email that has no user in Okta"""
+    LOG.info(f"User {value} not found in Okta")
+    increment("TOTAL_USERS_NOT_FOUND")
+    record_result(value, "not_found")
+
+
+def record_lookup_error(value: str, err: Exception) -> None:
+    """Function to count and record a failed lookup of an ID or email, so the retry pass can look it up again"""
+    increment("LOOKUP_ERROR_COUNT")
+    METRICS.inc("lookup_errors_total")
+    record_failed_attempt(value, CONFIG["FAILED_FIRST_CALL_CSV_PATH"], stage="lookup", error=err)
 
+
+def no_users_found(value: str, users: list) -> None:
+    """Function to count a value without users, which is only not found when no snapshot left some statuses out"""
+    if isinstance(users, UnlistedUsers):
+        LOG.info(f"User {value} not listed with status {', '.join(SNAPSHOT_STATUSES)}, skipping")
+        increment("TOTAL_USERS_UNLISTED")
+        return
+    user_not_found(value)
+
+
+def handle_deactivate_error(user_id: str, err: Exception, optimistic: bool) -> bool:
+    """Function to work out a failed deactivation, returns whether to go on to delete the user or raises the error"""
+    # Without a lookup first, the response codes tell us the user's state
+    if optimistic and isinstance(err, OktaApiError):
+        if err.status_code == 404:
+            user_not_found(user_id)
+            return False
+        if is_already_deprovisioned(err):
+            LOG.info(f"User {user_id} is already deprovisioned")
+            return True
+    increment("DEACTIVATION_ERROR_COUNT")
+    METRICS.inc("lifecycle_errors_total", stage="deactivate")
+    record_failed_attempt(user_id, CONFIG["FAILED_FIRST_CALL_CSV_PATH"], stage="deactivate", error=err)
+    raise err
+
+
+def handle_delete_error(user_id: str, err: Exception, optimistic: bool) -> None:
+    """Function to work out a failed delete, raises the error unless the user is already gone"""
+    # Someone else deleted the user between the two calls
+    if optimistic and isinstance(err, OktaApiError) and err.status_code == 404:
+        user_not_found(user_id)
+        return
+    increment("DELETE_ERROR_COUNT")
+    METRICS.inc("lifecycle_errors_total", stage="delete")
+    record_failed_attempt(user_id, CONFIG["FAILED_SECOND_CALL_CSV_PATH"], stage="delete", error=err)
+    raise err
+
+
+def delete_deprovisioned_user(okta: Okta, user_id: str, optimistic: bool = False):
+    """Function to delete a deprovisioned user"""
+    delete_user(okta, user_id, optimistic)
+
+
+def deactivate_and_delete_user(okta: Okta, user_id: str, optimistic: bool = False):
+    """Function to deactivate and delete a user"""
+    if deactivate_user(okta, user_id, optimistic):
+        delete_user(okta, user_id, optimistic)
+
+
+def optimistic_deactivate_and_delete_user(okta: Okta, user_id: str):
+    """Function to deactivate and delete a user without looking them up first, working out their state from the response codes"""
+    deactivate_and_delete_user(okta, user_id, optimistic=True)
+
+
+def is_retryable(status_code: int) -> bool:
+    """Function to check if a failure can go away on its own: no response, throttling or a server error"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def retry_failed_user(okta: Okta, kind: str, value: str, stage: str, attempts: int, users: list = None) -> None:
+    """Function to try a failed user again from the stage that failed, so users that got past deactivation are only deleted.
+
+    Failed email lookups arrive with their users already looked up in batches by `resolve_failed_emails`.
+    """
+    if stage == "lookup":
+        if users is None:
+            try:
+                users = find_users_by_id(okta, value)
+            except Exception as err:
+                retry_failed(value, stage, attempts, err)
+                return
+        if not users:
+            user_not_found(value)
+        steps = [(user["id"], "delete" if user["status"] == "DEPROVISIONED" else "deactivate") for user in users]
+    else:
+        steps = [(value, stage)]
+
+    # Every step is tried, even when one of the value's other users failed again
+    succeeded = [retry_lifecycle(okta, user_id, user_stage, attempts) for user_id, user_stage in steps]
+    if all(succeeded):
+        LOG.info(f"Retry {attempts} of {value} succeeded")
+        increment("TOTAL_FAILURES_RECOVERED")
+        # Operators reading the failed CSVs can tell the user needs nothing more
+        record_recovered_attempt(value, failure_path(stage), attempts)
+        if stage == "lookup" and kind == "emails":
+            email_users_deleted(value, users)
+
+
+def retry_lifecycle(okta: Okta, user_id: str, stage: str, attempts: int) -> bool:
+    """Function to deactivate and/or delete a user again from the given stage, returns whether it succeeded"""
     try:
+        if stage == "deactivate":
+            try:
+                okta.deactivate_user(user_id)
+            except OktaApiError as err:
+                # The failed attempt may have gone through after all
+                if not is_already_deprovisioned(err):
+                    raise
+                LOG.info(f"User {user_id} is already deprovisioned")
+            else:
+                increment("TOTAL_USERS_DEACTIVATED")
+                record_result(user_id, "deactivated", user_id)
+            stage = "delete"
         okta.delete_user(user_id)
-        CONFIG["TOTAL_USERS_DELETED"] += 1
+    except OktaApiError as err:
+        if err.status_code != 404:
+            retry_failed(user_id, stage, attempts, err)
+            return False
+        # Someone else deleted the user since the failure
+        user_not_found(user_id)
+    except Exception as err:
+        retry_failed(user_id, stage, attempts, err)
+        return False
+    else:
+        increment("TOTAL_USERS_DELETED")
+        record_result(user_id, "deleted", user_id)
+    return True
+
+
+def retry_failed(user_id: str, stage: str, attempts: int, err: Exception) -> None:
+    """Function to record another failed attempt of a user, for the next retry round and the failed CSVs"""
+    LOG.error(f"Retry {attempts} of {user_id} failed to {stage}: {err}")
+    record_failed_attempt(user_id, failure_path(stage), stage=stage, error=err, attempts=attempts)
+
+
+def failure_path(stage: str) -> str:
+    """Function to get the failed CSV a stage's failures are recorded in"""
+    return CONFIG["FAILED_SECOND_CALL_CSV_PATH"] if stage == "delete" else CONFIG["FAILED_FIRST_CALL_CSV_PATH"]
+
+
+def retry_failed_users(okta: Okta, kind: str) -> None:
+    """Function to retry the users that failed with a transient error, in up to FAILURE_RETRY_ATTEMPTS rounds with exponential backoff"""
+    for retry_round in range(CONFIG["FAILURE_RETRY_ATTEMPTS"]):
+        failed = [
+            (user_id, stage, attempts + 1)
+            for user_id, (stage, status_code, attempts) in take_failed_attempts().items()
+            if is_retryable(status_code)
+        ]
+        if not failed:
+            return
+        backoff = CONFIG["FAILURE_RETRY_BACKOFF_SECONDS"] * 2 ** retry_round
+        LOG.info(f"Retrying {len(failed)} failed user(s) in {backoff:.0f}s (round {retry_round + 1}/{CONFIG['FAILURE_RETRY_ATTEMPTS']})")
+        time.sleep(backoff)
+        increment("TOTAL_FAILURES_RETRIED", len(failed))
+        if kind == "emails":
+            failed = resolve_failed_emails(okta, failed)
+        run_rows(failed, partial(retry_failed_user, okta, kind))
+
+
+def resolve_failed_emails(okta: Okta, failed: list):
+    """Function to look the emails whose lookup failed up again in batches of EMAIL_SEARCH_BATCH_SIZE, yielding (value, stage, attempts, users) items"""
+    batch = []
+    for value, stage, attempts in failed:
+        if stage != "lookup":
+            yield value, stage, attempts, None
+            continue
+        batch.append((value, stage, attempts))
+        if len(batch) >= CONFIG["EMAIL_SEARCH_BATCH_SIZE"]:
+            yield from resolve_failed_email_batch(okta, batch)
+            batch = []
+    if batch:
+        yield from resolve_failed_email_batch(okta, batch)
+
+
+def resolve_failed_email_batch(okta: Okta, batch: list):
+    """Function to look up one batch of failed email lookups, recording another failed attempt for each email if the search fails"""
+    try:
+        users_by_email = okta.search_users_by_emails([email for email, _, _ in batch])
     except Exception as err:
-        CONFIG["DELETE_ERROR_COUNT"] += 1
-        record_failed_attempt(user_id, CONFIG["FAILED_SECOND_CALL_CSV_PATH"])
-        raise err
+        for email, stage, attempts in batch:
+            retry_failed(email, stage, attempts, err)
+        return
+    for email, stage, attempts in batch:
+        yield email, stage, attempts, users_by_email.get(email.casefold(), [])
+
 
-def get_exclude_values():
-    """Function to get the exclude values from the environment"""
+def get_exclude_values() -> ExcludeIndex:
+    """Function to get the exclude values index from the exclude CSV file"""
     try:
-        exclude_values = []
-        with open(SRC_PATH + CONFIG["INPUT_EXCLUDE_VALUES_CSV_PATH"], mode="r", encoding="utf-8-sig") as csv_file:
-            csv_reader = csv.reader(csv_file)
-            for row in csv_reader:
-                exclude_values.append(row[0])
+        exclude_values = ExcludeIndex.from_csv(SRC_PATH + CONFIG["INPUT_EXCLUDE_VALUES_CSV_PATH"])
+        LOG.info(f"Loaded {len(exclude_values)} exclude value(s)")
         return exclude_values
     except FileNotFoundError as e:
         LOG.error("Input Exclude Values CSV file not found: " + CONFIG["INPUT_EXCLUDE_VALUES_CSV_PATH"])
         raise e
 
-def process_emails_csv() -> None:
-    """Function to process the emails CSV file"""
-    okta = Okta()
-    total_rows = check_total_rows(INPUT_EMAILS_CSV_PATH)
-    exclude_values = get_exclude_values()
-    with open(
-        SRC_PATH + INPUT_EMAILS_CSV_PATH, mode="r", encoding="utf-8-sig"
-    ) as csv_file:
-        csv_reader = csv.reader(csv_file)
-        current_row = 0
-
-        for row in csv_reader:
-            current_row += 1
-            email = str(row[0])
-            percentage_done = (current_row / total_rows) * 100
-
-            if email in exclude_values:
-                LOG.info(f"Value: {email} found in exclude list. Skipping.\n")
-                CONFIG["TOTAL_USERS_SKIPPED"] += 1
-                continue
 
-            LOG.info(f"Processing row {current_row}/{total_rows}")
-            LOG.info("Current email: " + email)
+def create_checkpoint(input_path: str, parts: list) -> Checkpoint:
+    """Function to create the checkpoint for an input file, loading the previous one when RESUME is set"""
+    s3 = S3Util() if bool(Env.get("TARGET_S3_BUCKET")) else None
+    checkpoint = Checkpoint(input_path, s3, before_write=flush_failed_attempts, fingerprint=input_fingerprint(parts))
+    if CONFIG["RESUME"]:
+        checkpoint.load()
+    return checkpoint
 
-            try:
-                user_response = okta.search_users(field="profile.email", value=email)
-                if user_response["status_code"] == 404:
-                    LOG.info(f"User with email {email} not found in Okta")
-                    CONFIG["TOTAL_USERS_NOT_FOUND"] += 1
-                elif user_response["status_code"] == 200:
-                    users = user_response['json']
-                    total_users = len(users)
-                    LOG.info(f"Found {total_users} users with email {email}")
-                    if total_users == 0:
-                        CONFIG["TOTAL_USERS_NOT_FOUND"] += 1
-                    for index, user in enumerate(users):
-                        user_id = user["id"]
-                        LOG.info(
-                            f"[{index + 1}/{total_users}] Processing user with ID: {user_id}"
-                        )
-                        if user["status"] == "DEPROVISIONED":
-                            delete_deprovisioned_user(okta, user_id)
-                        else:
-                            deactivate_and_delete_user(okta, user_id)
-            except Exception as e:
-                LOG.error("Error processing email " + email + f": {e}")
 
+def run_checkpointed_row(checkpoint: Checkpoint, handler, current_row: int, value: str, *args) -> None:
+    """Function to run the row handler and then mark the row as finished in the checkpoint"""
+    handler(current_row, value, *args)
+    checkpoint.mark_done(current_row, value)
+
+
+def pending_rows(rows, checkpoint: Checkpoint = None):
+    """Function to leave out the rows a previous run already finished"""
+    for current_row, value in rows:
+        if checkpoint is not None and checkpoint.should_skip(current_row):
+            increment("TOTAL_ROWS_RESUMED")
+            continue
+        yield current_row, value
+
+
+def unknown_rows(rows, checkpoint: Checkpoint = None):
+    """Function to leave out the rows an earlier run found deleted or not found, according to the result cache"""
+    for current_row, value in rows:
+        if is_known_gone(value):
+            increment("TOTAL_ROWS_CACHED")
+            if checkpoint is not None:
+                checkpoint.mark_done(current_row, value)
+            continue
+        yield current_row, value
+
+
+def run_rows(rows, handler, checkpoint: Checkpoint = None) -> None:
+    """Function to run the row handler over every (row number, value, ...) item, using a bounded worker pool when CONCURRENCY > 1"""
+    if checkpoint is not None:
+        handler = partial(run_checkpointed_row, checkpoint, handler)
+
+    concurrency = CONFIG["CONCURRENCY"]
+    if concurrency <= 1:
+        for item in rows:
+            handler(*item)
+        return
+
+    LOG.info(f"Processing rows with {concurrency} concurrent workers")
+    # Only keep a small multiple of the worker count queued so huge inputs are not read into memory up front
+    max_in_flight = concurrency * 2
+    in_flight = set()
+    METRICS.gauge("rows_in_flight", lambda: len(in_flight))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for item in rows:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(handler, *item))
+            for future in in_flight:
+                future.result()
+    finally:
+        METRICS.remove_gauge("rows_in_flight")
+
+
+def resolve_email_rows(okta: Okta, exclude_values, rows):
+    """Function to look the emails up in batches, yielding (row number, email, users) items.
+
+    Emails are grouped into a few `or` search queries per EMAIL_SEARCH_BATCH_SIZE rows instead of one
+    query per row. users is None when the lookup failed.
+    """
+    batch = []
+    for current_row, email in rows:
+        batch.append((current_row, email))
+        if len(batch) >= CONFIG["EMAIL_SEARCH_BATCH_SIZE"]:
+            yield from resolve_email_batch(okta, exclude_values, batch)
+            batch = []
+    if batch:
+        yield from resolve_email_batch(okta, exclude_values, batch)
+
+
+def resolve_email_batch(okta: Okta, exclude_values, batch: list):
+    """Function to look up one batch of email rows"""
+    emails = [email for _, email in batch if email not in exclude_values]
+    users_by_email = {}
+    if emails:
+        try:
+            users_by_email = okta.search_users_by_emails(emails)
+        except Exception as e:
+            LOG.error(f"Error searching for {len(emails)} email(s): {e}")
+            # A plan run lists its failed lookups in the plan instead
+            for email in [] if CONFIG["PLAN_MODE"] else emails:
+                record_lookup_error(email, e)
+            users_by_email = None
+
+    for current_row, email in batch:
+        users = None if users_by_email is None else users_by_email.get(email.casefold(), [])
+        yield current_row, email, users
+
+
+def resolve_plan_rows(plan, fallback, okta: Okta, exclude_values, rows):
+    """Function to look the rows up in a plan, yielding (row number, value, users, optimistic) items.
+
+    The users' states are the ones saved at plan time, so the row handler acts on them optimistically and
+    works out from the response codes whether they were deactivated or deleted since. Rows the plan has no
+    answer for go through the fallback resolver, or are yielded with users None to be looked up by the row
+    handler when there is no fallback.
+    """
+    for current_row, value in rows:
+        users = plan.users_for(value)
+        if users is not None:
+            increment("TOTAL_ROWS_FROM_PLAN")
+            yield current_row, value, users, True
+        elif fallback is not None:
+            yield from fallback(okta, exclude_values, [(current_row, value)])
+        else:
+            yield current_row, value, None
+
+
+def resolve_snapshot_rows(snapshot, kind: str, okta: Okta, exclude_values, rows):
+    """Function to look the rows up in the directory snapshot, yielding (row number, value, users, optimistic) items.
+
+    The snapshot can be out of date by the time a row is handled, so the users are acted on optimistically.
+    """
+    find_users = snapshot.users_for_email if kind == "emails" else snapshot.users_for_id
+    for current_row, value in rows:
+        users = [] if value in exclude_values else find_users(value)
+        yield current_row, value, users, True
+
+
+def process_email_row(okta: Okta, exclude_values, input_stream: InputStream, current_row: int, email: str, users: list, optimistic: bool = False) -> None:
+    """Function to process a single row of the emails CSV file, with the users already looked up"""
+    if email in exclude_values:
+        LOG.info(f"Value: {email} found in exclude list. Skipping.\n")
+        increment("TOTAL_USERS_SKIPPED")
+        row_finished()
+        return
+
+    LOG.info(f"Processing row {current_row}")
+    LOG.info("Current email: " + email)
+
+    try:
+        if users is None:
+            raise RuntimeError("user lookup failed")
+        total_users = len(users)
+        LOG.info(f"Found {total_users} users with email {email}")
+        if total_users == 0:
+            no_users_found(email, users)
+        for index, user in enumerate(users):
+            user_id = user["id"]
             LOG.info(
-                f"[{current_row}/{total_rows}] Progress: ~{percentage_done:.2f}% done\n"
+                f"[{index + 1}/{total_users}] Processing user with ID: {user_id}"
             )
-            CONFIG["TOTAL_ROWS_PROCESSED"] = current_row
+            if user["status"] == "DEPROVISIONED":
+                delete_deprovisioned_user(okta, user_id, optimistic)
+            else:
+                deactivate_and_delete_user(okta, user_id, optimistic)
+        email_users_deleted(email, users)
+    except Exception as e:
+        LOG.error("Error processing email " + email + f": {e}")
+
+    LOG.info(
+        f"[{current_row}] Progress: ~{input_stream.progress() * 100:.2f}% done\n"
+    )
+    row_finished()
+
+
+def process_user(okta: Okta, okta_id: str, user, optimistic: bool = False) -> None:
+    """Function to deactivate and/or delete a looked up user depending on their status"""
+    if user is None:
+        # If the user is already not in Okta, move on.
+        user_not_found(okta_id)
+    # If the user is already deactivated, then move on to deleting them
+    elif user["status"] == "DEPROVISIONED":
+        delete_deprovisioned_user(okta, okta_id, optimistic)
+    else:
+        deactivate_and_delete_user(okta, okta_id, optimistic)
+
+
+def find_users_by_id(okta: Okta, okta_id: str) -> list:
+    """Function to look a user up by Okta ID, returns a list of zero or one user"""
+    user_response = okta.get_user(okta_id)
+    if user_response["status_code"] == 404:
+        return []
+    if user_response["status_code"] == 200:
+        return [user_response["json"]]
+    raise OktaApiError(f"Failed to get user {okta_id}", user_response["status_code"], user_response["json"])
+
+
+def plan_row(okta: Okta, exclude_values, plan_writer: PlanWriter, input_stream: InputStream, kind: str, current_row: int, value: str, users: list = None, _optimistic: bool = False) -> None:
+    """Function to resolve a single row of either CSV file and record what would be done with it, without any writes"""
+    if value in exclude_values:
+        LOG.info(f"Value: {value} found in exclude list. Skipping.\n")
+        increment("TOTAL_USERS_SKIPPED")
+        plan_writer.add(current_row, value, excluded=True)
+        row_finished()
+        return
 
+    try:
+        if users is None and kind == "ids":
+            users = find_users_by_id(okta, value)
+    except Exception as e:
+        LOG.error(f"Error looking up {value}: {e}")
 
-def process_ids_csv() -> None:
-    """Function to process the IDs CSV file"""
-    okta = Okta()
-    total_rows = check_total_rows(INPUT_IDS_CSV_PATH)
-    exclude_values = get_exclude_values()
-    with open(
-        SRC_PATH + INPUT_IDS_CSV_PATH, mode="r", encoding="utf-8-sig"
-    ) as csv_file:
-        csv_reader = csv.reader(csv_file)
-        current_row = 0  # Initialize current row counter
-
-        for row in csv_reader:
-            current_row += 1
-            okta_id = str(row[0])
-
-            if okta_id in exclude_values:
-                LOG.info(f"Value: {okta_id} found in exclude list. Skipping.\n")
-                CONFIG["TOTAL_USERS_SKIPPED"] += 1
-                continue
+    if users is None:
+        increment("PLAN_LOOKUP_ERRORS")
+    elif not users:
+        no_users_found(value, users)
+    for user in users or []:
+        increment("PLAN_USERS_TO_DELETE" if user["status"] == "DEPROVISIONED" else "PLAN_USERS_TO_DEACTIVATE")
+    plan_writer.add(current_row, value, users)
+
+    LOG.info(f"[{current_row}] Progress: ~{input_stream.progress() * 100:.2f}% done\n")
+    row_finished()
+
+
+def process_user_lookup(okta: Okta, okta_id: str) -> None:
+    """Function to look a user up and then deactivate and/or delete them depending on their status"""
+    try:
+        users = find_users_by_id(okta, okta_id)  # Check if the user exists
+    except Exception as err:
+        record_lookup_error(okta_id, err)
+        raise
+    process_user(okta, okta_id, users[0] if users else None)
+
+
+def process_id_row(okta: Okta, exclude_values, input_stream: InputStream, current_row: int, okta_id: str, users: list = None, optimistic: bool = False) -> None:
+    """Function to process a single row of the IDs CSV file"""
+    if okta_id in exclude_values:
+        LOG.info(f"Value: {okta_id} found in exclude list. Skipping.\n")
+        increment("TOTAL_USERS_SKIPPED")
+        row_finished()
+        return
+
+    # Print current row number and Okta ID
+    LOG.info(f"Processing row {current_row}")
+    LOG.info("Current Okta ID: " + okta_id)
+
+    try:
+        if users == []:
+            no_users_found(okta_id, users)
+        elif users is not None:
+            # Already resolved against the directory snapshot or a plan
+            process_user(okta, okta_id, users[0], optimistic)
+        elif CONFIG["OPTIMISTIC_LIFECYCLE"]:
+            # Skip the lookup, the lifecycle responses tell us whether the user exists
+            optimistic_deactivate_and_delete_user(okta, okta_id)
+        else:
+            process_user_lookup(okta, okta_id)
+    except Exception as e:
+        LOG.error("Error processing Okta ID " + okta_id + f": {e}")
 
-            # Calculate the percentage of completion
-            percentage_done = (current_row / total_rows) * 100
+    # The percentage of completion is estimated from how far into the file the reader is
+    LOG.info(f"Progress: ~{input_stream.progress() * 100:.2f}% done\n")
+    row_finished()
 
-            # Print current row number, Okta ID, and percentage done
-            LOG.info(f"Processing row {current_row}/{total_rows}")
-            LOG.info("Current Okta ID: " + okta_id)
 
+def resolve_stage(okta: Okta, exclude_values, kind: str, item: tuple, emit) -> None:
+    """Pipeline stage to look up the users of a row and pass each one on to be deactivated or deleted"""
+    current_row, value, *resolved = item
+    if value in exclude_values:
+        LOG.info(f"Value: {value} found in exclude list. Skipping.\n")
+        increment("TOTAL_USERS_SKIPPED")
+        return
+
+    LOG.info(f"Processing row {current_row}")
+    users = resolved[0] if resolved else None
+    optimistic = len(resolved) > 1 and resolved[1]
+    if users is None:
+        if kind == "emails":
+            raise RuntimeError(f"user lookup failed for {value}")
+        if CONFIG["OPTIMISTIC_LIFECYCLE"]:
+            # Skip the lookup, the lifecycle responses tell us whether the user exists
+            emit((value, True))
+            return
+        try:
+            users = find_users_by_id(okta, value)
+        except Exception as err:
+            record_lookup_error(value, err)
+            raise
+
+    if not users:
+        no_users_found(value, users)
+    for user in users:
+        # Deprovisioned users go straight to the delete stage
+        emit((user["id"], optimistic), stage="delete" if user["status"] == "DEPROVISIONED" else None)
+
+
+def deactivate_stage(okta: Okta, payload: tuple, emit) -> None:
+    """Pipeline stage to deactivate a user and pass them on to be deleted"""
+    user_id, optimistic = payload
+    if deactivate_user(okta, user_id, optimistic):
+        emit(payload)
+
+
+def delete_stage(okta: Okta, payload: tuple, emit) -> None:
+    """Pipeline stage to delete a deactivated user"""
+    user_id, optimistic = payload
+    delete_user(okta, user_id, optimistic)
+
+
+def run_pipeline(rows, okta: Okta, exclude_values, input_stream: InputStream, kind: str, checkpoint: Checkpoint = None) -> None:
+    """Function to run the rows through resolve, deactivate and delete stages that each have their own workers"""
+
+    def finish_row(item: tuple, failed: bool) -> None:
+        current_row, value = item[0], item[1]
+        if value not in exclude_values:
+            LOG.info(f"[{current_row}] Progress: ~{input_stream.progress() * 100:.2f}% done\n")
+            if kind == "emails" and not failed:
+                email_users_deleted(value, item[2])
+        # Excluded rows count as processed, as in the other modes
+        row_finished()
+        if checkpoint is not None:
+            checkpoint.mark_done(current_row, value)
+
+    workers = CONFIG["PIPELINE_WORKERS"]
+    LOG.info(
+        "Processing rows with a pipeline of "
+        + ", ".join(f"{count} {name}" for name, count in workers.items())
+        + " worker(s)"
+    )
+    pipeline = Pipeline(
+        [
+            Stage("resolve", partial(resolve_stage, okta, exclude_values, kind), workers["resolve"]),
+            Stage("deactivate", partial(deactivate_stage, okta), workers["deactivate"]),
+            Stage("delete", partial(delete_stage, okta), workers["delete"]),
+        ],
+        on_done=finish_row,
+    )
+    try:
+        pipeline.run(rows)
+    finally:
+        STATS.set("PIPELINE_STATS", pipeline.stats())
+
+
+async def find_users_async(okta, kind: str, value: str) -> list:
+    """Function to look the users of a row up with the async client"""
+    if kind == "emails":
+        return await okta.find_users_by_email(value)
+    user_response = await okta.get_user(value)
+    if user_response["status_code"] == 404:
+        return []
+    if user_response["status_code"] == 200:
+        return [user_response["json"]]
+    raise OktaApiError(f"Failed to get user {value}", user_response["status_code"], user_response["json"])
+
+
+async def process_row_async(okta, exclude_values, input_stream: InputStream, kind: str, current_row: int, value: str, users: list = None, optimistic: bool = False) -> None:
+    """Function to process a single row of either CSV file on the event loop with the async client"""
+    if value in exclude_values:
+        LOG.info(f"Value: {value} found in exclude list. Skipping.\n")
+        increment("TOTAL_USERS_SKIPPED")
+        row_finished()
+        return
+
+    LOG.info(f"Processing row {current_row}")
+    LOG.info(f"Current value: {value}")
+
+    try:
+        if users is None and kind != "emails" and CONFIG["OPTIMISTIC_LIFECYCLE"]:
+            # Skip the lookup, the lifecycle responses tell us whether the user exists
+            if await deactivate_user_async(okta, value, optimistic=True):
+                await delete_user_async(okta, value, optimistic=True)
+            users = ()
+        elif users is None:
             try:
-                user_response = okta.get_user(okta_id)  # Check if the user exists
-                if user_response["status_code"] == 404:
-                    # If the user is already not in Okta, move on.
-                    LOG.info(f"User {okta_id} not found in Okta")
-                elif user_response["status_code"] == 200:
-                    user = user_response.json
+                users = await find_users_async(okta, kind, value)
+            except Exception as err:
+                await off_loop(record_lookup_error, value, err)
+                raise
+
+        if users == []:
+            await off_loop(no_users_found, value, users)
+        for user in users:
+            # If the user is already deactivated, then move on to deleting them
+            if user["status"] != "DEPROVISIONED" and not await deactivate_user_async(okta, user["id"], optimistic):
+                # The user was deleted since they were resolved
+                continue
+            await delete_user_async(okta, user["id"], optimistic)
+        if kind == "emails":
+            await off_loop(email_users_deleted, value, users)
+    except Exception as e:
+        LOG.error(f"Error processing {value}: {e}")
 
-                    # If the user is already deactivated, then move on to deleting them
-                    if user["status"] == "DEPROVISIONED":
-                        delete_deprovisioned_user(okta, okta_id)
-                    else:
-                        deactivate_and_delete_user(okta, okta_id)
+    LOG.info(f"[{current_row}] Progress: ~{input_stream.progress() * 100:.2f}% done\n")
+    row_finished()
 
-            except Exception as e:
-                LOG.error("Error processing Okta ID " + okta_id + f": {e}")
 
-            LOG.info(f"Progress: ~{percentage_done:.2f}% done\n")
-            CONFIG["TOTAL_ROWS_PROCESSED"] = current_row
+async def run_rows_async(rows, handler, checkpoint: Checkpoint = None, concurrency: int = None) -> None:
+    """Function to run an async row handler over every (row number, value, ...) item with a bounded number in flight"""
+    if concurrency is None:
+        concurrency = CONFIG["ASYNC_CONCURRENCY"]
+    import asyncio  # pylint: disable=C0415
+
+    LOG.info(f"Processing rows with up to {concurrency} requests in flight")
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    errors = []
+
+    async def run(item: tuple) -> None:
+        try:
+            await handler(*item)
+            if checkpoint is not None:
+                await off_loop(checkpoint.mark_done, item[0], item[1])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    # Reading the input (and the result cache lookups of unknown_rows) blocks, so rows are pulled off the loop
+    rows = iter(rows)
+    while True:
+        await slots.acquire()
+        item = await off_loop(next, rows, None)
+        if item is None:
+            slots.release()
+            break
+        task = asyncio.ensure_future(run(item))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    if errors:
+        raise errors[0]
+
+
+async def process_rows_async(rows, okta: Okta, exclude_values, input_stream: InputStream, kind: str, checkpoint: Checkpoint = None) -> None:
+    """Function to process the rows with the async client, sharing the rate limiters of the sync one"""
+    from .utilities.async_okta_util import AsyncOkta
+
+    async_okta = AsyncOkta(rate_limiters=okta.rate_limiters)
+    try:
+        await run_rows_async(
+            rows,
+            partial(process_row_async, async_okta, exclude_values, input_stream, kind),
+            checkpoint,
+        )
+    finally:
+        await async_okta.close()
+        STATS.set("HTTP_LATENCY_STATS", async_okta.latency_stats())
+
+
+def create_shard_coordinator(s3: S3Util = None):
+    """Function to create the coordinator sharing the rate limit between shards, None when the run is not sharded"""
+    if CONFIG["SHARD_COUNT"] <= 1:
+        return None
+    store = S3ShardStore(s3) if s3 is not None else LocalShardStore()
+    coordinator = ShardCoordinator(store, CONFIG["SHARD_INDEX"], CONFIG["SHARD_COUNT"])
+    coordinator.start()
+    LOG.info(
+        f"Running shard {CONFIG['SHARD_INDEX'] + 1} of {CONFIG['SHARD_COUNT']} (by {CONFIG['SHARD_BY']}), "
+        f"{coordinator.active_shards()} shard(s) sharing the rate limit"
+    )
+    return coordinator
+
+
+def create_adaptive_concurrency():
+    """Function to create the controller adapting the requests in flight, None when ADAPTIVE_CONCURRENCY is off"""
+    if not CONFIG["ADAPTIVE_CONCURRENCY"]:
+        return None
+    if CONFIG["ASYNC_CONCURRENCY"] > 0:
+        LOG.warn("ADAPTIVE_CONCURRENCY only applies to the threaded client, ignoring it with ASYNC_CONCURRENCY")
+        return None
+    concurrency = AdaptiveConcurrency(
+        CONFIG["ADAPTIVE_CONCURRENCY_INITIAL"],
+        minimum=CONFIG["ADAPTIVE_CONCURRENCY_MIN"],
+        maximum=CONFIG["ADAPTIVE_CONCURRENCY_MAX"],
+    )
+    LOG.info(
+        f"Adapting concurrency between {concurrency.minimum} and {concurrency.maximum}, starting at {concurrency.limit}"
+    )
+    METRICS.gauge("adaptive_concurrency", lambda: concurrency.limit)
+    return concurrency
+
+
+def process_csv(input_path: str, kind: str, row_handler, parts: list = None, resolve_rows=None, rate_limiters: RateLimiterPool = None) -> None:
+    """Function to stream an input CSV file once and run the row handler over every row"""
+    if parts is None:
+        parts = local_parts(find_input_path(SRC_PATH + input_path))
+    shard = None
+    if CONFIG["SHARD_COUNT"] > 1 and CONFIG["SHARD_BY"] == "part":
+        # Each shard takes every SHARD_COUNT-th input part (S3 shard key or local file)
+        parts = parts[CONFIG["SHARD_INDEX"]::CONFIG["SHARD_COUNT"]]
+    elif CONFIG["SHARD_COUNT"] > 1:
+        shard = (CONFIG["SHARD_INDEX"], CONFIG["SHARD_COUNT"])
+    concurrency = create_adaptive_concurrency()
+    okta = Okta(rate_limiters=rate_limiters, concurrency=concurrency)
+    exclude_values = get_exclude_values()
+    s3 = S3Util() if bool(Env.get("TARGET_S3_BUCKET")) else None
+    plan_mode = CONFIG["PLAN_MODE"]
+    # A plan run only reads, so it must not touch the checkpoint of the run that executes it
+    checkpoint = None if plan_mode else create_checkpoint(input_path, parts)
+    snapshot, plan_writer = None, None
+    if CONFIG["RESULT_CACHE"]:
+        open_result_cache(s3)
+    if CONFIG["EXECUTE_PLAN"] and not plan_mode:
+        # The plan run already resolved the rows, only the ones it could not resolve are looked up again
+        plan = load_plan(input_path, s3)
+        fallback = None if CONFIG["ASYNC_CONCURRENCY"] > 0 else resolve_rows
+        resolve_rows = partial(resolve_plan_rows, plan, fallback)
+    elif CONFIG["SNAPSHOT_MODE"]:
+        # One listing of the directory replaces the per-row lookups
+        snapshot = build_snapshot(okta)
+        STATS.set("SNAPSHOT_USERS", len(snapshot))
+        resolve_rows = partial(resolve_snapshot_rows, snapshot, kind)
+    elif CONFIG["ASYNC_CONCURRENCY"] > 0 and not plan_mode:
+        # The async handler looks rows up itself, a batch search here would block the event loop
+        resolve_rows = None
+    # Invalid and duplicate rows are finished as soon as they are read
+    input_stream = InputStream(parts, kind, on_skip=None if checkpoint is None else checkpoint.mark_done, shard=shard)
+    try:
+        rows = pending_rows(input_stream, checkpoint)
+        if CONFIG["RESULT_CACHE"] and not plan_mode:
+            # A plan lists every row, so it still looks up the ones an earlier run found gone
+            rows = unknown_rows(rows, checkpoint)
+        if resolve_rows is not None:
+            rows = resolve_rows(okta, exclude_values, rows)
+        if plan_mode:
+            plan_writer = PlanWriter(input_path, s3)
+            run_rows(rows, partial(plan_row, okta, exclude_values, plan_writer, input_stream, kind))
+            plan_writer.commit()
+        elif CONFIG["ASYNC_CONCURRENCY"] > 0:
+            import asyncio  # pylint: disable=C0415
+
+            asyncio.run(process_rows_async(rows, okta, exclude_values, input_stream, kind, checkpoint))
+        elif CONFIG["PIPELINE"]:
+            run_pipeline(rows, okta, exclude_values, input_stream, kind, checkpoint)
+        else:
+            run_rows(
+                rows,
+                partial(row_handler, okta, exclude_values, input_stream),
+                checkpoint,
+            )
+        if not plan_mode:
+            # Transient failures are retried once every row had its first try
+            retry_failed_users(okta, kind)
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
+        if snapshot is not None:
+            snapshot.close()
+        if plan_writer is not None:
+            plan_writer.close()
+        close_result_cache(s3)
+        # Only this shard's rows are counted, so the shard reports add up to the whole input
+        total_rows = input_stream.total_rows - input_stream.other_shard_rows
+        STATS.set("TOTAL_ROWS", total_rows)
+        LOG.info(f"Total rows in input CSV: {total_rows}")
+
+    if checkpoint is not None:
+        # Every row was processed, so a later input with the same name must start from the first row
+        checkpoint.complete()
+    STATS.set("RATE_LIMIT_STATS", okta.rate_limit_stats())
+    if concurrency is not None:
+        METRICS.remove_gauge("adaptive_concurrency")
+        STATS.set("ADAPTIVE_CONCURRENCY_STATS", [concurrency.stats()])
+    STATS.set("LATENCY_STATS", latency_percentiles())
+    if CONFIG["ASYNC_CONCURRENCY"] == 0:
+        STATS.set("HTTP_LATENCY_STATS", okta.http.latency_stats())
+    okta.http.close()
+
+
+def latency_percentiles() -> list:
+    """Function to get the p50/p95/p99 Okta latency of every endpoint family and status code"""
+    return [
+        {
+            "endpoint": histogram["labels"]["endpoint"],
+            "status": histogram["labels"]["status"],
+            "count": histogram["count"],
+            "p50": histogram["p50"],
+            "p95": histogram["p95"],
+            "p99": histogram["p99"],
+        }
+        for histogram in sorted(METRICS.snapshot()["histograms"], key=lambda item: sorted(item["labels"].items()))
+        if histogram["name"] == "okta_request_seconds"
+    ]
+
+
+def process_emails_csv(parts: list = None, rate_limiters: RateLimiterPool = None) -> None:
+    """Function to process the emails CSV file"""
+    process_csv(INPUT_EMAILS_CSV_PATH, "emails", process_email_row, parts, resolve_email_rows, rate_limiters)
+
+
+def process_ids_csv(parts: list = None, rate_limiters: RateLimiterPool = None) -> None:
+    """Function to process the IDs CSV file"""
+    process_csv(INPUT_IDS_CSV_PATH, "ids", process_id_row, parts, rate_limiters=rate_limiters)
 
 
 # Main function to process the CSV and delete users
@@ -241,24 +965,45 @@ def main():
     s3_enabled = bool(Env.get("TARGET_S3_BUCKET"))
 
     # If S3 is enabled check for a input csv file and download it
+    check_type, parts, s3 = None, None, None
     if s3_enabled:
         s3 = S3Util()
-        download_data_files(s3)
+        if CONFIG["S3_STREAM_INPUT"]:
+            # Only the exclude list is downloaded, the input is streamed straight out of S3
+            download_exclude_file(s3)
+            check_type, parts = find_s3_input(s3)
+        else:
+            download_data_files(s3)
 
     # Check file exists
-    check_type = check_for_file()
+    if parts is None:
+        check_type = check_for_file()
     if check_type is None:
         return
 
-    if check_type == "emails":
-        process_emails_csv()
+    coordinator = create_shard_coordinator(s3)
+    rate_limiters = None
+    if coordinator is not None:
+        rate_limiters = RateLimiterPool(pool_minimum=int(OKTA_RATE_LIMIT_POOL_MINIMUM), shares=coordinator.active_shards)
+
+    exporter = MetricsExporter(s3=s3 if METRICS_S3_SECONDS > 0 else None).start()
+    try:
+        if check_type == "emails":
+            process_emails_csv(parts, rate_limiters)
 
-    if check_type == "ids":
-        process_ids_csv()
+        if check_type == "ids":
+            process_ids_csv(parts, rate_limiters)
+    finally:
+        exporter.stop()
 
     reporting.finish()
     reporting.generate()
 
+    if coordinator is not None:
+        reports = coordinator.finish(reporting.export())
+        if reports is not None:
+            reporting.generate_combined(reports)
+
     # If S3 is enabled, upload the log file
     if s3_enabled:
         upload_logs_to_s3(s3, CONFIG["LOG_FILE_PATH"])
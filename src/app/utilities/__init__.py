@@ -1,11 +1,38 @@
-"""Utilities package for common functions and classes used across the application."""
+"""Utilities package for common functions and classes used across the application.
 
-from src.app.utilities.config_util import CONFIG
-from src.app.utilities.env_util import Env
-from src.app.utilities.error_util import *
-from src.app.utilities.logging_util import Logger
-from src.app.utilities.okta_util import Okta
-from src.app.utilities.reporting_util import ReportingUtil
-from src.app.utilities.s3_util import S3Util
+Modules only some runs need (boto3, sqlite3, asyncio, http.server) are imported inside the
+function that first uses them, marked `# pylint: disable=C0415`, so a plain sequential run
+does not pay for importing them at startup.
+"""
+
+import importlib
 
 NAME = "utilities"
+
+# Names re-exported from the submodules, imported on first access so importing one utility
+# does not load all of them (and boto3 with them)
+EXPORTS = {
+    "CONFIG": "config_util",
+    "Env": "env_util",
+    "OktaApiError": "error_util",
+    "FailureSink": "error_util",
+    "FAILURES": "error_util",
+    "record_failed_attempt": "error_util",
+    "record_recovered_attempt": "error_util",
+    "flush_failed_attempts": "error_util",
+    "take_failed_attempts": "error_util",
+    "Logger": "logging_util",
+    "Okta": "okta_util",
+    "ReportingUtil": "reporting_util",
+    "S3Util": "s3_util",
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{EXPORTS[name]}"), name)
+    globals()[name] = value
+    return value
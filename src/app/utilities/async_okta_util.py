@@ -0,0 +1,296 @@
+"""Module to interact with Okta API from an asyncio event loop"""
+
+import asyncio
+import json
+import time
+from urllib.parse import quote
+import aiohttp
+from src.app.utilities.http_util import (
+    HTTP_BACKOFF_SECONDS,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_READ_TIMEOUT,
+    backoff,
+    is_retryable_request,
+)
+from src.app.utilities.okta_util import (
+    DEACTIVATE_USER_BUCKET,
+    DELETE_USER_BUCKET,
+    GET_USER_BUCKET,
+    OKTA_API_TOKEN,
+    OKTA_BASE_URL,
+    OKTA_DOMAIN,
+    OKTA_MAX_RATE_LIMIT_RETRIES,
+    OKTA_PAGE_LIMIT,
+    OKTA_RATE_LIMIT_POOL_MINIMUM,
+    SEARCH_USERS_BUCKET,
+    _escape,
+    email_filters,
+)
+from src.app.utilities.rate_limit_util import RateLimiterPool
+from src.app.utilities.logging_util import Logger
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.stats_util import increment
+from src.app.utilities.error_util import OktaApiError
+from src.app.utilities.metrics_util import METRICS
+
+ASYNC_POOL_SIZE = int(Env.get("ASYNC_POOL_SIZE", max(10, CONFIG["ASYNC_CONCURRENCY"])))
+# How long a partly filled batch of email lookups waits for more rows before it is searched anyway
+ASYNC_EMAIL_BATCH_LINGER_SECONDS = 0.01
+
+LOG = Logger("async_okta_util.py")
+
+
+class AsyncOkta:
+    """Class to interact with Okta API with coroutines over one pooled aiohttp session.
+
+    It exposes the same calls and return values as `Okta`, awaited instead of called. Many
+    requests can be in flight on a single event loop, without a thread per request. Rate
+    limits are paced with the same RateLimiterPool, waiting with `asyncio.sleep`.
+    """
+
+    def __init__(
+        self,
+        rate_limiters: RateLimiterPool = None,
+        base_url: str = None,
+        pool_size: int = ASYNC_POOL_SIZE,
+        max_retries: int = HTTP_MAX_RETRIES,
+        backoff_seconds: float = HTTP_BACKOFF_SECONDS,
+    ):
+        self.base_url = base_url or OKTA_BASE_URL or f"https://{OKTA_DOMAIN}/api/v1"
+        self.headers = {
+            "Authorization": "SSWS " + OKTA_API_TOKEN,
+            "Content-Type": "application/json",
+        }
+        if rate_limiters is None:
+            rate_limiters = RateLimiterPool(pool_minimum=int(OKTA_RATE_LIMIT_POOL_MINIMUM))
+        self.rate_limiters = rate_limiters
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.session = None
+        self.email_batcher = None
+        self.request_count = 0
+        self.retry_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def _session(self) -> aiohttp.ClientSession:
+        # The session has to be created inside the running event loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+            )
+        return self.session
+
+    async def _api(self, url: str, method: str, data=None, bucket: str = GET_USER_BUCKET):
+        rate_limiter = self.rate_limiters.get(bucket)
+        rate_limit_retries, server_retries = 0, 0
+        while True:
+            await rate_limiter.acquire_async()
+            started = time.monotonic()
+            try:
+                status_code, headers, body, next_url = await self._request(url, method, data)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                increment("TOTAL_OKTA_API_CALLS")
+                if not is_retryable_request(method) or server_retries >= self.max_retries:
+                    raise err
+            else:
+                latency = time.monotonic() - started
+                increment("WORK_TIME", latency)
+                increment("TOTAL_OKTA_API_CALLS")
+                METRICS.observe("okta_request_seconds", latency, endpoint=bucket, status=status_code)
+                METRICS.mark("okta_requests")
+                rate_limiter.update(headers)
+                if status_code == 429:
+                    if rate_limiter.seconds_until_reset() <= 0 or rate_limit_retries >= OKTA_MAX_RATE_LIMIT_RETRIES:
+                        break
+                    # The limiter is marked as used up, so the next acquire waits for the reset
+                    rate_limit_retries += 1
+                    rate_limiter.exhaust()
+                    LOG.warn(f"Rate limit reached, waiting for {rate_limiter.seconds_until_reset():.0f} second(s)")
+                    continue
+                if not is_retryable_request(method, status_code) or server_retries >= self.max_retries:
+                    break
+
+            # Server errors and connection errors of lookups are retried with backoff, through the rate limiter
+            server_retries += 1
+            self.retry_count += 1
+            METRICS.inc("http_retries_total")
+            await asyncio.sleep(backoff(server_retries, self.backoff_seconds))
+        return {"status_code": status_code, "json": body, "next": next_url}
+
+    async def _request(self, url: str, method: str, data=None):
+        """Function to send one request, returns its status code, headers, body and next page URL"""
+        started = time.monotonic()
+        try:
+            async with self._session().request(method, url, json=data) as response:
+                content = await response.read()
+                latency = time.monotonic() - started
+                self._record_latency(latency)
+                if LOG.is_enabled("HTTP"):
+                    LOG.http(f"{method.upper()} - {url} - {response.status} ({latency * 1000:.0f}ms)")
+                next_url = response.links.get("next", {}).get("url")
+                return (
+                    response.status,
+                    response.headers,
+                    _json(content),
+                    None if next_url is None else str(next_url),
+                )
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+            self._record_latency(time.monotonic() - started)
+            LOG.warn(f"{method.upper()} - {url} - connection error: {err}")
+            raise err
+
+    def _record_latency(self, latency: float) -> None:
+        # Only ever called from the event loop thread, so no lock is needed
+        self.request_count += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    async def _paginate(self, endpoint: str, bucket: str):
+        """Function to follow the Link: rel=next headers and collect every page of a list endpoint"""
+        response = await self._api(endpoint, "GET", bucket=bucket)
+        if response["status_code"] != 200:
+            return response
+
+        items = list(response["json"] or [])
+        while response["next"]:
+            response = await self._api(response["next"], "GET", bucket=bucket)
+            if response["status_code"] != 200:
+                raise OktaApiError(f"Failed to fetch the next page of {endpoint}", response["status_code"], response["json"])
+            items.extend(response["json"] or [])
+        return {"status_code": 200, "json": items, "next": None}
+
+    async def search_users(self, field: str, value: str):
+        """Function to search users"""
+        return await self._search(f'{field} eq "{_escape(value)}"')
+
+    async def search_users_by_emails(self, emails: list) -> dict:
+        """Function to look up many emails with as few search calls as possible, returns users keyed by lowercase email"""
+        users_by_email = {email.casefold(): [] for email in emails}
+        for expression in email_filters(self.base_url, emails):
+            response = await self._search(expression)
+            if response["status_code"] == 404:
+                continue
+            if response["status_code"] != 200:
+                raise OktaApiError("Failed to search users by email", response["status_code"], response["json"])
+            for user in response["json"]:
+                email = str(user.get("profile", {}).get("email", "")).casefold()
+                if email in users_by_email:
+                    users_by_email[email].append(user)
+        return users_by_email
+
+    async def find_users_by_email(self, email: str) -> list:
+        """Function to look up the users of one email, batched with the lookups of the other rows in flight"""
+        if self.email_batcher is None:
+            self.email_batcher = EmailSearchBatcher(self, CONFIG["EMAIL_SEARCH_BATCH_SIZE"])
+        return await self.email_batcher.lookup(email)
+
+    async def _search(self, expression: str):
+        endpoint = f"{self.base_url}/users?limit={OKTA_PAGE_LIMIT}&filter={quote(expression)}"
+        return await self._paginate(endpoint, SEARCH_USERS_BUCKET)
+
+    async def get_user(self, okta_id):
+        """Function to get user details"""
+        return await self._api(f"{self.base_url}/users/{okta_id}", "GET", bucket=GET_USER_BUCKET)
+
+    async def deactivate_user(self, okta_id):
+        """Function to deactivate user"""
+        endpoint = f"{self.base_url}/users/{okta_id}/lifecycle/deactivate"
+        response = await self._api(endpoint, "POST", bucket=DEACTIVATE_USER_BUCKET)
+        if response["status_code"] != 200:
+            raise OktaApiError(f"Failed to deactivate user {okta_id}", response["status_code"], response["json"])
+        return True
+
+    async def delete_user(self, okta_id):
+        """Function to delete user"""
+        response = await self._api(f"{self.base_url}/users/{okta_id}", "DELETE", bucket=DELETE_USER_BUCKET)
+        if response["status_code"] != 204:
+            raise OktaApiError(f"Failed to delete user {okta_id}", response["status_code"], response["json"])
+        return True
+
+    def rate_limit_stats(self) -> list:
+        """Function to get the rate limit state of every endpoint family used so far"""
+        return self.rate_limiters.stats()
+
+    def latency_stats(self) -> dict:
+        """Function to get the request count, retry count and latency totals"""
+        return {
+            "request_count": self.request_count,
+            "retry_count": self.retry_count,
+            "total_latency": self.total_latency,
+            "average_latency": self.total_latency / self.request_count if self.request_count else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+    async def close(self) -> None:
+        """Function to close the pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class EmailSearchBatcher:
+    """Class to answer the email lookups of the rows in flight on the event loop with batched searches.
+
+    Rows await `lookup` one email at a time. Waiting emails are searched together with
+    `search_users_by_emails` once batch_size of them are waiting, or after linger_seconds when
+    fewer rows are in flight, so async runs keep the few `or` searches per batch of the
+    threaded mode.
+    """
+
+    def __init__(self, okta: AsyncOkta, batch_size: int, linger_seconds: float = ASYNC_EMAIL_BATCH_LINGER_SECONDS):
+        self.okta = okta
+        self.batch_size = max(1, batch_size)
+        self.linger_seconds = linger_seconds
+        self.pending = []
+        self.timer = None
+        self.searches = set()
+
+    async def lookup(self, email: str) -> list:
+        """Function to wait for the users of an email"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((email, future))
+        if len(self.pending) >= self.batch_size:
+            self._send()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger_seconds, self._send)
+        return await future
+
+    def _send(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            search = asyncio.ensure_future(self._search(batch))
+            self.searches.add(search)
+            search.add_done_callback(self.searches.discard)
+
+    async def _search(self, batch: list) -> None:
+        try:
+            users = await self.okta.search_users_by_emails([email for email, _ in batch])
+        except Exception as e:
+            # Every row of a failed batch fails with the search's error
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for email, future in batch:
+            if not future.done():
+                future.set_result(users[email.casefold()])
+
+
+def _json(content: bytes):
+    """Function to decode a response body, 204 responses and error pages have no JSON body"""
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode("utf-8", errors="replace")
@@ -0,0 +1,167 @@
+"""Module to checkpoint run progress so interrupted runs can resume"""
+
+import json
+import os
+import threading
+import time
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.logging_util import Logger
+
+CHECKPOINT_EVERY_ROWS = int(Env.get("CHECKPOINT_EVERY_ROWS", 1000))
+CHECKPOINT_EVERY_SECONDS = float(Env.get("CHECKPOINT_EVERY_SECONDS", 30))
+
+
+class Checkpoint:
+    """Class to track which input rows are finished and persist that progress in batches.
+
+    Progress is stored as an offset (every row up to and including it is finished) plus the
+    rows, and their IDs, finished beyond the offset. Workers finish rows out of order, so only
+    that small out-of-order set is kept instead of every completed ID.
+    The input's fingerprint is saved with it, so a later file with the same name is not skipped,
+    and `complete` removes the checkpoint once the input is fully processed.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        s3=None,
+        flush_rows: int = CHECKPOINT_EVERY_ROWS,
+        flush_seconds: float = CHECKPOINT_EVERY_SECONDS,
+        before_write=None,
+        fingerprint: str = None,
+    ):
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        self.input_path = input_path
+        self.fingerprint = fingerprint
+        self.path = f"data/checkpoints/{name}{CONFIG['SHARD_SUFFIX']}.checkpoint.json"
+        self.local_path = CONFIG["SRC_PATH"] + self.path
+        self.s3 = s3
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.before_write = before_write
+        self.log = Logger("checkpoint_util.py")
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.sequence = 0
+        self.written_sequence = 0
+        self.offset = 0
+        self.done_rows = {}
+        self.unflushed_rows = 0
+        self.last_flush = time.monotonic()
+
+    def load(self) -> bool:
+        """Function to load a previous checkpoint from disk, or from S3 when it is not on disk"""
+        data = None
+        if os.path.exists(self.local_path):
+            with open(self.local_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        elif self.s3 is not None:
+            try:
+                data = json.loads(self.s3.get_object(self.path))
+            except Exception as e:
+                self.log.warn(f"No checkpoint found in S3 for {self.path}: {e}")
+
+        if data is None:
+            self.log.info(f"No checkpoint found for {self.input_path}, starting from the first row")
+            return False
+
+        if data.get("input_path") != self.input_path:
+            self.log.warn(
+                f"Checkpoint {self.path} was written for {data.get('input_path')}, not {self.input_path}. Ignoring it."
+            )
+            return False
+
+        if data.get("fingerprint") != self.fingerprint:
+            self.log.warn(f"Checkpoint {self.path} was written for a different version of {self.input_path}. Ignoring it.")
+            return False
+
+        self.offset = int(data["offset"])
+        self.done_rows = {int(row): value for row, value in data.get("completed", {}).items()}
+        self.log.info(
+            f"Resuming {self.input_path} after row {self.offset} ({len(self.done_rows)} later row(s) already finished)"
+        )
+        return True
+
+    def should_skip(self, row_number: int) -> bool:
+        """Function to check if a row was finished by a previous run"""
+        return row_number <= self.offset or row_number in self.done_rows
+
+    def mark_done(self, row_number: int, value: str) -> None:
+        """Function to mark a row as finished, flushing the checkpoint when a batch threshold is reached"""
+        with self.lock:
+            if row_number <= self.offset:
+                return
+            self.done_rows[row_number] = value
+            while self.offset + 1 in self.done_rows:
+                self.offset += 1
+                del self.done_rows[self.offset]
+            self.unflushed_rows += 1
+            should_flush = (
+                self.unflushed_rows >= self.flush_rows
+                or time.monotonic() - self.last_flush >= self.flush_seconds
+            )
+            if not should_flush:
+                return
+            data = self._snapshot()
+
+        self._write(data)
+
+    def flush(self) -> None:
+        """Function to write the checkpoint now"""
+        with self.lock:
+            data = self._snapshot()
+        self._write(data)
+
+    def complete(self) -> None:
+        """Function to remove the checkpoint once the whole input is processed, so the next run starts over"""
+        with self.write_lock:
+            # Nothing written after this point may bring it back
+            self.written_sequence = float("inf")
+            if os.path.exists(self.local_path):
+                os.remove(self.local_path)
+            if self.s3 is not None:
+                try:
+                    self.s3.delete_object(self.path)
+                except Exception as e:
+                    self.log.error(f"Failed to delete checkpoint {self.path} from S3: {e}")
+        self.log.info(f"Finished {self.input_path}, removed checkpoint {self.path}")
+
+    def _snapshot(self) -> dict:
+        """Function to capture the checkpoint state, must be called while holding the lock"""
+        self.unflushed_rows = 0
+        self.last_flush = time.monotonic()
+        self.sequence += 1
+        return {
+            "sequence": self.sequence,
+            "input_path": self.input_path,
+            "fingerprint": self.fingerprint,
+            "offset": self.offset,
+            "completed": {str(row): value for row, value in self.done_rows.items()},
+            "updated_at": int(time.time()),
+        }
+
+    def _write(self, data: dict) -> None:
+        if self.before_write is not None:
+            # e.g. flush buffered failures first, so a resumed run never skips rows whose failures were lost
+            self.before_write()
+
+        with self.write_lock:
+            # Another worker may already have written a newer snapshot
+            if data["sequence"] <= self.written_sequence:
+                return
+            self.written_sequence = data["sequence"]
+
+            body = json.dumps(data)
+            os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+            # Write then rename so a crash mid-write never leaves a truncated checkpoint behind
+            temp_path = f"{self.local_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(body)
+            os.replace(temp_path, self.local_path)
+
+            if self.s3 is not None:
+                try:
+                    self.s3.put_object(self.path, body)
+                except Exception as e:
+                    self.log.error(f"Failed to upload checkpoint {self.path} to S3: {e}")
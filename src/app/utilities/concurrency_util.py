@@ -0,0 +1,128 @@
+"""Module to adapt the number of Okta requests in flight to how the tenant is responding"""
+
+import threading
+from collections import deque
+from src.app.utilities.env_util import Env
+from src.app.utilities.logging_util import Logger
+
+# A round's p95 latency this many times the baseline counts as the tenant slowing down
+ADAPTIVE_LATENCY_TOLERANCE = float(Env.get("ADAPTIVE_LATENCY_TOLERANCE", 2.0))
+# Only add requests while at least this fraction of the rate limit window is left
+ADAPTIVE_MIN_HEADROOM = float(Env.get("ADAPTIVE_MIN_HEADROOM", 0.2))
+ADAPTIVE_DECREASE_FACTOR = 0.5
+ADAPTIVE_HISTORY_ROUNDS = 10
+
+LOG = Logger("concurrency_util.py")
+
+
+class AdaptiveConcurrency:
+    """Class to limit the requests in flight with an AIMD (additive increase, multiplicative decrease) controller.
+
+    Callers wrap each request in `acquire`/`release` and report how it went with `record`
+    before releasing it.
+    Results are collected in rounds of `limit` requests. A round that was fast and left rate
+    limit headroom raises the limit by one. A 429, or a round whose p95 latency rose past
+    ADAPTIVE_LATENCY_TOLERANCE times the baseline, halves it at once. Requests that were
+    already in flight when the limit dropped are not counted again, so one burst of 429s
+    only backs off once.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.ignore = 0
+        self.latencies = []
+        self.low_headroom = False
+        self.baseline = None
+        self.increases = 0
+        self.decreases = 0
+        self.lowest = self.limit
+        self.highest = self.limit
+        self.history = deque(maxlen=ADAPTIVE_HISTORY_ROUNDS)
+
+    def acquire(self) -> None:
+        """Function to wait until another request may be sent"""
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """Function to give back the slot of a finished request"""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def record(self, latency: float, status_code: int, headroom: float = None) -> None:
+        """Function to feed back a finished request: its latency, status code and the fraction of the rate limit left"""
+        with self.condition:
+            if self.ignore > 0:
+                # Sent before the last decrease, so it says nothing about the new limit
+                self.ignore -= 1
+                return
+            if status_code == 429:
+                self._decrease("rate limited")
+                return
+            self.latencies.append(latency)
+            if headroom is not None and headroom < ADAPTIVE_MIN_HEADROOM:
+                self.low_headroom = True
+            if len(self.latencies) >= self.limit:
+                self._finish_round()
+
+    def _finish_round(self) -> None:
+        """Function to act on a full round of results, must be called while holding the lock"""
+        latencies = sorted(self.latencies)
+        low_headroom = self.low_headroom
+        self.latencies = []
+        self.low_headroom = False
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        if self.baseline is not None and p95 > self.baseline * ADAPTIVE_LATENCY_TOLERANCE:
+            self._decrease(f"p95 latency rose to {p95 * 1000:.0f}ms")
+            return
+
+        # Follow the fastest rounds straight away and slower ones only slowly
+        self.baseline = p95 if self.baseline is None or p95 < self.baseline else self.baseline * 0.95 + p95 * 0.05
+        self.history.append(self.limit)
+        if not low_headroom and self.limit < self.maximum:
+            self.limit += 1
+            self.increases += 1
+            self.highest = max(self.highest, self.limit)
+            self.condition.notify()
+
+    def _decrease(self, reason: str) -> None:
+        """Function to cut the limit, must be called while holding the lock"""
+        limit = max(self.minimum, int(self.limit * ADAPTIVE_DECREASE_FACTOR))
+        # Everything in flight except the request being recorded
+        self.ignore = max(0, self.in_flight - 1)
+        self.latencies = []
+        self.low_headroom = False
+        self.history.append(limit)
+        if limit == self.limit:
+            return
+        LOG.info(f"Lowering concurrency from {self.limit} to {limit}: {reason}")
+        self.limit = limit
+        self.decreases += 1
+        self.lowest = min(self.lowest, limit)
+
+    def settled(self) -> float:
+        """Function to get the average limit over the last rounds, the concurrency the run settled on"""
+        with self.condition:
+            history = list(self.history) or [self.limit]
+        return sum(history) / len(history)
+
+    def stats(self) -> dict:
+        """Function to get the current, settled, lowest and highest limit and how often it changed"""
+        settled = self.settled()
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "settled": settled,
+                "lowest": self.lowest,
+                "highest": self.highest,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "baseline_p95": self.baseline,
+            }
@@ -9,6 +9,13 @@ import src as src_dir
 FILENAME_TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
 ENVIRONMENT = Env.get("ENVIRONMENT", "test")
 SRC_PATH = src_dir.__path__[0] + "/"
+SHARD_INDEX = int(Env.get("SHARD_INDEX", 0))
+SHARD_COUNT = max(1, int(Env.get("SHARD_COUNT", 1)))
+# Where the adaptive concurrency controller starts in each environment. Update these from the
+# "settled" concurrency in the reports of earlier runs
+ADAPTIVE_CONCURRENCY_DEFAULTS = {"dev": 2, "stage": 4, "prod": 4, "test": 2}
+# Shards of one job write their logs, failures and checkpoints to their own files
+SHARD_SUFFIX = f"-shard-{SHARD_INDEX}-of-{SHARD_COUNT}" if SHARD_COUNT > 1 else ""
 
 CONFIG = {
     "SRC_PATH": SRC_PATH,
@@ -16,9 +23,40 @@ CONFIG = {
     "INPUT_IDS_CSV_PATH": "data/input/okta_ids/test_ids.csv",
     "INPUT_EMAILS_CSV_PATH": "data/input/okta_emails/test_emails.csv",
     "INPUT_EXCLUDE_VALUES_CSV_PATH": "data/input/test_exclude.csv",
-    "LOG_FILE_PATH": f"data/logs/logs_{Env.get('ENVIRONMENT')}_{FILENAME_TIMESTAMP}.txt",
-    "FAILED_FIRST_CALL_CSV_PATH": f"data/output/failed_first_call/{Env.get('ENVIRONMENT')}-failed_to_deactivate-{FILENAME_TIMESTAMP}.csv",
-    "FAILED_SECOND_CALL_CSV_PATH": f"data/output/failed_second_call/{Env.get('ENVIRONMENT')}-failed_to_delete-{FILENAME_TIMESTAMP}.csv",
+    "LOG_FILE_PATH": f"data/logs/logs_{Env.get('ENVIRONMENT')}_{FILENAME_TIMESTAMP}{SHARD_SUFFIX}.txt",
+    "FAILED_FIRST_CALL_CSV_PATH": f"data/output/failed_first_call/{Env.get('ENVIRONMENT')}-failed_to_deactivate-{FILENAME_TIMESTAMP}{SHARD_SUFFIX}.csv",
+    "FAILED_SECOND_CALL_CSV_PATH": f"data/output/failed_second_call/{Env.get('ENVIRONMENT')}-failed_to_delete-{FILENAME_TIMESTAMP}{SHARD_SUFFIX}.csv",
+    "SHARD_INDEX": SHARD_INDEX,
+    "SHARD_COUNT": SHARD_COUNT,
+    "SHARD_BY": str(Env.get("SHARD_BY", "row")).lower(),
+    "SHARD_SUFFIX": SHARD_SUFFIX,
+    "CONCURRENCY": max(1, int(Env.get("CONCURRENCY", 1))),
+    "RESUME": bool(Env.get("RESUME")),
+    "S3_STREAM_INPUT": bool(Env.get("S3_STREAM_INPUT")),
+    "OPTIMISTIC_LIFECYCLE": bool(Env.get("OPTIMISTIC_LIFECYCLE")),
+    "ASYNC_CONCURRENCY": max(0, int(Env.get("ASYNC_CONCURRENCY", 0))),
+    "PIPELINE": bool(Env.get("PIPELINE")),
+    "ADAPTIVE_CONCURRENCY": bool(Env.get("ADAPTIVE_CONCURRENCY")),
+    "ADAPTIVE_CONCURRENCY_INITIAL": int(Env.get("ADAPTIVE_CONCURRENCY_INITIAL", ADAPTIVE_CONCURRENCY_DEFAULTS.get(ENVIRONMENT, 2))),
+    "ADAPTIVE_CONCURRENCY_MIN": max(1, int(Env.get("ADAPTIVE_CONCURRENCY_MIN", 1))),
+    "SNAPSHOT_MODE": bool(Env.get("SNAPSHOT_MODE")),
+    "PLAN_MODE": bool(Env.get("PLAN_MODE")),
+    "EXECUTE_PLAN": bool(Env.get("EXECUTE_PLAN")),
+    "RESULT_CACHE": bool(Env.get("RESULT_CACHE")),
+    "FAILURE_RETRY_ATTEMPTS": max(0, int(Env.get("FAILURE_RETRY_ATTEMPTS", 2))),
+    "FAILURE_RETRY_BACKOFF_SECONDS": max(0.0, float(Env.get("FAILURE_RETRY_BACKOFF_SECONDS", 5))),
+    "EMAIL_SEARCH_BATCH_SIZE": max(1, int(Env.get("EMAIL_SEARCH_BATCH_SIZE", 50))),
+}
+
+if CONFIG["ADAPTIVE_CONCURRENCY"]:
+    # The workers are sized for the most requests the controller may allow, it holds them back below that
+    CONFIG["ADAPTIVE_CONCURRENCY_MAX"] = max(1, int(Env.get("ADAPTIVE_CONCURRENCY_MAX", max(32, CONFIG["CONCURRENCY"]))))
+    CONFIG["CONCURRENCY"] = max(CONFIG["CONCURRENCY"], CONFIG["ADAPTIVE_CONCURRENCY_MAX"])
+
+# Each pipeline stage calls its own rate limit bucket, so each gets its own workers
+CONFIG["PIPELINE_WORKERS"] = {
+    stage: max(1, int(Env.get(f"PIPELINE_{stage.upper()}_WORKERS", CONFIG["CONCURRENCY"])))
+    for stage in ("resolve", "deactivate", "delete")
 }
 
 if ENVIRONMENT == "dev":
@@ -33,3 +71,4 @@ elif ENVIRONMENT == "prod":
     CONFIG["INPUT_IDS_CSV_PATH"] = "data/input/okta_ids/prod_ids.csv"
     CONFIG["INPUT_EMAILS_CSV_PATH"] = "data/input/okta_emails/prod_emails.csv"
     CONFIG["INPUT_EXCLUDE_VALUES_CSV_PATH"] = "data/input/prod_exclude.csv"
+
@@ -1,19 +1,137 @@
+"""Module to record failed attempts"""
+
+import atexit
 import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
 from src.app.utilities.s3_util import S3Util
 from src.app.utilities.env_util import Env
 from src.app.utilities.config_util import CONFIG
 
-s3 = S3Util()
+FAILURE_FLUSH_SIZE = int(Env.get("FAILURE_FLUSH_SIZE", 100))
+FAILURE_FLUSH_SECONDS = float(Env.get("FAILURE_FLUSH_SECONDS", 30))
+FAILURE_ERROR_MAX_LENGTH = 1000
+FAILURE_HEADER = ["okta_id", "stage", "status_code", "error", "attempts", "timestamp"]
+# Stage of the row written when the retry pass recovers an earlier failure
+RECOVERED_STAGE = "recovered"
+
+
+class OktaApiError(Exception):
+    """Exception raised when an Okta API call returns an unexpected status code"""
+
+    def __init__(self, message: str, status_code: int = None, body=None):
+        super().__init__(f"{message} (status code: {status_code})")
+        self.status_code = status_code
+        self.body = body
+
+
+class FailureSink:
+    """Class to buffer failed attempts in memory and flush them to the CSV files in batches.
+
+    Buffered rows are appended to the local CSV files, and each changed file is uploaded to S3
+    once per flush, when FAILURE_FLUSH_SIZE failures are buffered or FAILURE_FLUSH_SECONDS have
+    passed since the last flush. Call `flush` at shutdown to write whatever is left.
+    The latest failure of every Okta ID is also kept until `take_failed` hands it to the retry pass,
+    and a `recovered` row follows the failures of an Okta ID the retry pass got through.
+    """
+
+    def __init__(self, s3_util: S3Util = None, flush_size: int = FAILURE_FLUSH_SIZE, flush_seconds: float = FAILURE_FLUSH_SECONDS):
+        self.s3 = s3_util
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.buffers = {}
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.failed = {}
+
+    def record(self, okta_id: str, path: str, stage: str = None, status_code: int = None, error: str = None, attempts: int = 1) -> None:
+        """Function to buffer a failed attempt, flushing when a threshold is reached"""
+        self._buffer(okta_id, path, stage, status_code, error, attempts)
+
+    def record_recovered(self, okta_id: str, path: str, attempts: int) -> None:
+        """Function to buffer a row saying the retry pass got through an earlier failure, which is not retried again"""
+        self._buffer(okta_id, path, RECOVERED_STAGE, None, None, attempts)
+
+    def _buffer(self, okta_id: str, path: str, stage: str, status_code: int, error: str, attempts: int) -> None:
+        row = [
+            okta_id,
+            stage or "",
+            "" if status_code is None else status_code,
+            (error or "")[:FAILURE_ERROR_MAX_LENGTH],
+            attempts,
+            datetime.now().isoformat(timespec="seconds"),
+        ]
+        with self.lock:
+            self.buffers.setdefault(path, []).append(row)
+            self.buffered += 1
+            if stage != RECOVERED_STAGE:
+                self.failed[okta_id] = (stage, status_code, attempts)
+            should_flush = (
+                self.buffered >= self.flush_size
+                or time.monotonic() - self.last_flush >= self.flush_seconds
+            )
+        if should_flush:
+            self.flush()
 
+    def take_failed(self) -> dict:
+        """Function to get and forget the failures recorded so far, as {okta_id: (stage, status code, attempts)}"""
+        with self.lock:
+            failed, self.failed = self.failed, {}
+        return failed
 
-def record_failed_attempt(okta_id: str, path: str) -> None:
+    def flush(self) -> None:
+        """Function to write all buffered failures to disk and upload the changed files to S3"""
+        with self.flush_lock:
+            with self.lock:
+                buffers, self.buffers = self.buffers, {}
+                self.buffered = 0
+                self.last_flush = time.monotonic()
+
+            for path, rows in buffers.items():
+                local_path = CONFIG["SRC_PATH"] + path
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                is_new = not os.path.exists(local_path)
+                with open(local_path, "a", newline="", encoding="utf-8-sig") as file:
+                    writer = csv.writer(file)
+                    if is_new:
+                        writer.writerow(FAILURE_HEADER)
+                    writer.writerows(rows)
+
+                if self.s3 is not None:
+                    with open(local_path, "rb") as data:
+                        self.s3.upload_fileobj(path, data)
+
+
+FAILURES = FailureSink(S3Util() if bool(Env.get("TARGET_S3_BUCKET")) else None)
+atexit.register(FAILURES.flush)
+
+
+def record_failed_attempt(okta_id: str, path: str, stage: str = None, error: Exception = None, attempts: int = 1) -> None:
     """Function to record failed attempts into a CSV file"""
-    s3_enabled = bool(Env.get("TARGET_S3_BUCKET"))
+    status_code = getattr(error, "status_code", None)
+    body = getattr(error, "body", None)
+    if body is not None:
+        message = body if isinstance(body, str) else json.dumps(body)
+    else:
+        message = str(error) if error is not None else None
+    FAILURES.record(okta_id, path, stage, status_code, message, attempts)
+
+
+def record_recovered_attempt(okta_id: str, path: str, attempts: int) -> None:
+    """Function to record into a failed CSV file that a retry of its failed attempts succeeded"""
+    FAILURES.record_recovered(okta_id, path, attempts)
+
+
+def flush_failed_attempts() -> None:
+    """Function to write any buffered failed attempts to the CSV files"""
+    FAILURES.flush()
 
-    with open(CONFIG["SRC_PATH"] + path, "a", newline="", encoding="utf-8-sig") as file:
-        writer = csv.writer(file)
-        writer.writerow([okta_id])
 
-    if s3_enabled:
-        with open(f"{CONFIG['SRC_PATH']}{path}", "rb") as data:
-            s3.upload_fileobj(path, data)
+def take_failed_attempts() -> dict:
+    """Function to get and forget the failed attempts recorded so far, for the retry pass"""
+    return FAILURES.take_failed()
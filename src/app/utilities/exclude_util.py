@@ -0,0 +1,131 @@
+"""Module to match input values against the exclude list"""
+
+import csv
+import fnmatch
+import hashlib
+import json
+import os
+import re
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.logging_util import Logger
+
+EXCLUDE_CASE_INSENSITIVE = bool(Env.get("EXCLUDE_CASE_INSENSITIVE"))
+EXCLUDE_INDEX_CACHE = bool(Env.get("EXCLUDE_INDEX_CACHE"))
+EXCLUDE_INDEX_CACHE_PATH = "data/cache/"
+
+LOG = Logger("exclude_util.py")
+
+
+def _has_wildcard(value: str) -> bool:
+    return "*" in value or "?" in value or "[" in value
+
+
+class ExcludeIndex:
+    """Class to look up exclude list entries in constant time.
+
+    Plain values go into a hashed set. Entries with wildcards are compiled once: `*@domain`
+    entries into a set of domains, `prefix*` entries into a tuple for `str.startswith`, and
+    anything else into a single combined regex.
+    """
+
+    def __init__(self, values=(), case_insensitive: bool = EXCLUDE_CASE_INSENSITIVE):
+        self.case_insensitive = case_insensitive
+        self.exact = set()
+        self.domains = set()
+        self.globs = []
+        self.pattern = None
+        prefixes = []
+        for value in values:
+            key = self._key(value.strip())
+            if not key:
+                continue
+            if not _has_wildcard(key):
+                self.exact.add(key)
+            elif key.startswith("*@") and not _has_wildcard(key[2:]):
+                self.domains.add(key[2:])
+            elif key.endswith("*") and not _has_wildcard(key[:-1]):
+                prefixes.append(key[:-1])
+            else:
+                self.globs.append(key)
+        self.prefixes = tuple(prefixes)
+        self._compile()
+
+    def __contains__(self, value: str) -> bool:
+        key = self._key(value)
+        if key in self.exact:
+            return True
+        if self.domains:
+            at = key.rfind("@")
+            if at != -1 and key[at + 1:] in self.domains:
+                return True
+        if self.prefixes and key.startswith(self.prefixes):
+            return True
+        return self.pattern is not None and self.pattern.match(key) is not None
+
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.domains) + len(self.prefixes) + len(self.globs)
+
+    def _key(self, value: str) -> str:
+        # Only emails are folded, Okta IDs are case sensitive
+        if self.case_insensitive and "@" in value:
+            return value.casefold()
+        return value
+
+    def _compile(self) -> None:
+        if self.globs:
+            self.pattern = re.compile("|".join(fnmatch.translate(glob) for glob in self.globs))
+
+    def to_dict(self) -> dict:
+        """Function to serialize the index for the on-disk cache"""
+        return {
+            "case_insensitive": self.case_insensitive,
+            "exact": list(self.exact),
+            "domains": list(self.domains),
+            "prefixes": list(self.prefixes),
+            "globs": self.globs,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExcludeIndex":
+        """Function to rebuild an index from the on-disk cache without reclassifying every entry"""
+        index = cls(case_insensitive=data["case_insensitive"])
+        index.exact = set(data["exact"])
+        index.domains = set(data["domains"])
+        index.prefixes = tuple(data["prefixes"])
+        index.globs = list(data["globs"])
+        index._compile()
+        return index
+
+    @classmethod
+    def from_csv(cls, path: str, case_insensitive: bool = EXCLUDE_CASE_INSENSITIVE, use_cache: bool = EXCLUDE_INDEX_CACHE) -> "ExcludeIndex":
+        """Function to build the index from the first column of a CSV file, reusing the disk cache when the file is unchanged"""
+        if use_cache:
+            stat = os.stat(path)
+            fingerprint = [stat.st_size, stat.st_mtime_ns]
+            cache_path = CONFIG["SRC_PATH"] + exclude_index_cache_name(path)
+            if os.path.exists(cache_path):
+                try:
+                    with open(cache_path, "r", encoding="utf-8") as file:
+                        cached = json.load(file)
+                    if cached["fingerprint"] == fingerprint and cached["index"]["case_insensitive"] == case_insensitive:
+                        LOG.info(f"Loaded exclude index from cache: {cache_path}")
+                        return cls.from_dict(cached["index"])
+                except (ValueError, KeyError) as e:
+                    LOG.warn(f"Ignoring unreadable exclude index cache: {e}")
+
+        with open(path, mode="r", encoding="utf-8-sig") as csv_file:
+            index = cls((row[0] for row in csv.reader(csv_file) if row), case_insensitive)
+
+        if use_cache:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as file:
+                json.dump({"fingerprint": fingerprint, "index": index.to_dict()}, file)
+
+        return index
+
+
+def exclude_index_cache_name(path: str) -> str:
+    """Function to get the cache file of an exclude list, one per input path"""
+    key = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return f"{EXCLUDE_INDEX_CACHE_PATH}exclude_index-{key}.json"
@@ -1,15 +1,56 @@
 """Module to interact with HTTP API"""
 
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from src.app.utilities.logging_util import Logger
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.metrics_util import METRICS
+
+HTTP_POOL_SIZE = int(
+    Env.get(
+        "HTTP_POOL_SIZE",
+        max(10, sum(CONFIG["PIPELINE_WORKERS"].values()) if CONFIG["PIPELINE"] else CONFIG["CONCURRENCY"]),
+    )
+)
+HTTP_CONNECT_TIMEOUT = float(Env.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(Env.get("HTTP_READ_TIMEOUT", 10))
+HTTP_MAX_RETRIES = int(Env.get("HTTP_MAX_RETRIES", 3))
+# Only these are retried after a 5xx or a connection error: Okta may have applied a lifecycle call or a
+# delete before failing to answer, and sending it again would then fail with 403 or 404
+HTTP_RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+HTTP_BACKOFF_SECONDS = float(Env.get("HTTP_BACKOFF_SECONDS", 0.5))
+HTTP_BACKOFF_MAX_SECONDS = float(Env.get("HTTP_BACKOFF_MAX_SECONDS", 30))
+
+LOG = Logger("Http Util")
+
+
+def is_retryable_request(method: str, status_code: int = None) -> bool:
+    """Function to check if a request that got a 5xx (or, with no status code, a connection error) can be sent again"""
+    return method.upper() in HTTP_RETRY_METHODS and (status_code is None or status_code >= 500)
+
+
+def backoff(attempt: int, backoff_seconds: float = HTTP_BACKOFF_SECONDS) -> float:
+    """Function to get an exponential backoff with full jitter for the given retry attempt"""
+    ceiling = min(HTTP_BACKOFF_MAX_SECONDS, backoff_seconds * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
 
 
 class HttpUtil:
-    """Class to interact with HTTP API"""
+    """Class to interact with HTTP API over a pooled keep-alive session.
+
+    Every call is a single request. Retries are up to the caller, so each attempt goes through
+    its rate limiting and is counted; `record_retry` adds them to the stats.
+    """
 
     def __init__(
         self,
         headers=None,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
     ):
         if headers is None:
             headers = {
@@ -17,23 +58,74 @@ class HttpUtil:
             }
 
         self.headers = headers
+        self.timeout = timeout
+
+        # One session keeps TCP/TLS connections alive between requests; the adapter pool
+        # needs to be at least as large as the number of concurrent workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers)
+
+        self.stats_lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
 
     def api(self, url: str, method: str, data=None):
         """Function to interact with API"""
         return self._api(url, method, data)
 
     def _api(self, url: str, method: str, data=None):
-        response = requests.request(
-            method,
-            url,
-            headers=self.headers,
-            json=data,
-            timeout=10,
-        )
+        started = time.monotonic()
+        try:
+            response = self.session.request(
+                method,
+                url,
+                json=data,
+                timeout=self.timeout,
+            )
+        except requests.exceptions.ConnectionError as err:
+            self._record_latency(time.monotonic() - started)
+            METRICS.inc("http_connection_errors_total")
+            LOG.warn(f"{method.upper()} - {url} - connection error: {err}")
+            raise err
+        latency = time.monotonic() - started
+        self._record_latency(latency)
+        response.latency = latency
+        METRICS.observe("http_request_seconds", latency, method=method.upper(), status=response.status_code)
+        if LOG.is_enabled("HTTP"):
+            LOG.http(f"{method.upper()} - {url} - {response.status_code} ({latency * 1000:.0f}ms)")
+        return response
 
-        Logger("Http Util").http(f"{method.upper()} - {url} - {response.status_code}")
+    def record_retry(self) -> None:
+        """Function to count a request the caller is about to send again"""
+        with self.stats_lock:
+            self.retry_count += 1
+        METRICS.inc("http_retries_total")
+
+    def _record_latency(self, latency: float) -> None:
+        with self.stats_lock:
+            self.request_count += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def latency_stats(self) -> dict:
+        """Function to get the request count, retry count and latency totals"""
+        with self.stats_lock:
+            return {
+                "request_count": self.request_count,
+                "retry_count": self.retry_count,
+                "total_latency": self.total_latency,
+                "average_latency": self.total_latency / self.request_count if self.request_count else 0.0,
+                "max_latency": self.max_latency,
+            }
 
-        return response
+    def close(self) -> None:
+        """Function to close the pooled connections"""
+        self.session.close()
 
     def get(self, endpoint: str):
         """Function to get data from API"""
@@ -0,0 +1,244 @@
+"""Module to stream rows out of the input CSV files"""
+
+import csv
+import gzip
+import hashlib
+import io
+import os
+import queue
+import re
+import threading
+from src.app.utilities.env_util import Env
+from src.app.utilities.stats_util import increment
+from src.app.utilities.logging_util import Logger
+from src.app.utilities.shard_util import shard_of
+
+OKTA_ID_PATTERN = re.compile(r"^[A-Za-z0-9]+$")
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+$")
+S3_PREFETCH_CHUNK_BYTES = int(Env.get("S3_PREFETCH_CHUNK_BYTES", 1024 * 1024))
+S3_PREFETCH_CHUNKS = int(Env.get("S3_PREFETCH_CHUNKS", 8))
+FINGERPRINT_HEAD_BYTES = 64 * 1024
+
+LOG = Logger("ingest_util.py")
+
+
+def find_input_path(path: str):
+    """Function to find an input file on disk, also accepting a gzip-compressed copy or a directory of shards"""
+    for candidate in (path, f"{path}.gz", shard_prefix(path)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def shard_prefix(path: str) -> str:
+    """Function to get the directory/key prefix holding the shards of a split input, e.g. data/input/okta_ids/prod_ids/"""
+    return f"{path[:-len('.csv')] if path.endswith('.csv') else path}/"
+
+
+class LocalPart:
+    """Class to open an input file on disk"""
+
+    def __init__(self, path: str):
+        self.name = path
+        self.size = os.path.getsize(path)
+
+    def open(self):
+        """Function to open the file for binary reading"""
+        return open(self.name, "rb")
+
+    def fingerprint(self) -> str:
+        """Function to identify the file's content by its name, size, modification time and a hash of its first bytes"""
+        with open(self.name, "rb") as file:
+            head = hashlib.sha256(file.read(FINGERPRINT_HEAD_BYTES)).hexdigest()
+        return f"{os.path.basename(self.name)}:{self.size}:{os.stat(self.name).st_mtime_ns}:{head}"
+
+
+class S3Part:
+    """Class to stream an input object out of S3 without staging it on disk"""
+
+    def __init__(self, s3, key: str, size: int, version: str = None):
+        self.s3 = s3
+        self.name = key
+        self.size = size
+        self.version = version
+
+    def open(self):
+        """Function to open the object for binary reading while it downloads in the background"""
+        body, _ = self.s3.open_object(self.name)
+        return PrefetchReader(body)
+
+    def fingerprint(self) -> str:
+        """Function to identify the object by its name, size and version (ETag and last modified time), without downloading any of it"""
+        return f"{os.path.basename(self.name)}:{self.size}:{self.version}"
+
+
+def local_parts(path: str) -> list:
+    """Function to get the input parts of a local input file or directory of shards"""
+    if os.path.isdir(path):
+        return [LocalPart(os.path.join(path, name)) for name in sorted(os.listdir(path)) if not name.startswith(".")]
+    return [LocalPart(path)]
+
+
+def input_fingerprint(parts: list) -> str:
+    """Function to get a fingerprint of the input parts, so progress saved for one input is never applied to another"""
+    return hashlib.sha256("\n".join(part.fingerprint() for part in parts).encode()).hexdigest()
+
+
+def s3_parts(s3, key: str) -> list:
+    """Function to get the input parts of an S3 input: the object itself, its .gz copy or the shards under its prefix"""
+    for candidate in (key, f"{key}.gz"):
+        info = s3.object_info(candidate)
+        if info is not None:
+            return [S3Part(s3, candidate, *info)]
+    return [S3Part(s3, shard_key, size, version) for shard_key, size, version in s3.list_object_versions(shard_prefix(key))]
+
+
+class PrefetchReader(io.RawIOBase):
+    """Class to read a streaming body on a background thread.
+
+    Chunks are downloaded ahead into a bounded queue, so the download keeps running while rows
+    are being processed, without ever holding more than a few chunks in memory.
+    """
+
+    def __init__(self, body, chunk_size: int = S3_PREFETCH_CHUNK_BYTES, max_chunks: int = S3_PREFETCH_CHUNKS):
+        super().__init__()
+        self.body = body
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.buffer = b""
+        self.offset = 0
+        self.finished = False
+        self.error = None
+        self.thread = threading.Thread(target=self._download, daemon=True)
+        self.thread.start()
+
+    def _download(self) -> None:
+        try:
+            while True:
+                chunk = self.body.read(self.chunk_size)
+                if not self._put(chunk) or not chunk:
+                    return
+        except Exception as e:
+            self.error = e
+            self._put(b"")
+
+    def _put(self, chunk: bytes) -> bool:
+        # Give up once the reader is closed, otherwise a full queue would block this thread forever
+        while not self.closed:
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.offset >= len(self.buffer) and not self.finished:
+            self.buffer = self.chunks.get()
+            self.offset = 0
+            if not self.buffer:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+        size = min(len(buffer), len(self.buffer) - self.offset)
+        buffer[:size] = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self) -> None:
+        self.body.close()
+        super().close()
+
+
+class CountingReader(io.RawIOBase):
+    """Class to count the compressed bytes read from an input part, used to estimate progress"""
+
+    def __init__(self, raw_file):
+        super().__init__()
+        self.raw_file = raw_file
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = self.raw_file.readinto(buffer)
+        self.count += size or 0
+        return size
+
+
+class InputStream:
+    """Class to read the input CSV file(s) in a single pass.
+
+    Rows are validated and de-duplicated as they are read, so bad or repeated values never cost
+    an API call. Progress is estimated from the bytes read against the total input size instead
+    of counting the rows up front. Parts ending in `.gz` are decompressed on the fly, and split
+    inputs are read shard after shard with one continuous row numbering. With `shard` set to
+    (index, count), only the values hashing to that shard are yielded, so several processes
+    can split one input; the same value always lands in the same shard.
+    """
+
+    def __init__(self, parts: list, kind: str = "ids", on_skip=None, shard: tuple = None):
+        self.parts = parts
+        self.kind = kind
+        self.on_skip = on_skip
+        self.shard = shard
+        self.other_shard_rows = 0
+        self.pattern = EMAIL_PATTERN if kind == "emails" else OKTA_ID_PATTERN
+        self.size = max(1, sum(part.size for part in parts))
+        self.finished_bytes = 0
+        self.reader = None
+        self.total_rows = 0
+
+    def __iter__(self):
+        """Function to yield (row number, value) for every valid, first-seen value"""
+        seen = set()
+        row_number = 0
+        for part in self.parts:
+            LOG.info(f"Reading input: {part.name}")
+            with part.open() as raw_file:
+                self.reader = CountingReader(raw_file)
+                binary_file = io.BufferedReader(self.reader)
+                if part.name.endswith(".gz"):
+                    binary_file = gzip.GzipFile(fileobj=binary_file)
+                text_file = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+                for row in csv.reader(text_file):
+                    row_number += 1
+                    self.total_rows = row_number
+                    value = row[0].strip() if row else ""
+                    key = value.casefold() if self.kind == "emails" else value
+
+                    if self.shard is not None and shard_of(key, self.shard[1]) != self.shard[0]:
+                        self.other_shard_rows += 1
+                        self._skip(row_number, value)
+                        continue
+
+                    if not self.pattern.match(value):
+                        LOG.warn(f"Row {row_number}: skipping invalid value {value!r}")
+                        increment("TOTAL_ROWS_INVALID")
+                        self._skip(row_number, value)
+                        continue
+
+                    if key in seen:
+                        LOG.info(f"Row {row_number}: skipping duplicate value {value}")
+                        increment("TOTAL_ROWS_DUPLICATE")
+                        self._skip(row_number, value)
+                        continue
+                    seen.add(key)
+
+                    yield row_number, value
+            self.finished_bytes += part.size
+            self.reader = None
+
+    def progress(self) -> float:
+        """Function to estimate the fraction of the input read so far"""
+        reader = self.reader
+        position = self.finished_bytes + (reader.count if reader is not None else 0)
+        return min(1.0, position / self.size)
+
+    def _skip(self, row_number: int, value: str) -> None:
+        if self.on_skip is not None:
+            self.on_skip(row_number, value)
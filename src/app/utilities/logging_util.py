@@ -1,10 +1,175 @@
 """Module to log messages to console"""
 
+import atexit
+import json
+import os
+import queue
 import re
+import sys
+import threading
+import time
 from datetime import datetime
 from src.app.utilities.env_util import Env
 from src.app.utilities.config_util import CONFIG
 
+LEVELS = {"DEBUG": 10, "HTTP": 15, "INFO": 20, "WARN": 30, "ERROR": 40}
+LOG_LEVEL = LEVELS.get(str(Env.get("LOG_LEVEL", "DEBUG")).upper(), LEVELS["DEBUG"])
+LOG_FORMAT = str(Env.get("LOG_FORMAT", "text")).lower()
+LOG_BATCH_SIZE = 1000
+# Longest a flush waits for the writer thread before writing the rest itself
+LOG_FLUSH_TIMEOUT_SECONDS = 10
+
+LEVEL_PREFIXES = {"DEBUG": "[DEBUG] ", "HTTP": "[HTTP] ", "INFO": "", "WARN": "[WARN] ", "ERROR": "[ERROR] "}
+LEVEL_COLORS = {"DEBUG": None, "HTTP": "green", "INFO": "cyan", "WARN": "yellow", "ERROR": "red"}
+COLORS = {
+    "black": "\033[30m",
+    "red": "\033[31m",
+    "green": "\033[32m",
+    "yellow": "\033[33m",
+    "blue": "\033[34m",
+    "magenta": "\033[35m",
+    "cyan": "\033[36m",
+    "white": "\033[37m",
+    "orange": "\033[91m",
+    "reset": "\033[0m",
+}
+COLOR_PATTERN = re.compile(r"\033\[[0-9;]*m")
+
+
+class LogWriter:
+    """Class to write log records to the console and log file from a background thread.
+
+    Callers only put a record on a queue. The writer thread keeps the log file open, formats
+    records in batches and writes each batch with a single call, so logging stays off the hot path.
+    """
+
+    def __init__(self, log_file_path: str, json_format: bool = False, colors_enabled: bool = False):
+        self.log_file_path = log_file_path
+        self.json_format = json_format
+        self.colors_enabled = colors_enabled
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, timestamp: float, name: str, level: str, message: str) -> None:
+        """Function to queue a log record"""
+        if self.thread is None:
+            self._start()
+        self.queue.put((timestamp, name, level, message))
+
+    def flush(self) -> None:
+        """Function to wait until every record queued so far has been written.
+
+        If the writer thread died or does not catch up within LOG_FLUSH_TIMEOUT_SECONDS, the
+        records still queued are written synchronously, so an exit flush can never hang.
+        """
+        if self.thread is None:
+            return
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(done)
+            if done.wait(LOG_FLUSH_TIMEOUT_SECONDS):
+                return
+            sys.stderr.write("Log writer did not catch up, writing the remaining records directly\n")
+        self._write_remaining()
+
+    def _write_remaining(self) -> None:
+        records = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(record, threading.Event):
+                record.set()
+            else:
+                records.append(record)
+        if not records:
+            return
+        console_lines, file_lines = self._format(records)
+        sys.stdout.write(console_lines)
+        sys.stdout.flush()
+        file = self._open()
+        if file is not None:
+            with file:
+                file.write(file_lines)
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)
+            return open(self.log_file_path, "a", encoding="utf-8-sig")
+        except OSError as e:
+            sys.stderr.write(f"Unable to open log file {self.log_file_path}: {e}\n")
+            return None
+
+    def _run(self) -> None:
+        file = self._open()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [record for record in batch if not isinstance(record, threading.Event)]
+            if records:
+                console_lines, file_lines = self._format(records)
+                sys.stdout.write(console_lines)
+                sys.stdout.flush()
+                if file is not None:
+                    file.write(file_lines)
+                    file.flush()
+
+            for record in batch:
+                if isinstance(record, threading.Event):
+                    record.set()
+
+    def _format(self, records: list):
+        console_lines = []
+        file_lines = []
+        for timestamp, name, level, message in records:
+            if self.json_format:
+                line = json.dumps(
+                    {
+                        "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+                        "level": level,
+                        "logger": name,
+                        "message": COLOR_PATTERN.sub("", message),
+                    }
+                )
+                console_lines.append(f"{line}\n")
+                file_lines.append(f"{line}\n")
+                continue
+
+            header = f"[{datetime.fromtimestamp(timestamp)} - ({name})]: {LEVEL_PREFIXES[level]}"
+            # strip any coloring from the message before writing it to the log file
+            plain = COLOR_PATTERN.sub("", message) if "\033" in message else message
+            console_lines.append(f"{header}{self._colorize(message, LEVEL_COLORS[level])}\n\n")
+            file_lines.append(f"{header}{plain}\n")
+        return "".join(console_lines), "".join(file_lines)
+
+    def _colorize(self, text: str, color_name: str) -> str:
+        """Function to colorize text for console output"""
+
+        if self.colors_enabled is not True or color_name not in COLORS:
+            return text
+        return f"{COLORS[color_name]}{text}{COLORS['reset']}"
+
+
+WRITER = LogWriter(
+    CONFIG["SRC_PATH"] + CONFIG["LOG_FILE_PATH"],
+    json_format=LOG_FORMAT == "json",
+    colors_enabled=bool(Env.get("ENABLE_LOGGING_COLORS")),
+)
+atexit.register(WRITER.flush)
+
 
 class Logger:
     """Class to log messages to console"""
@@ -14,73 +179,45 @@ class Logger:
         name: str = "logging_util.py",
     ):
         self.name = name
-        self.logging_colors_enabled = bool(Env.get("ENABLE_LOGGING_COLORS"))
         self.logging_disabled = bool(Env.get("DISABLE_LOGGER"))
-        self.log_file_path = CONFIG["SRC_PATH"] + CONFIG["LOG_FILE_PATH"]
+        self.level = LOG_LEVEL
+        self.log_file_path = WRITER.log_file_path
 
     def info(self, message: str) -> None:
         """Function to log info messages"""
 
-        if self.logging_disabled:
-            return None
-        self._print(f"{self._colorize(message, 'cyan')}")
+        self._print("INFO", message)
 
     def debug(self, message: str) -> None:
         """Function to log debug messages"""
 
-        if self.logging_disabled:
-            return None
-        self._print(f"[DEBUG] {message}")
+        self._print("DEBUG", message)
 
     def warn(self, message: str) -> None:
         """Function to log warning messages"""
 
-        if self.logging_disabled:
-            return None
-        self._print(f"[WARN] {self._colorize(message, 'yellow')}")
+        self._print("WARN", message)
 
     def error(self, message: str) -> None:
         """Function to log error messages"""
 
-        if self.logging_disabled:
-            return None
-        self._print(f"[ERROR] {self._colorize(message, 'red')}")
+        self._print("ERROR", message)
 
     def http(self, message: str) -> None:
         """Function to log http messages"""
 
-        if self.logging_disabled:
-            return None
-        self._print(f"[HTTP] {self._colorize(message, 'green')}")
-
-    def _print(self, message: str) -> None:
-        print(f"[{datetime.now()} - ({self.name})]: {message}\n")
-        # strip any coloring from the message before printing to the console
-        log_message = re.sub(r"\033\[[0-9;]*m", "", message)
-        with open(self.log_file_path, "a", encoding="utf-8-sig") as file:
-            file.write(f"[{datetime.now()} - ({self.name})]: {log_message}\n")
+        self._print("HTTP", message)
 
-    def _colorize(self, text: str, color_name: str) -> str:
-        """Function to colorize text for console output"""
+    def is_enabled(self, level: str) -> bool:
+        """Function to check if messages of a level would be logged, to skip building expensive messages"""
+        return not self.logging_disabled and LEVELS[level] >= self.level
 
-        logging_colors_enabled = self.logging_colors_enabled
-        if logging_colors_enabled is not True:
-            return text
+    def _print(self, level: str, message) -> None:
+        if self.logging_disabled or LEVELS[level] < self.level:
+            return None
+        WRITER.write(time.time(), self.name, level, str(message))
 
-        colors = {
-            "black": "\033[30m",
-            "red": "\033[31m",
-            "green": "\033[32m",
-            "yellow": "\033[33m",
-            "blue": "\033[34m",
-            "magenta": "\033[35m",
-            "cyan": "\033[36m",
-            "white": "\033[37m",
-            "orange": "\033[91m",
-            "reset": "\033[0m",
-        }
-        return (
-            f"{colors[color_name]}{text}{colors['reset']}"
-            if color_name in colors
-            else text
-        )
+    @staticmethod
+    def flush() -> None:
+        """Function to wait until every queued message has been written"""
+        WRITER.flush()
@@ -0,0 +1,299 @@
+"""Module to record live run metrics and expose them in the Prometheus text format"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.logging_util import Logger
+
+METRICS_PORT = int(Env.get("METRICS_PORT", 0))
+METRICS_HOST = Env.get("METRICS_HOST", "127.0.0.1")
+METRICS_FILE = Env.get("METRICS_FILE")
+METRICS_INTERVAL_SECONDS = float(Env.get("METRICS_INTERVAL_SECONDS", 15))
+METRICS_S3_SECONDS = float(Env.get("METRICS_S3_SECONDS", 60))
+METRICS_WINDOWS = (60, 300)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+LOG = Logger("metrics_util.py")
+
+
+class Histogram:
+    """Class to count observations into fixed buckets and estimate quantiles from them"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Function to add an observation, must be called while holding the registry lock"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Function to estimate a quantile by interpolating inside its bucket, like Prometheus' histogram_quantile"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class SlidingWindow:
+    """Class to count events per second over the last `window_seconds`"""
+
+    def __init__(self, window_seconds: int, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.slots = [0.0] * window_seconds
+        self.seconds = [0] * window_seconds
+        self.started = clock()
+
+    def add(self, amount: float = 1) -> None:
+        """Function to add events at the current second, must be called while holding the registry lock"""
+        second = int(self.clock())
+        slot = second % self.window_seconds
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.slots[slot] = 0.0
+        self.slots[slot] += amount
+
+    def rate(self) -> float:
+        """Function to get the average events per second over the window"""
+        now = self.clock()
+        second = int(now)
+        total = sum(
+            amount
+            for amount, slot_second in zip(self.slots, self.seconds)
+            if second - slot_second < self.window_seconds
+        )
+        return total / max(1.0, min(self.window_seconds, now - self.started))
+
+
+class MetricsRegistry:
+    """Class to hold the run's counters, latency histograms, sliding rates and gauges.
+
+    Everything is keyed by a metric name plus labels, e.g. the endpoint family and status code
+    of a request. Recording is a dict lookup and a few additions under one lock, so it is cheap
+    enough for the request path. `render` formats everything in the Prometheus text format.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.windows = {}
+        self.gauges = {}
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Function to add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Function to record a latency (or any value) in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def mark(self, name: str, amount: float = 1) -> None:
+        """Function to count events for a total and for the sliding per-second rates"""
+        with self.lock:
+            self.counters[(name, ())] = self.counters.get((name, ()), 0) + amount
+            windows = self.windows.get(name)
+            if windows is None:
+                windows = self.windows[name] = [SlidingWindow(seconds, self.clock) for seconds in METRICS_WINDOWS]
+            for window in windows:
+                window.add(amount)
+
+    def gauge(self, name: str, read, **labels) -> None:
+        """Function to register a callable read whenever the metrics are rendered, e.g. a queue depth"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def remove_gauge(self, name: str, **labels) -> None:
+        """Function to stop reporting a gauge"""
+        with self.lock:
+            self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def reset(self) -> None:
+        """Function to clear every metric"""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.windows.clear()
+            self.gauges.clear()
+
+    def snapshot(self) -> dict:
+        """Function to get the current value of every metric as plain data"""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "buckets": list(zip(histogram.buckets, histogram.counts)),
+                }
+                for (name, labels), histogram in self.histograms.items()
+            ]
+            rates = [
+                {"name": name, "window_seconds": window.window_seconds, "per_second": window.rate()}
+                for name, windows in self.windows.items()
+                for window in windows
+            ]
+            gauges = list(self.gauges.items())
+
+        values = []
+        for (name, labels), read in gauges:
+            try:
+                values.append({"name": name, "labels": dict(labels), "value": read()})
+            except Exception as e:
+                LOG.warn(f"Failed to read gauge {name}: {e}")
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms, "rates": rates, "gauges": values}
+
+    def render(self) -> str:
+        """Function to format the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for counter in sorted(snapshot["counters"], key=lambda item: item["name"]):
+            lines.append(f"okta_deletion_{counter['name']}{_labels(counter['labels'])} {counter['value']}")
+        for histogram in sorted(snapshot["histograms"], key=lambda item: item["name"]):
+            name = f"okta_deletion_{histogram['name']}"
+            cumulative = 0
+            for bound, count in histogram["buckets"]:
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(histogram['labels'], le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(histogram['labels'], le='+Inf')} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels(histogram['labels'])} {histogram['count']}")
+            for quantile in ("p50", "p95", "p99"):
+                lines.append(f"{name}_{quantile}{_labels(histogram['labels'])} {histogram[quantile]}")
+        for rate in snapshot["rates"]:
+            window = f"{rate['window_seconds']}s"
+            lines.append(f"okta_deletion_{rate['name']}_per_second{_labels({'window': window})} {rate['per_second']}")
+        for gauge in snapshot["gauges"]:
+            lines.append(f"okta_deletion_{gauge['name']}{_labels(gauge['labels'])} {gauge['value']}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in items.items()) + "}"
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Class to expose the metrics while a run is going.
+
+    Serves them on http://METRICS_HOST:METRICS_PORT/metrics when METRICS_PORT is set, rewrites
+    METRICS_FILE every METRICS_INTERVAL_SECONDS when it is set (e.g. for the node_exporter
+    textfile collector), and uploads a JSON snapshot to S3 every METRICS_S3_SECONDS when an
+    S3Util is given.
+    """
+
+    def __init__(self, registry: MetricsRegistry = METRICS, s3=None, port: int = METRICS_PORT, path: str = METRICS_FILE):
+        self.registry = registry
+        self.s3 = s3
+        self.port = port
+        self.path = path
+        self.s3_key = f"data/metrics/metrics_{CONFIG['FILENAME_TIMESTAMP']}{CONFIG.get('SHARD_SUFFIX', '')}.json"
+        self.server = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_upload = time.monotonic()
+
+    def start(self) -> "MetricsExporter":
+        """Function to start serving and writing the metrics in the background"""
+        if self.port:
+            from http.server import ThreadingHTTPServer  # pylint: disable=C0415
+
+            self.server = ThreadingHTTPServer((METRICS_HOST, self.port), _handler(self.registry))
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+            LOG.info(f"Serving metrics on http://{METRICS_HOST}:{self.server.server_address[1]}/metrics")
+        if self.path or self.s3 is not None:
+            self.thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Function to write the final metrics and stop the background work"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.export(final=True)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def export(self, final: bool = False) -> None:
+        """Function to write the metrics file and, when due, the S3 snapshot"""
+        try:
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    file.write(self.registry.render())
+                os.replace(temp_path, self.path)
+            if self.s3 is not None and (final or time.monotonic() - self.last_upload >= METRICS_S3_SECONDS):
+                self.last_upload = time.monotonic()
+                self.s3.put_object(self.s3_key, json.dumps(self.registry.snapshot()))
+        except Exception as e:
+            LOG.warn(f"Failed to export metrics: {e}")
+
+    def _run(self) -> None:
+        while not self.stopped.wait(METRICS_INTERVAL_SECONDS):
+            self.export()
+
+
+def _handler(registry: MetricsRegistry):
+    from http.server import BaseHTTPRequestHandler  # pylint: disable=C0415
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Class to answer Prometheus scrapes"""
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            pass
+
+        def do_GET(self):  # pylint: disable=C0103
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
@@ -1,69 +1,227 @@
 """Module to interact with Okta API"""
 
+import threading
 import time
-from datetime import datetime
-from src.app.utilities.http_util import HttpUtil
+from urllib.parse import quote
+import requests
+from src.app.utilities.http_util import HTTP_BACKOFF_SECONDS, HTTP_MAX_RETRIES, HttpUtil, backoff, is_retryable_request
+from src.app.utilities.rate_limit_util import RateLimiterPool
 from src.app.utilities.logging_util import Logger
 from src.app.utilities.env_util import Env
-from src.app.utilities.config_util import CONFIG
+from src.app.utilities.stats_util import increment
+from src.app.utilities.error_util import OktaApiError
+from src.app.utilities.metrics_util import METRICS
 
 OKTA_DOMAIN = Env.get("OKTA_DOMAIN")
 OKTA_API_TOKEN = Env.get("OKTA_API_KEY")
+# Overrides https://{OKTA_DOMAIN}/api/v1, e.g. to point the tool at the local mock server in benchmarks/
+OKTA_BASE_URL = Env.get("OKTA_BASE_URL")
 OKTA_RATE_LIMIT_POOL_MINIMUM = Env.get("OKTA_RATE_LIMIT_POOL_MINIMUM", 200)
+OKTA_SEARCH_URL_MAX_LENGTH = int(Env.get("OKTA_SEARCH_URL_MAX_LENGTH", 2000))
+OKTA_PAGE_LIMIT = 200
+# 429 responses retried (each after waiting for the window to reset) before the 429 is handed to the caller
+OKTA_MAX_RATE_LIMIT_RETRIES = int(Env.get("OKTA_MAX_RATE_LIMIT_RETRIES", 5))
+
+# Okta rate limits these endpoint families independently
+GET_USER_BUCKET = "GET /users/{id}"
+SEARCH_USERS_BUCKET = "GET /users?filter="
+DEACTIVATE_USER_BUCKET = "POST /users/{id}/lifecycle/deactivate"
+DELETE_USER_BUCKET = "DELETE /users/{id}"
+
+# Okta answers a lifecycle call that does not fit the user's current status with this error,
+# e.g. deactivating a user that is already DEPROVISIONED
+INVALID_STATUS_ERROR_CODE = "E0000038"
+
+
+class OktaResponse(dict):
+    """Class to hold the status code, JSON body and next page URL of an Okta response.
+
+    Lifecycle calls only look at the status code, so the body and the Link header are only
+    decoded when "json" or "next" is first read.
+    """
+
+    __slots__ = ("response",)
+
+    def __init__(self, response):
+        super().__init__(status_code=response.status_code)
+        self.response = response
+
+    def __missing__(self, key: str):
+        if key == "json":
+            value = _json(self.response)
+        elif key == "next":
+            value = self.response.links.get("next", {}).get("url")
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
 
 class Okta:
     """Class to interact with Okta API"""
 
-    def __init__(self):
-        self.base_url = f"https://{OKTA_DOMAIN}/api/v1"
+    def __init__(self, rate_limiters: RateLimiterPool = None, concurrency=None):
+        self.base_url = OKTA_BASE_URL or f"https://{OKTA_DOMAIN}/api/v1"
         self.headers = {
             "Authorization": "SSWS " + OKTA_API_TOKEN,
             "Content-Type": "application/json",
         }
         self.log = Logger("okta_util.py")
-        self.http = HttpUtil(headers=self.headers)
-
-    def _api(self, url: str, method: str, data=None):
-        response = self.http.api(url, method, data)
-        CONFIG["TOTAL_OKTA_API_CALLS"] += 1
-        # Check rate limit status
-        seconds_until_rate_limit_reset = int(self._check_rate_limit(response.headers))
-        # If response code is 429 and there is a wait time for the rate limit to reset, retry
-        if response.status_code == 429 and seconds_until_rate_limit_reset > 0:
-            self.log.warn(
-                f"Rate limit reached, waiting for {seconds_until_rate_limit_reset} second(s)"
-            )
-            time.sleep(seconds_until_rate_limit_reset)
-            CONFIG["SLEEP_COUNT"] += 1
-            CONFIG["SLEEP_TIME"] += seconds_until_rate_limit_reset
-            return self._api(url, method, data)
-
-        data = {
-            "status_code": response.status_code,
-            "json": response.json(),
-        }
-        return data
-    
+        self._http = None
+        self.http_lock = threading.Lock()
+        if rate_limiters is None:
+            rate_limiters = RateLimiterPool(pool_minimum=int(OKTA_RATE_LIMIT_POOL_MINIMUM))
+        self.rate_limiters = rate_limiters
+        # Optional AdaptiveConcurrency gating the requests in flight
+        self.concurrency = concurrency
+        self.max_retries = HTTP_MAX_RETRIES
+        self.backoff_seconds = HTTP_BACKOFF_SECONDS
+        self.sleep = time.sleep
+
+    @property
+    def http(self) -> HttpUtil:
+        """The pooled HTTP session, opened by the first request"""
+        if self._http is None:
+            with self.http_lock:
+                if self._http is None:
+                    self._http = HttpUtil(headers=self.headers)
+        return self._http
+
+    @http.setter
+    def http(self, http) -> None:
+        self._http = http
+
+    def _api(self, url: str, method: str, data=None, bucket: str = GET_USER_BUCKET):
+        rate_limiter = self.rate_limiters.get(bucket)
+        rate_limit_retries, server_retries = 0, 0
+        while True:
+            try:
+                response = self._send(rate_limiter, url, method, data, bucket)
+            except requests.exceptions.ConnectionError as err:
+                if not is_retryable_request(method) or server_retries >= self.max_retries:
+                    raise err
+            else:
+                # If response code is 429 and there is a wait time for the rate limit to reset, retry.
+                # The limiter is marked as used up, so the next acquire waits for the reset.
+                if response.status_code == 429:
+                    if rate_limiter.seconds_until_reset() <= 0 or rate_limit_retries >= OKTA_MAX_RATE_LIMIT_RETRIES:
+                        return OktaResponse(response)
+                    rate_limit_retries += 1
+                    rate_limiter.exhaust()
+                    self.log.warn(f"Rate limit reached, waiting for {rate_limiter.seconds_until_reset():.0f} second(s)")
+                    continue
+                if not is_retryable_request(method, response.status_code) or server_retries >= self.max_retries:
+                    return OktaResponse(response)
+
+            # Server errors and connection errors of lookups are retried with backoff, through the
+            # rate limiter like any other request
+            server_retries += 1
+            self.http.record_retry()
+            self.sleep(backoff(server_retries, self.backoff_seconds))
+
+    def _send(self, rate_limiter, url: str, method: str, data, bucket: str):
+        """Function to send one request once the concurrency gate and then the rate limiter let it through"""
+        # Waiting for a concurrency slot with a paced rate-limit slot already reserved would let the
+        # waiting requests go out in a burst once the limit grows again
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        try:
+            rate_limiter.acquire()
+            started = time.monotonic()
+            response = self.http.api(url, method, data)
+            latency = time.monotonic() - started
+            rate_limiter.update(response.headers)
+            if self.concurrency is not None:
+                self.concurrency.record(latency, response.status_code, rate_limiter.headroom())
+        finally:
+            if self.concurrency is not None:
+                self.concurrency.release()
+            increment("TOTAL_OKTA_API_CALLS")
+        increment("WORK_TIME", latency)
+        METRICS.observe("okta_request_seconds", latency, endpoint=bucket, status=response.status_code)
+        METRICS.mark("okta_requests")
+        return response
+
+    def _paginate(self, endpoint: str, bucket: str):
+        """Function to follow the Link: rel=next headers and collect every page of a list endpoint"""
+        response = self._api(endpoint, "GET", bucket=bucket)
+        if response["status_code"] != 200:
+            return response
+
+        items = []
+        for page in self._pages(response, endpoint, bucket):
+            items.extend(page)
+        return {"status_code": 200, "json": items, "next": None}
+
+    def _pages(self, response: dict, endpoint: str, bucket: str):
+        """Function to yield the first page and then every following page of a list endpoint"""
+        yield response["json"] or []
+        while response["next"]:
+            response = self._api(response["next"], "GET", bucket=bucket)
+            if response["status_code"] != 200:
+                raise OktaApiError(f"Failed to fetch the next page of {endpoint}", response["status_code"], response["json"])
+            yield response["json"] or []
+
+    def list_users(self, statuses: list = None):
+        """Function to page through the whole directory, yielding one page of users at a time"""
+        endpoint = f"{self.base_url}/users?limit={OKTA_PAGE_LIMIT}"
+        if statuses:
+            # Without a filter Okta leaves DEPROVISIONED users out of the list
+            expression = " or ".join(f'status eq "{_escape(status)}"' for status in statuses)
+            endpoint += f"&filter={quote(expression)}"
+        # Listing is rate limited together with searches, both are GET /api/v1/users
+        response = self._api(endpoint, "GET", bucket=SEARCH_USERS_BUCKET)
+        if response["status_code"] != 200:
+            raise OktaApiError("Failed to list users", response["status_code"], response["json"])
+        yield from self._pages(response, endpoint, SEARCH_USERS_BUCKET)
+
     def search_users(self, field: str, value: str):
         """Function to search users"""
-        endpoint = f"{self.base_url}/users?filter={field} eq \"{value}\""
-        response = self._api(endpoint, "GET")
-        return response
+        return self._search(f'{field} eq "{_escape(value)}"')
+
+    def search_users_by_emails(self, emails: list) -> dict:
+        """Function to look up many emails with as few search calls as possible, returns users keyed by lowercase email"""
+        users_by_email = {email.casefold(): [] for email in emails}
+        for expression in self._email_filters(emails):
+            response = self._search(expression)
+            if response["status_code"] == 404:
+                continue
+            if response["status_code"] != 200:
+                raise OktaApiError("Failed to search users by email", response["status_code"], response["json"])
+            for user in response["json"]:
+                email = str(user.get("profile", {}).get("email", "")).casefold()
+                if email in users_by_email:
+                    users_by_email[email].append(user)
+        return users_by_email
+
+    def _search(self, expression: str):
+        endpoint = f"{self.base_url}/users?limit={OKTA_PAGE_LIMIT}&filter={quote(expression)}"
+        return self._paginate(endpoint, SEARCH_USERS_BUCKET)
+
+    def _email_filters(self, emails: list):
+        return email_filters(self.base_url, emails)
 
     def get_user(self, okta_id):
         """Function to get user details"""
 
         endpoint = f"{self.base_url}/users/{okta_id}"
-        response = self._api(endpoint, "GET")
+        response = self._api(endpoint, "GET", bucket=GET_USER_BUCKET)
         return response
 
     def deactivate_user(self, okta_id):
         """Function to deactivate user"""
         try:
             endpoint = f"{self.base_url}/users/{okta_id}/lifecycle/deactivate"
-            response = self._api(endpoint, "POST")
-            return response["status_code"] == 200
+            response = self._api(endpoint, "POST", bucket=DEACTIVATE_USER_BUCKET)
+            if response["status_code"] != 200:
+                raise OktaApiError(f"Failed to deactivate user {okta_id}", response["status_code"], response["json"])
+            return True
         except Exception as e:
             raise e
 
@@ -71,65 +229,53 @@ class Okta:
         """Function to delete user"""
         try:
             endpoint = f"{self.base_url}/users/{okta_id}"
-            response = self._api(endpoint, "DELETE")
-            return response["status_code"] == 204
+            response = self._api(endpoint, "DELETE", bucket=DELETE_USER_BUCKET)
+            if response["status_code"] != 204:
+                raise OktaApiError(f"Failed to delete user {okta_id}", response["status_code"], response["json"])
+            return True
         except Exception as e:
             raise e
 
-    def _check_rate_limit(self, headers=None):
-        """Function to check the rate limit status of the Okta API"""
-
-        if headers is None:
-            return False
-
-        x_rate_limit = headers.get("X-Rate-Limit-Limit", None)
-        x_rate_limit_remaining = headers.get("X-Rate-Limit-Remaining", None)
-        x_rate_limit_reset = headers.get("X-Rate-Limit-Reset", None)
-
-        if (
-            x_rate_limit is None
-            or x_rate_limit_remaining is None
-            or x_rate_limit_reset is None
-        ):
-            return False
-
-        self.log.info(
-            f"X-Rate-Limit: {str(x_rate_limit)}, X-Rate-Limit-Remaining: {str(x_rate_limit_remaining)}, X-Rate-Limit-Reset: {str(x_rate_limit_reset)} ({max(0, int(x_rate_limit_reset) - int(datetime.now().timestamp()))})"
-        )
-
-        # now in epoch time (seconds)
-        now = int(datetime.now().timestamp())
-
-        data = {}
-        data["wait_time"] = max(0, int(x_rate_limit_reset) - now)
-
-        # If the remaining limit is less than 100, sleep
-        if int(x_rate_limit_remaining) <= 100:
-            self.log.warn(
-                f"[PAUSED] Rate limit remaining is less than 100, sleeping for {max(0, int(x_rate_limit_reset) - int(datetime.now().timestamp()))} second(s)"
-            )
-            CONFIG["SLEEP_COUNT"] += 1
-            CONFIG["SLEEP_TIME"] += data["wait_time"]
-            time.sleep(data["wait_time"])
-            data["wait_time"] = 0  # Already slept
-
-        # If the remaining limit is less than half of the total limit, sleep
-        elif int(x_rate_limit_remaining) < int(x_rate_limit) / 2:
-            self.log.warn(
-                f"[PAUSED] Rate limit remaining is less than half, sleeping for {max(0, int(x_rate_limit_reset) - int(datetime.now().timestamp()))} second(s)"
-            )
-            CONFIG["SLEEP_COUNT"] += 1
-            CONFIG["SLEEP_TIME"] += data["wait_time"]
-            time.sleep(data["wait_time"])
-            data["wait_time"] = 0  # Already slept
-
-        elif int(x_rate_limit_remaining) <= int(OKTA_RATE_LIMIT_POOL_MINIMUM):
-            self.log.warn(
-                f"[PAUSED] Rate limit pool minimum reached, sleeping for {max(0, int(x_rate_limit_reset) - int(datetime.now().timestamp()))} second(s)"
-            )
-            CONFIG["SLEEP_COUNT"] += 1
-            CONFIG["SLEEP_TIME"] += data["wait_time"]
-            time.sleep(data["wait_time"])
-            data["wait_time"] = 0  # Already slept
-
-        return int(data["wait_time"])
+    def rate_limit_stats(self) -> list:
+        """Function to get the rate limit state of every endpoint family used so far"""
+        return self.rate_limiters.stats()
+
+
+def _json(response):
+    """Function to decode a response body, 204 responses and error pages have no JSON body"""
+    if not response.content:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+def is_already_deprovisioned(error: OktaApiError) -> bool:
+    """Function to check if a failed deactivate call means the user is already deprovisioned"""
+    body = error.body if isinstance(error.body, dict) else {}
+    return error.status_code in (400, 403) and body.get("errorCode") == INVALID_STATUS_ERROR_CODE
+
+
+def email_filters(base_url: str, emails: list):
+    """Function to group emails into `profile.email eq "a" or profile.email eq "b"` expressions that fit the URL length limit"""
+    base_length = len(f"{base_url}/users?limit={OKTA_PAGE_LIMIT}&filter=")
+    terms = []
+    length = base_length
+    for email in emails:
+        term = f'profile.email eq "{_escape(email)}"'
+        term_length = len(quote(f" or {term}" if terms else term))
+        if terms and length + term_length > OKTA_SEARCH_URL_MAX_LENGTH:
+            yield " or ".join(terms)
+            terms = []
+            length = base_length
+            term_length = len(quote(term))
+        terms.append(term)
+        length += term_length
+    if terms:
+        yield " or ".join(terms)
+
+
+def _escape(value: str) -> str:
+    """Function to escape a value for use inside a quoted filter expression"""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
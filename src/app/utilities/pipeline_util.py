@@ -0,0 +1,147 @@
+"""Module to run work through a pipeline of stages connected by bounded queues"""
+
+import queue
+import threading
+import time
+from src.app.utilities.env_util import Env
+from src.app.utilities.logging_util import Logger
+from src.app.utilities.metrics_util import METRICS
+
+PIPELINE_QUEUE_SIZE = int(Env.get("PIPELINE_QUEUE_SIZE", 100))
+
+LOG = Logger("pipeline_util.py")
+
+
+class Stage:
+    """Class to describe one stage of a pipeline: its name, handler and number of workers.
+
+    The handler is called as `handler(payload, emit)` and passes work on by calling
+    `emit(payload)` for the next stage, or `emit(payload, stage=name)` to jump to a later one.
+    """
+
+    def __init__(self, name: str, handler, workers: int = 1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.max_queued = 0
+
+
+class _Job:
+    def __init__(self, item):
+        self.item = item
+        self.pending = 1
+        self.failed = False
+
+
+class Pipeline:
+    """Class to run items through stages that each have their own worker threads.
+
+    Stages are connected by bounded queues, so a stage that falls behind (e.g. because its
+    rate limit bucket is throttled) fills its queue and slows down the stages feeding it,
+    while the other stages keep working. Work only flows forward, so the pipeline drains
+    stage by stage. `on_done(item, failed)` is called once an item and everything it emitted has
+    been handled, failed saying if any stage raised for it.
+    """
+
+    def __init__(self, stages: list, queue_size: int = PIPELINE_QUEUE_SIZE, on_done=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+        self.positions = {stage.name: position for position, stage in enumerate(stages)}
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def run(self, items) -> None:
+        """Function to feed every item into the first stage and wait until the pipeline is drained"""
+        for position, stage in enumerate(self.stages):
+            METRICS.gauge("pipeline_queued", self.queues[position].qsize, stage=stage.name)
+            for number in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(position,),
+                    name=f"{stage.name}-{number + 1}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+
+        try:
+            for item in items:
+                self._put(0, (_Job(item), item))
+        finally:
+            # Nothing flows backwards, so once a stage's queue is drained it gets no more work
+            for stage_queue, stage in zip(self.queues, self.stages):
+                stage_queue.join()
+                for _ in range(stage.workers):
+                    stage_queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            for stage in self.stages:
+                METRICS.remove_gauge("pipeline_queued", stage=stage.name)
+
+    def stats(self) -> list:
+        """Function to get the processed/error counts, busy time and deepest queue of every stage"""
+        with self.lock:
+            return [
+                {
+                    "name": stage.name,
+                    "workers": stage.workers,
+                    "processed": stage.processed,
+                    "errors": stage.errors,
+                    "busy_time": stage.busy_time,
+                    "max_queued": stage.max_queued,
+                }
+                for stage in self.stages
+            ]
+
+    def _put(self, position: int, entry) -> None:
+        # Blocks while the stage's queue is full, which is the backpressure on the stage before it
+        self.queues[position].put(entry)
+        queued = self.queues[position].qsize()
+        stage = self.stages[position]
+        if queued > stage.max_queued:
+            with self.lock:
+                stage.max_queued = max(stage.max_queued, queued)
+
+    def _emit(self, job: _Job, position: int, payload, stage: str = None) -> None:
+        target = position + 1 if stage is None else self.positions[stage]
+        if target <= position or target >= len(self.stages):
+            raise ValueError(f"Stage {self.stages[position].name} cannot emit to stage {stage}")
+        with self.lock:
+            job.pending += 1
+        self._put(target, (job, payload))
+
+    def _work(self, position: int) -> None:
+        stage = self.stages[position]
+        stage_queue = self.queues[position]
+        while True:
+            entry = stage_queue.get()
+            if entry is None:
+                stage_queue.task_done()
+                return
+
+            job, payload = entry
+            started = time.monotonic()
+            failed = False
+            try:
+                stage.handler(payload, lambda next_payload, stage=None: self._emit(job, position, next_payload, stage))
+            except Exception as e:
+                failed = True
+                LOG.error(f"{stage.name} stage failed: {e}")
+            finally:
+                with self.lock:
+                    stage.processed += 1
+                    stage.errors += failed
+                    job.failed = job.failed or failed
+                    stage.busy_time += time.monotonic() - started
+                    job.pending -= 1
+                    done = job.pending == 0
+                if done and self.on_done is not None:
+                    try:
+                        self.on_done(job.item, job.failed)
+                    except Exception as e:
+                        LOG.error(f"Error finishing pipeline item: {e}")
+                stage_queue.task_done()
@@ -0,0 +1,140 @@
+"""Module to write and read plans: what a run would do with every input row, worked out without any writes"""
+
+import csv
+import os
+import sys
+import threading
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.logging_util import Logger
+from src.app.utilities.snapshot_util import UnlistedUsers
+
+PLAN_PATH = "data/plans/"
+PLAN_HEADER = ["row", "value", "action", "okta_id", "status"]
+
+LOG = Logger("plan_util.py")
+
+
+def plan_key(input_path: str) -> str:
+    """Function to get the key of an input file's plan, relative to the data root (and the S3 prefix)"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return f"{PLAN_PATH}{name}{CONFIG['SHARD_SUFFIX']}.plan.csv"
+
+
+class PlanWriter:
+    """Class to write a plan CSV as rows are resolved.
+
+    Each resolved user gets a line with the action an execute run would take: `deactivate_and_delete`,
+    or `delete` for users that are already deprovisioned. Rows without users get one line with
+    `not_found`, `unlisted` (no user in a snapshot of only some statuses), `excluded` or `lookup_failed`.
+    The plan is written to a temporary file and only moved into place (and uploaded to S3) by `commit`,
+    so an interrupted plan run never leaves a partial plan behind for an execute run to pick up.
+    """
+
+    def __init__(self, input_path: str, s3=None):
+        self.key = plan_key(input_path)
+        self.local_path = CONFIG["SRC_PATH"] + self.key
+        self.temp_path = f"{self.local_path}.tmp"
+        self.s3 = s3
+        self.lock = threading.Lock()
+        self.counts = {}
+        os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+        self.file = open(self.temp_path, "w", newline="", encoding="utf-8")  # pylint: disable=R1732
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(PLAN_HEADER)
+
+    def add(self, current_row: int, value: str, users: list = None, excluded: bool = False) -> None:
+        """Function to record a row: excluded, users None when the lookup failed, or the users found for it"""
+        if excluded:
+            lines = [(current_row, value, "excluded", "", "")]
+        elif users is None:
+            lines = [(current_row, value, "lookup_failed", "", "")]
+        elif isinstance(users, UnlistedUsers):
+            lines = [(current_row, value, "unlisted", "", "")]
+        elif not users:
+            lines = [(current_row, value, "not_found", "", "")]
+        else:
+            lines = [
+                (
+                    current_row,
+                    value,
+                    "delete" if user["status"] == "DEPROVISIONED" else "deactivate_and_delete",
+                    user["id"],
+                    user["status"],
+                )
+                for user in users
+            ]
+        with self.lock:
+            self.writer.writerows(lines)
+            for line in lines:
+                self.counts[line[2]] = self.counts.get(line[2], 0) + 1
+
+    def commit(self) -> None:
+        """Function to move the finished plan into place and upload it to S3 when enabled"""
+        self.file.close()
+        os.replace(self.temp_path, self.local_path)
+        LOG.info(f"Wrote plan {self.local_path}: {self.counts}")
+        if self.s3 is not None:
+            with open(self.local_path, "rb") as file:
+                self.s3.upload_fileobj(self.key, file)
+
+    def close(self) -> None:
+        """Function to close the plan, dropping it if it was never committed"""
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class Plan:
+    """Class to look rows up in a plan written by an earlier plan run.
+
+    Values map to a tuple of (Okta ID, status) pairs, empty when the user was not found. Rows
+    the plan could not resolve (failed or excluded at plan time) are left out, so they are
+    looked up again.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.unlisted = set()
+
+    def add(self, value: str, action: str, okta_id: str, status: str) -> None:
+        """Function to add one line of a plan"""
+        if action in ("lookup_failed", "excluded"):
+            return
+        if action == "unlisted":
+            self.unlisted.add(value)
+            return
+        users = self.values.get(value, ())
+        if action != "not_found":
+            users += ((okta_id, sys.intern(status)),)
+        self.values[value] = users
+
+    def users_for(self, value: str):
+        """Function to get the planned users of a value as a list of {id, status}, None when the plan has no answer"""
+        users = self.values.get(value)
+        if users is None:
+            return UnlistedUsers() if value in self.unlisted else None
+        return [{"id": okta_id, "status": status} for okta_id, status in users]
+
+    def __len__(self) -> int:
+        return len(self.values) + len(self.unlisted)
+
+
+def load_plan(input_path: str, s3=None) -> Plan:
+    """Function to read the plan of an input file, downloading it from S3 when it is not on disk"""
+    key = plan_key(input_path)
+    local_path = CONFIG["SRC_PATH"] + key
+    if not os.path.exists(local_path) and s3 is not None:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        s3.download_file(key, local_path)
+    if not os.path.exists(local_path):
+        raise FileNotFoundError(f"No plan found at {local_path}, run with PLAN_MODE=True first")
+
+    plan = Plan()
+    with open(local_path, "r", newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for _, value, action, okta_id, status in reader:
+            plan.add(value, action, okta_id, status)
+    LOG.info(f"Loaded plan {local_path} with {len(plan)} resolved value(s)")
+    return plan
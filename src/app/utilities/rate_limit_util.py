@@ -0,0 +1,184 @@
+"""Module to pace requests against the Okta rate limit headers"""
+
+import threading
+import time
+from src.app.utilities.logging_util import Logger
+from src.app.utilities.stats_util import increment
+from src.app.utilities.metrics_util import METRICS
+
+
+class RateLimiter:
+    """Class to pace requests so the X-Rate-Limit budget is spread evenly across the reset window.
+
+    The limiter is safe to share between worker threads. Each call to `acquire` reserves one
+    request from the remaining budget (minus the pool minimum) and sleeps just long enough to
+    keep requests evenly spaced until the window resets, instead of running the budget down
+    and then stalling until `X-Rate-Limit-Reset`. Coroutines use `acquire_async`, which waits
+    with `asyncio.sleep` so the event loop keeps running.
+    """
+
+    def __init__(self, name: str = "default", pool_minimum: int = 0, clock=time.time, sleep=time.sleep, shares=None):
+        self.name = name
+        self.pool_minimum = int(pool_minimum)
+        self.clock = clock
+        self.sleep = sleep
+        # Callable returning how many processes draw on the same tenant budget, e.g. ShardCoordinator.active_shards
+        self.shares = shares
+        self.log = Logger("rate_limit_util.py")
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.next_slot = 0.0
+        self.throttle_count = 0
+        self.throttle_time = 0.0
+
+    def update(self, headers=None) -> None:
+        """Function to update the limiter state from a response's X-Rate-Limit headers"""
+        if headers is None:
+            return
+
+        try:
+            limit = int(headers["X-Rate-Limit-Limit"])
+            remaining = int(headers["X-Rate-Limit-Remaining"])
+            reset = int(headers["X-Rate-Limit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self.lock:
+            if self.reset is None or reset > self.reset:
+                # A new window started
+                self.limit = limit
+                self.remaining = remaining
+                self.reset = reset
+            elif reset == self.reset:
+                # Responses from concurrent workers arrive out of order, so keep the lowest count seen
+                self.limit = limit
+                self.remaining = remaining if self.remaining is None else min(self.remaining, remaining)
+
+    def acquire(self) -> float:
+        """Function to wait for the next request slot, returns the number of seconds spent throttled"""
+        wait_time = self._throttle()
+        if wait_time > 0:
+            self.sleep(wait_time)
+        return wait_time
+
+    async def acquire_async(self) -> float:
+        """Function to wait for the next request slot without blocking the event loop"""
+        import asyncio  # pylint: disable=C0415
+
+        wait_time = self._throttle()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+    def _throttle(self) -> float:
+        """Function to reserve the next request slot and record how long the caller has to wait for it"""
+        with self.lock:
+            wait_time = self._reserve(self.clock())
+
+        if wait_time > 0:
+            if wait_time >= 1:
+                self.log.warn(
+                    f"[PAUSED] Rate limit budget for {self.name} is low, sleeping for {wait_time:.2f} second(s)"
+                )
+            with self.lock:
+                self.throttle_count += 1
+                self.throttle_time += wait_time
+            increment("THROTTLE_COUNT")
+            increment("THROTTLE_TIME", wait_time)
+            METRICS.inc("throttle_total", endpoint=self.name)
+            METRICS.inc("throttle_seconds_total", wait_time, endpoint=self.name)
+
+        return wait_time
+
+    def exhaust(self) -> None:
+        """Function to mark the current window as used up, e.g. after a 429 response"""
+        with self.lock:
+            if self.reset is not None and self.reset > self.clock():
+                self.remaining = 0
+
+    def headroom(self):
+        """Function to get the fraction of the current window's limit that is left, None until the headers are known"""
+        limit, remaining = self.limit, self.remaining
+        if not limit or remaining is None:
+            return None
+        return remaining / limit
+
+    def seconds_until_reset(self) -> float:
+        """Function to get the number of seconds until the current window resets"""
+        with self.lock:
+            if self.reset is None:
+                return 0
+            return max(0, self.reset - self.clock())
+
+    def stats(self) -> dict:
+        """Function to get the limiter state and throttle totals"""
+        with self.lock:
+            return {
+                "name": self.name,
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset": self.reset,
+                "throttle_count": self.throttle_count,
+                "throttle_time": self.throttle_time,
+            }
+
+    def _reserve(self, now: float) -> float:
+        """Function to reserve one request from the budget, must be called while holding the lock"""
+        if self.remaining is None or self.reset is None:
+            # Nothing learned yet, let the request through so the headers can tell us the budget
+            return 0.0
+
+        if now >= self.reset:
+            # The window rolled over, the budget is unknown until the next response headers arrive
+            self.remaining = None
+            self.next_slot = 0.0
+            return 0.0
+
+        # Never hold back more than half of the advertised limit, otherwise small buckets could never make progress
+        reserve = min(self.pool_minimum, self.limit // 2)
+        budget = self.remaining - reserve
+        if budget <= 0:
+            return self.reset - now
+
+        # Every shard sees the whole tenant budget in the headers, so each one paces to its share of it
+        shares = self.shares() if self.shares is not None else 1
+        interval = (self.reset - now) * shares / budget
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + interval
+        self.remaining -= 1
+        return slot - now
+
+
+class RateLimiterPool:
+    """Class to keep an independent RateLimiter per endpoint family.
+
+    Okta rate limits each endpoint family separately, so a throttled search bucket must not hold
+    back deletes that still have headroom. Limiters are created on first use.
+    """
+
+    def __init__(self, pool_minimum: int = 0, clock=time.time, sleep=time.sleep, shares=None):
+        self.pool_minimum = int(pool_minimum)
+        self.clock = clock
+        self.sleep = sleep
+        self.shares = shares
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def get(self, name: str) -> RateLimiter:
+        """Function to get the limiter for an endpoint family"""
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            with self.lock:
+                limiter = self.limiters.get(name)
+                if limiter is None:
+                    limiter = RateLimiter(name, pool_minimum=self.pool_minimum, clock=self.clock, sleep=self.sleep, shares=self.shares)
+                    self.limiters[name] = limiter
+        return limiter
+
+    def stats(self) -> list:
+        """Function to get the state and throttle totals of every bucket"""
+        with self.lock:
+            limiters = list(self.limiters.values())
+        return [limiter.stats() for limiter in limiters]
@@ -5,20 +5,16 @@ from datetime import datetime
 from os import environ
 from src.app.utilities.logging_util import Logger
 from src.app.utilities.config_util import CONFIG
+from src.app.utilities.metrics_util import METRICS
+from src.app.utilities.stats_util import STATS, merge_stats
 
-CONFIG_SETUP_DEFAULTS = {
-    "TOTAL_ROWS": 0,
-    "TOTAL_USERS_DEACTIVATED": 0,
-    "TOTAL_USERS_DELETED": 0,
-    "TOTAL_USERS_NOT_FOUND": 0,
-    "TOTAL_USERS_SKIPPED": 0,
-    "TOTAL_OKTA_API_CALLS": 0,
-    "TOTAL_ERROR_COUNT": 0,
-    "DEACTIVATION_ERROR_COUNT": 0,
-    "DELETE_ERROR_COUNT": 0,
-    "SLEEP_COUNT": 0,
-    "SLEEP_TIME": 0,
-}
+# Variables whose name contains one of these have their value left out of the log
+SECRET_NAME_MARKERS = ("TOKEN", "KEY", "SECRET", "PASSWORD")
+
+
+def redact(key: str, value) -> str:
+    """Function to hide the value of a variable that holds a credential"""
+    return "[REDACTED]" if any(marker in key.upper() for marker in SECRET_NAME_MARKERS) else value
 
 
 class ReportingUtil:
@@ -32,20 +28,16 @@ class ReportingUtil:
 
     def start(self):
         """Function to start the reporting"""
+        # Count from zero before anything of this run is counted
+        STATS.reset()
+        METRICS.reset()
         self.start_time = int(datetime.now().timestamp())
 
-        log = self.log.info
-
-        log("Starting Okta User Deletion Script")
-        log("Environment Variables:")
-        for key, value in environ.items():
-            log(f"    {key}: {value}")
-        log("Config Variables:")
-        for key, value in CONFIG.items():
-            log(f"    {key}: {value}")
-
-        for key, value in CONFIG_SETUP_DEFAULTS.items():
-            CONFIG[key] = value
+        self.log.info("Starting Okta User Deletion Script")
+        # One record per section rather than one per variable, only when debugging
+        if self.log.is_enabled("DEBUG"):
+            self.log.debug("Environment Variables:\n" + "\n".join(f"    {key}: {redact(key, value)}" for key, value in environ.items()))
+            self.log.debug("Config Variables:\n" + "\n".join(f"    {key}: {redact(key, value)}" for key, value in CONFIG.items()))
 
     def finish(self):
         """Function to finish the reporting"""
@@ -56,12 +48,27 @@ class ReportingUtil:
 
         self.log.info("Finished Okta User Deletion Script")
 
+    def export(self) -> dict:
+        """Function to get the run counters and times, so the reports of several shards can be merged"""
+        data = STATS.snapshot()
+        data["START_TIME"] = self.start_time
+        data["END_TIME"] = self.end_time
+        return data
+
+    def generate_combined(self, reports: list) -> None:
+        """Function to generate one report from the exported counters of every shard"""
+        self.start_time = min(report["START_TIME"] for report in reports)
+        self.end_time = max(report["END_TIME"] for report in reports)
+        self.duration = time.strftime("%H:%M:%S", time.gmtime(self.end_time - self.start_time))
+        self.log.info(f"Combined report for {len(reports)} shard(s):")
+        self.generate(merge_stats(reports))
+
     def generate(self, data=None):
         """Function to generate report"""
         # Generate report
 
         if data is None:
-            data = CONFIG
+            data = STATS.snapshot()
 
         runtime_minutes = max(1, (self.end_time - self.start_time) / 60)
         report = "\n".join(
@@ -69,19 +76,73 @@ class ReportingUtil:
                 "\nStats:",
                 f"    Total time taken: {self.duration}",
                 f"    Total rows in input CSV: {data['TOTAL_ROWS']}",
-                f"    Total rows processed: {data['TOTAL_ROWS']}",
+                f"    Total rows processed: {data['TOTAL_ROWS_PROCESSED']}",
+                f"    Total rows already finished by a previous run: {data['TOTAL_ROWS_RESUMED']}",
+                f"    Total rows skipped as already deleted or not found: {data['TOTAL_ROWS_CACHED']}",
+                f"    Total invalid rows skipped: {data['TOTAL_ROWS_INVALID']}",
+                f"    Total duplicate rows skipped: {data['TOTAL_ROWS_DUPLICATE']}",
                 f"    Total users deactivated: {data['TOTAL_USERS_DEACTIVATED']}",
                 f"    Total users deleted: {data['TOTAL_USERS_DELETED']}",
                 f"    Total users not found: {data['TOTAL_USERS_NOT_FOUND']}",
                 f"    Total users skipped: {data['TOTAL_USERS_SKIPPED']}",
-                f"    Average rows per minute: {data['TOTAL_ROWS'] / runtime_minutes:.2f}",
+                f"    Average rows per minute: {data['TOTAL_ROWS_PROCESSED'] / runtime_minutes:.2f}",
                 f"    Total Okta API requests made: {data['TOTAL_OKTA_API_CALLS']}",
                 f"    Average Okta API requests per minute: {data['TOTAL_OKTA_API_CALLS'] / runtime_minutes:.2f}",
-                f"    Total errors: {data['DEACTIVATION_ERROR_COUNT'] + data['DELETE_ERROR_COUNT']}",
+                f"    Total errors: {data['LOOKUP_ERROR_COUNT'] + data['DEACTIVATION_ERROR_COUNT'] + data['DELETE_ERROR_COUNT']}",
+                f"        Total Lookup Error count: {data['LOOKUP_ERROR_COUNT']}",
                 f"        Total Deactivate Error count: {data['DEACTIVATION_ERROR_COUNT']}",
                 f"        Total Delete Error count: {data['DELETE_ERROR_COUNT']}",
-                f"    Total sleep count: {data['SLEEP_COUNT']}",
-                f"    Total sleep time: {data['SLEEP_TIME']}s ({time.strftime('%H:%M:%S', time.gmtime(data['SLEEP_TIME']))})",
+                f"        Retries: {data['TOTAL_FAILURES_RETRIED']} ({data['TOTAL_FAILURES_RECOVERED']} recovered)",
+                f"    Total throttle count: {data['THROTTLE_COUNT']}",
+                f"    Total time throttled: {data['THROTTLE_TIME']:.2f}s ({time.strftime('%H:%M:%S', time.gmtime(data['THROTTLE_TIME']))})",
+                f"    Total time waiting on Okta requests: {data['WORK_TIME']:.2f}s ({time.strftime('%H:%M:%S', time.gmtime(data['WORK_TIME']))})",
+            ]
+            + (
+                [
+                    "    Plan (no users were changed):",
+                    f"        Users to deactivate and delete: {data['PLAN_USERS_TO_DEACTIVATE']}",
+                    f"        Already deprovisioned users to delete: {data['PLAN_USERS_TO_DELETE']}",
+                    f"        Rows that could not be looked up: {data['PLAN_LOOKUP_ERRORS']}",
+                ]
+                if CONFIG["PLAN_MODE"]
+                else []
+            )
+            + [
+                f"    Rows resolved from the plan: {count}"
+                for count in [data.get("TOTAL_ROWS_FROM_PLAN")]
+                if count
+            ]
+            + [
+                f"    Users in directory snapshot: {count}"
+                for count in [data.get("SNAPSHOT_USERS")]
+                if count
+            ]
+            + [
+                f"    Values without a user of the SNAPSHOT_STATUSES (not counted as not found): {count}"
+                for count in [data.get("TOTAL_USERS_UNLISTED")]
+                if count
+            ]
+            + [
+                f"    HTTP requests: {stats['request_count']} ({stats['retry_count']} retried), average latency {stats['average_latency'] * 1000:.0f}ms, max latency {stats['max_latency'] * 1000:.0f}ms"
+                for stats in [data.get("HTTP_LATENCY_STATS")]
+                if stats
+            ]
+            + [
+                f"    Rate limit bucket {stats['name']}: throttled {stats['throttle_count']} time(s) for {stats['throttle_time']:.2f}s, last remaining {stats['remaining']}/{stats['limit']}"
+                for stats in data.get("RATE_LIMIT_STATS", [])
+            ]
+            + [
+                f"    Okta {stats['endpoint']} -> {stats['status']}: {stats['count']} request(s), p50 {stats['p50'] * 1000:.0f}ms, p95 {stats['p95'] * 1000:.0f}ms, p99 {stats['p99'] * 1000:.0f}ms"
+                for stats in data.get("LATENCY_STATS", [])
+            ]
+            + [
+                f"    Adaptive concurrency: settled at {stats['settled']:.1f} (ranged {stats['lowest']}-{stats['highest']}, {stats['increases']} increase(s), {stats['decreases']} decrease(s))"
+                for stats in data.get("ADAPTIVE_CONCURRENCY_STATS", [])
+            ]
+            + [
+                f"    Pipeline stage {stats['name']}: {stats['processed']} item(s) on {stats['workers']} worker(s), {stats['errors']} error(s), busy {stats['busy_time']:.2f}s, up to {stats['max_queued']} queued"
+                for stats in data.get("PIPELINE_STATS", [])
             ]
         )
         self.log.info(report)
+
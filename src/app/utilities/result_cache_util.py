@@ -0,0 +1,146 @@
+"""Module to remember what earlier runs found out about users, so later runs can skip the ones that are gone"""
+
+import os
+import re
+import threading
+import time
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG, ENVIRONMENT
+from src.app.utilities.logging_util import Logger
+
+RESULT_CACHE_TTL_SECONDS = float(Env.get("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+RESULT_CACHE_PREFIX = "data/cache/results/"
+RESULT_CACHE_FLUSH_SIZE = 500
+# Outcomes that leave nothing to do for a value, IDs and emails that map to them are skipped
+GONE_OUTCOMES = ("deleted", "not_found")
+
+LOG = Logger("result_cache_util.py")
+
+
+def result_cache_name() -> str:
+    """Function to get the cache file name, one per environment and Okta org so tenants never share results"""
+    domain = re.sub(r"[^A-Za-z0-9.-]", "_", str(Env.get("OKTA_DOMAIN") or "okta"))
+    return f"{ENVIRONMENT}_{domain}"
+
+
+class ResultCache:
+    """Class to keep the last known outcome of every ID and email in a local SQLite file.
+
+    Each value maps to its outcome (`deactivated`, `deleted` or `not_found`), the Okta ID it
+    resolved to and when that was seen. Outcomes are buffered and written in batches, and a
+    value counts as gone while its `deleted`/`not_found` outcome is younger than the TTL.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        import sqlite3  # pylint: disable=C0415
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (value TEXT PRIMARY KEY, okta_id TEXT, outcome TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def record(self, value: str, outcome: str, okta_id: str = None) -> None:
+        """Function to record the outcome of a value, written with the next batch"""
+        with self.lock:
+            self.pending.append((value, okta_id, outcome, self.clock()))
+            if len(self.pending) < RESULT_CACHE_FLUSH_SIZE:
+                return
+        self.flush()
+
+    def is_gone(self, value: str) -> bool:
+        """Function to check if a value was deleted or not found within the TTL"""
+        with self.lock:
+            row = self.connection.execute("SELECT outcome, updated_at FROM results WHERE value = ?", (value,)).fetchone()
+        return row is not None and row[0] in GONE_OUTCOMES and self.clock() - row[1] <= self.ttl_seconds
+
+    def flush(self) -> None:
+        """Function to write the buffered outcomes"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if pending:
+                with self.connection:
+                    self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", pending)
+
+    def merge(self, path: str) -> None:
+        """Function to add the outcomes of another cache file, keeping the newest outcome of every value"""
+        self.flush()
+        with self.lock:
+            self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+            try:
+                with self.connection:
+                    self.connection.execute(
+                        "INSERT INTO results SELECT * FROM other.results WHERE true "
+                        "ON CONFLICT (value) DO UPDATE SET okta_id = excluded.okta_id, outcome = excluded.outcome, "
+                        "updated_at = excluded.updated_at WHERE excluded.updated_at > results.updated_at"
+                    )
+            finally:
+                self.connection.execute("DETACH DATABASE other")
+
+    def __len__(self) -> int:
+        self.flush()
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        """Function to write the buffered outcomes and close the file"""
+        self.flush()
+        with self.lock:
+            self.connection.close()
+
+
+RESULTS = None
+
+
+def open_result_cache(s3=None) -> ResultCache:
+    """Function to open the local cache, first merging in the copies every run and shard uploaded to S3"""
+    global RESULTS  # pylint: disable=W0603
+    name = result_cache_name()
+    cache = ResultCache(f"{CONFIG['SRC_PATH']}{RESULT_CACHE_PREFIX}{name}.db")
+    if s3 is not None:
+        for key, _ in s3.list_objects(f"{RESULT_CACHE_PREFIX}{name}"):
+            rest = key[len(f"{RESULT_CACHE_PREFIX}{name}"):]
+            if rest != ".db" and not (rest.startswith("-shard-") and rest.endswith(".db")):
+                continue
+            local_path = f"{CONFIG['SRC_PATH']}{key}.download"
+            try:
+                s3.download_file(key, local_path)
+                cache.merge(local_path)
+            except Exception as e:
+                LOG.warn(f"Failed to merge the result cache {key}: {e}")
+            finally:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+    LOG.info(f"Result cache holds {len(cache)} value(s)")
+    RESULTS = cache
+    return cache
+
+
+def close_result_cache(s3=None) -> None:
+    """Function to close the cache and upload this run's copy to S3"""
+    global RESULTS  # pylint: disable=W0603
+    if RESULTS is None:
+        return
+    cache, RESULTS = RESULTS, None
+    cache.close()
+    if s3 is not None:
+        # Each shard uploads its own copy, the next run merges them all
+        with open(cache.path, "rb") as file:
+            s3.upload_fileobj(f"{RESULT_CACHE_PREFIX}{result_cache_name()}{CONFIG['SHARD_SUFFIX']}.db", file)
+
+
+def record_result(value: str, outcome: str, okta_id: str = None) -> None:
+    """Function to record the outcome of a value when the result cache is open"""
+    if RESULTS is not None:
+        RESULTS.record(value, outcome, okta_id)
+
+
+def is_known_gone(value: str) -> bool:
+    """Function to check if an earlier run found a value deleted or not found, False when the result cache is not open"""
+    return RESULTS is not None and RESULTS.is_gone(value)
@@ -1,31 +1,97 @@
 """Module to interact with S3"""
 
-import boto3
+import threading
 from src.app.utilities.env_util import Env
 from src.app.utilities.logging_util import Logger
 
+CLIENT_LOCK = threading.Lock()
+
 
 class S3Util:
-    """Class to interact with S3"""
+    """Class to interact with S3.
+
+    boto3 is only imported, and the client only created, by the first call that talks to S3,
+    so runs that never touch S3 do not pay for either.
+    """
 
     def __init__(self):
         self.bucket = Env.get("TARGET_S3_BUCKET")
-        self.client = boto3.client("s3")
+        self._client = None
         self.prefix = f"{Env.get('S3_PREFIX', '.').strip('/')}/{Env.get('JOB_NAME')}"
         self.log = Logger("s3_util.py")
 
+    @property
+    def client(self):
+        """The boto3 S3 client, created on first use"""
+        if self._client is None:
+            # boto3 sessions are not thread safe, so only one thread creates the client
+            with CLIENT_LOCK:
+                if self._client is None:
+                    import boto3  # pylint: disable=C0415
+
+                    self._client = boto3.client("s3")
+        return self._client
+
     def get_object(self, key):
         """Function to get object from S3"""
         s3_key = f"{self.prefix}/{key}"
         response = self.client.get_object(Bucket=self.bucket, Key=s3_key)
         return response["Body"].read().decode("utf-8")
 
+    def open_object(self, key):
+        """Function to open a streaming body for an object in S3, returns the body and its size in bytes"""
+        s3_key = f"{self.prefix}/{key}"
+        response = self.client.get_object(Bucket=self.bucket, Key=s3_key)
+        return response["Body"], response["ContentLength"]
+
+    def object_info(self, key):
+        """Function to get the size and version (ETag and last modified time) of an object in S3, returns None if it does not exist"""
+        s3_key = f"{self.prefix}/{key}"
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=s3_key)
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise e
+        return response["ContentLength"], _version(response["ETag"], response["LastModified"])
+
+    def list_object_versions(self, key_prefix):
+        """Function to list the objects under a key prefix, returns (key, size, version) triples sorted by key"""
+        s3_prefix = f"{self.prefix}/{key_prefix}"
+        paginator = self.client.get_paginator("list_objects_v2")
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=s3_prefix):
+            for item in page.get("Contents", []):
+                objects.append((item["Key"][len(self.prefix) + 1:], item["Size"], _version(item["ETag"], item["LastModified"])))
+        return sorted(objects)
+
+    def list_objects(self, key_prefix):
+        """Function to list the objects under a key prefix, returns (key, size) pairs sorted by key"""
+        s3_prefix = f"{self.prefix}/{key_prefix}"
+        paginator = self.client.get_paginator("list_objects_v2")
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=s3_prefix):
+            for item in page.get("Contents", []):
+                objects.append((item["Key"][len(self.prefix) + 1:], item["Size"]))
+        return sorted(objects)
+
     def put_object(self, key, data):
         """Function to upload object to S3"""
         s3_key = f"{self.prefix}/{key}"
         response = self.client.put_object(Bucket=self.bucket, Key=s3_key, Body=data)
         return response["ResponseMetadata"]["HTTPStatusCode"] == 200
 
+    def put_object_if_absent(self, key, data):
+        """Function to upload object to S3 only if no object exists at the key, returns False if one already does"""
+        s3_key = f"{self.prefix}/{key}"
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=s3_key, Body=data, IfNoneMatch="*")
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("412", "PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise e
+        return True
+
     def download_file(self, key, filename):
         """Function to download file from S3"""
         s3_key = f"{self.prefix}/{key}"
@@ -51,3 +117,7 @@ class S3Util:
         status_code = response["ResponseMetadata"].get("HTTPStatusCode")
         if status_code:
             return status_code == 204
+
+
+def _version(etag: str, last_modified) -> str:
+    return f"{etag.strip(chr(34))}:{last_modified.isoformat()}"
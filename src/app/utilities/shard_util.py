@@ -0,0 +1,189 @@
+"""Module to split one run across several shards that share the tenant rate limit"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from src.app.utilities.env_util import Env
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.logging_util import Logger
+
+SHARD_LEASE_SECONDS = float(Env.get("SHARD_LEASE_SECONDS", 30))
+SHARD_STATE_PATH = "data/shards/"
+COMBINED_LOCK_NAME = "reports/combined.lock"
+
+LOG = Logger("shard_util.py")
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """Function to get the shard a value belongs to, the same in every process"""
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+
+class LocalShardStore:
+    """Class to share small JSON documents between shards running on one machine"""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or CONFIG["SRC_PATH"] + SHARD_STATE_PATH
+
+    def put(self, name: str, data: dict) -> None:
+        """Function to write a document, atomically replacing any previous version"""
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temp_path, path)
+
+    def claim(self, name: str, data: dict) -> bool:
+        """Function to create a document only if it does not exist yet, returns False if another process already has"""
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        return True
+
+    def get(self, name: str):
+        """Function to read a document, returns None if it does not exist"""
+        try:
+            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def list(self, prefix: str) -> list:
+        """Function to list the names of the documents under a prefix"""
+        directory = os.path.join(self.directory, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f"{prefix}{name}" for name in os.listdir(directory) if name.endswith(".json"))
+
+    def delete(self, name: str) -> None:
+        """Function to delete a document"""
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class S3ShardStore:
+    """Class to share small JSON documents between shards through the job's S3 prefix"""
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def put(self, name: str, data: dict) -> None:
+        """Function to write a document"""
+        self.s3.put_object(SHARD_STATE_PATH + name, json.dumps(data))
+
+    def claim(self, name: str, data: dict) -> bool:
+        """Function to create a document only if it does not exist yet, returns False if another process already has"""
+        return self.s3.put_object_if_absent(SHARD_STATE_PATH + name, json.dumps(data))
+
+    def get(self, name: str):
+        """Function to read a document, returns None if it does not exist"""
+        try:
+            return json.loads(self.s3.get_object(SHARD_STATE_PATH + name))
+        except self.s3.client.exceptions.NoSuchKey:
+            return None
+
+    def list(self, prefix: str) -> list:
+        """Function to list the names of the documents under a prefix"""
+        return [key[len(SHARD_STATE_PATH):] for key, _ in self.s3.list_objects(SHARD_STATE_PATH + prefix)]
+
+    def delete(self, name: str) -> None:
+        """Function to delete a document"""
+        self.s3.delete_object(SHARD_STATE_PATH + name)
+
+
+class ShardCoordinator:
+    """Class to divide the tenant rate limit between the shards that are running.
+
+    Each shard keeps a lease alive in the shared store from a heartbeat thread. The rate
+    limiters divide their budget by the number of live leases, so N shards together pace to
+    the rate one run would, and the remaining shards speed up as others finish. Each shard
+    leaves its counters behind when it finishes, and the last one to finish merges them. Two
+    shards can finish together and both see no live lease, so the merge is claimed with a lock
+    document that only one of them can create.
+    """
+
+    def __init__(self, store, shard_index: int, shard_count: int, lease_seconds: float = SHARD_LEASE_SECONDS, clock=time.time):
+        self.store = store
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.active = shard_count
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        """Function to take this shard's lease and keep it alive until `finish`"""
+        self.refresh()
+        self.thread = threading.Thread(target=self._heartbeat, name="shard-heartbeat", daemon=True)
+        self.thread.start()
+
+    def active_shards(self) -> int:
+        """Function to get the number of shards currently sharing the rate limit"""
+        return self.active
+
+    def refresh(self) -> None:
+        """Function to renew this shard's lease and count the live leases"""
+        now = self.clock()
+        self.store.put(self._lease_name(self.shard_index), {"shard": self.shard_index, "expires_at": now + self.lease_seconds})
+        live = 0
+        for name in self.store.list("leases/"):
+            lease = self.store.get(name)
+            if lease is not None and lease["expires_at"] > now:
+                live += 1
+        self.active = max(1, live)
+
+    def finish(self, report: dict):
+        """Function to release the lease and leave the counters behind, returns every shard's counters if this shard finished last"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.store.put(self._report_name(self.shard_index), report)
+        self.store.delete(self._lease_name(self.shard_index))
+
+        now = self.clock()
+        for name in self.store.list("leases/"):
+            lease = self.store.get(name)
+            if lease is not None and lease["expires_at"] > now:
+                LOG.info("Other shards are still running, leaving the combined report to the last one")
+                return None
+
+        if not self.store.claim(COMBINED_LOCK_NAME, {"shard": self.shard_index}):
+            LOG.info("Another shard is building the combined report")
+            return None
+        try:
+            if self.store.get(self._report_name(self.shard_index)) is None:
+                LOG.info("Another shard has already built the combined report")
+                return None
+            reports = [self.store.get(self._report_name(index)) for index in range(self.shard_count)]
+            if any(report is None for report in reports):
+                LOG.warn("Not every shard left a report, skipping the combined report")
+                return None
+            for index in range(self.shard_count):
+                self.store.delete(self._report_name(index))
+            return reports
+        finally:
+            self.store.delete(COMBINED_LOCK_NAME)
+
+    def _heartbeat(self) -> None:
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                self.refresh()
+            except Exception as e:
+                LOG.warn(f"Failed to renew the lease of shard {self.shard_index}: {e}")
+
+    def _lease_name(self, index: int) -> str:
+        return f"leases/shard-{index}.json"
+
+    def _report_name(self, index: int) -> str:
+        return f"reports/shard-{index}.json"
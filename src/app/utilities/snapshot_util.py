@@ -0,0 +1,144 @@
+"""Module to hold a snapshot of the Okta directory for resolving input rows locally"""
+
+import os
+import sys
+from src.app.utilities.env_util import Env
+from src.app.utilities.logging_util import Logger
+
+# Every status a user can be deactivated and/or deleted from
+ALL_SNAPSHOT_STATUSES = "STAGED,PROVISIONED,ACTIVE,RECOVERY,PASSWORD_EXPIRED,LOCKED_OUT,SUSPENDED,DEPROVISIONED"
+SNAPSHOT_STATUSES = [
+    status.strip().upper()
+    for status in str(Env.get("SNAPSHOT_STATUSES", ALL_SNAPSHOT_STATUSES)).split(",")
+    if status.strip()
+]
+SNAPSHOT_DB_PATH = Env.get("SNAPSHOT_DB_PATH")
+
+LOG = Logger("snapshot_util.py")
+
+
+class UnlistedUsers(list):
+    """Class for the (empty) users of a value a snapshot of only some statuses has no user for.
+
+    The value can still have users with one of the statuses left out, so it is not known to be not found.
+    """
+
+
+class UserSnapshot:
+    """Class to index the directory in memory by Okta ID and by lowercase email.
+
+    Only the ID, status and email of each user are kept. Status strings are interned, and an
+    email maps to a single ID unless several users share it, so the index stays compact.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.emails = {}
+        # False when only some statuses were listed, see `missing`
+        self.complete = True
+
+    def add(self, users: list) -> None:
+        """Function to add a page of users to the index"""
+        for user in users:
+            okta_id = user["id"]
+            self.statuses[okta_id] = sys.intern(user["status"])
+            email = str((user.get("profile") or {}).get("email") or "").casefold()
+            if not email:
+                continue
+            existing = self.emails.get(email)
+            if existing is None:
+                self.emails[email] = okta_id
+            elif isinstance(existing, tuple):
+                self.emails[email] = existing + (okta_id,)
+            elif existing != okta_id:
+                self.emails[email] = (existing, okta_id)
+
+    def users_for_id(self, okta_id: str) -> list:
+        """Function to get the user with an Okta ID as a list of zero or one {id, status}"""
+        status = self.statuses.get(okta_id)
+        return self.missing() if status is None else [{"id": okta_id, "status": status}]
+
+    def users_for_email(self, email: str) -> list:
+        """Function to get every user with an email as a list of {id, status}"""
+        okta_ids = self.emails.get(email.casefold(), ())
+        if isinstance(okta_ids, str):
+            okta_ids = (okta_ids,)
+        return [{"id": okta_id, "status": self.statuses[okta_id]} for okta_id in okta_ids] or self.missing()
+
+    def missing(self) -> list:
+        """Function to get the users of a value the snapshot has no user for"""
+        return [] if self.complete else UnlistedUsers()
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+    def close(self) -> None:
+        """Function to release the index"""
+        self.statuses = {}
+        self.emails = {}
+
+
+class SqliteUserSnapshot:
+    """Class to index the directory in a local SQLite file instead of memory, for very large tenants"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.complete = True
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        import sqlite3  # pylint: disable=C0415
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE users (id TEXT PRIMARY KEY, email TEXT, status TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX users_email ON users (email)")
+
+    def add(self, users: list) -> None:
+        """Function to add a page of users to the index"""
+        rows = [
+            (user["id"], str((user.get("profile") or {}).get("email") or "").casefold() or None, user["status"])
+            for user in users
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?)", rows)
+
+    def users_for_id(self, okta_id: str) -> list:
+        """Function to get the user with an Okta ID as a list of zero or one {id, status}"""
+        rows = self.connection.execute("SELECT id, status FROM users WHERE id = ?", (okta_id,))
+        return [{"id": row[0], "status": row[1]} for row in rows] or self.missing()
+
+    def users_for_email(self, email: str) -> list:
+        """Function to get every user with an email as a list of {id, status}"""
+        rows = self.connection.execute("SELECT id, status FROM users WHERE email = ?", (email.casefold(),))
+        return [{"id": row[0], "status": row[1]} for row in rows] or self.missing()
+
+    def missing(self) -> list:
+        """Function to get the users of a value the snapshot has no user for"""
+        return [] if self.complete else UnlistedUsers()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self) -> None:
+        """Function to close and remove the SQLite file"""
+        self.connection.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def build_snapshot(okta, statuses: list = None, path: str = SNAPSHOT_DB_PATH):
+    """Function to list the directory once and index every user, in SQLite when a path is given"""
+    if statuses is None:
+        statuses = SNAPSHOT_STATUSES
+    snapshot = SqliteUserSnapshot(path) if path else UserSnapshot()
+    # Values without a user in a snapshot of only some statuses are not known to be not found
+    snapshot.complete = set(ALL_SNAPSHOT_STATUSES.split(",")) <= set(statuses)
+    LOG.info(f"Listing users with status {', '.join(statuses)} into a snapshot")
+    for page in okta.list_users(statuses):
+        snapshot.add(page)
+        if LOG.is_enabled("DEBUG"):
+            LOG.debug(f"Snapshot holds {len(snapshot)} users")
+    LOG.info(f"Snapshot holds {len(snapshot)} users")
+    return snapshot
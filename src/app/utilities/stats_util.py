@@ -0,0 +1,131 @@
+"""Module to keep the run statistics shown in the report"""
+
+import copy
+import threading
+
+STATS_DEFAULTS = {
+    "TOTAL_ROWS": 0,
+    "TOTAL_ROWS_PROCESSED": 0,
+    "TOTAL_ROWS_RESUMED": 0,
+    "TOTAL_ROWS_CACHED": 0,
+    "TOTAL_ROWS_INVALID": 0,
+    "TOTAL_ROWS_DUPLICATE": 0,
+    "TOTAL_USERS_DEACTIVATED": 0,
+    "TOTAL_USERS_DELETED": 0,
+    "TOTAL_USERS_NOT_FOUND": 0,
+    "TOTAL_USERS_SKIPPED": 0,
+    "TOTAL_USERS_UNLISTED": 0,
+    "TOTAL_OKTA_API_CALLS": 0,
+    "SNAPSHOT_USERS": 0,
+    "PLAN_USERS_TO_DEACTIVATE": 0,
+    "PLAN_USERS_TO_DELETE": 0,
+    "PLAN_LOOKUP_ERRORS": 0,
+    "TOTAL_ROWS_FROM_PLAN": 0,
+    "TOTAL_ERROR_COUNT": 0,
+    "LOOKUP_ERROR_COUNT": 0,
+    "DEACTIVATION_ERROR_COUNT": 0,
+    "DELETE_ERROR_COUNT": 0,
+    "TOTAL_FAILURES_RETRIED": 0,
+    "TOTAL_FAILURES_RECOVERED": 0,
+    "THROTTLE_COUNT": 0,
+    "THROTTLE_TIME": 0,
+    "WORK_TIME": 0,
+    "RATE_LIMIT_STATS": [],
+    "HTTP_LATENCY_STATS": {},
+    "LATENCY_STATS": [],
+    "PIPELINE_STATS": [],
+    "ADAPTIVE_CONCURRENCY_STATS": [],
+}
+
+
+class RunStats:
+    """Class to count what a run did without a shared lock on the hot path.
+
+    Every thread adds to its own dict of counters, registered the first time it counts
+    something, and `snapshot` sums them. Values that are worked out once (row totals, rate
+    limit and latency stats) are `set` instead. A snapshot is a plain dict, so the snapshots of
+    several shards can be sent between processes and combined with `merge_stats`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.generation = 0
+        self.counters = []
+        self.values = {}
+
+    def _counters(self) -> dict:
+        """Function to get the calling thread's counters, registering them on first use after a reset"""
+        local = self.local
+        if getattr(local, "generation", None) != self.generation:
+            with self.lock:
+                local.counts = {}
+                local.generation = self.generation
+                self.counters.append(local.counts)
+        return local.counts
+
+    def increment(self, key: str, amount=1) -> None:
+        """Function to add to a counter of the calling thread"""
+        counts = self._counters()
+        counts[key] = counts.get(key, 0) + amount
+
+    def set(self, key: str, value) -> None:
+        """Function to set a value that is worked out once, such as a total or a list of stats"""
+        with self.lock:
+            self.values[key] = value
+
+    def snapshot(self) -> dict:
+        """Function to get every statistic, with the counters of all threads added up"""
+        data = copy.deepcopy(STATS_DEFAULTS)
+        with self.lock:
+            counters = list(self.counters)
+            data.update(self.values)
+        for counts in counters:
+            for key, value in dict(counts).items():
+                data[key] = data.get(key, 0) + value
+        return data
+
+    def __getitem__(self, key: str):
+        return self.snapshot()[key]
+
+    def reset(self) -> None:
+        """Function to start counting from zero, threads register new counters on their next increment"""
+        with self.lock:
+            self.generation += 1
+            self.counters = []
+            self.values = {}
+
+
+STATS = RunStats()
+
+
+def increment(key: str, amount=1) -> None:
+    """Function to add to a run counter"""
+    STATS.increment(key, amount)
+
+
+def merge_stats(snapshots: list) -> dict:
+    """Function to add up the statistics of several shards: counters are summed and lists of stats joined"""
+    merged = {}
+    for key, default in STATS_DEFAULTS.items():
+        values = [snapshot.get(key, default) for snapshot in snapshots]
+        if isinstance(default, list):
+            merged[key] = [item for value in values for item in value]
+        elif isinstance(default, dict):
+            merged[key] = _merge_latency_stats([value for value in values if value])
+        else:
+            merged[key] = sum(values)
+    return merged
+
+
+def _merge_latency_stats(stats: list) -> dict:
+    if not stats:
+        return {}
+    merged = {
+        "request_count": sum(item["request_count"] for item in stats),
+        "retry_count": sum(item["retry_count"] for item in stats),
+        "total_latency": sum(item["total_latency"] for item in stats),
+        "max_latency": max(item["max_latency"] for item in stats),
+    }
+    merged["average_latency"] = merged["total_latency"] / merged["request_count"] if merged["request_count"] else 0.0
+    return merged
@@ -0,0 +1,99 @@
+import asyncio
+
+from aiohttp import web
+
+from src.app.utilities.async_okta_util import AsyncOkta, EmailSearchBatcher
+from src.app.utilities.error_util import OktaApiError
+from src.app.utilities.rate_limit_util import RateLimiterPool
+
+
+async def serve(routes):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/api/v1"
+
+
+def test_async_client_calls_and_paginates():
+    failures = {"count": 0}
+
+    async def get_user(request):
+        # The first attempt fails to check the 5xx retry
+        if failures["count"] == 0:
+            failures["count"] += 1
+            return web.json_response({}, status=503)
+        return web.json_response({"id": request.match_info["id"], "status": "ACTIVE"}, headers={
+            "X-Rate-Limit-Limit": "100", "X-Rate-Limit-Remaining": "50", "X-Rate-Limit-Reset": "4102444800",
+        })
+
+    async def search(request):
+        if request.query.get("after"):
+            return web.json_response([{"id": "00u2", "profile": {"email": "a@example.com"}}])
+        next_url = f"{request.url.with_query({'after': '1'})}"
+        return web.json_response(
+            [{"id": "00u1", "profile": {"email": "A@example.com"}}],
+            headers={"Link": f'<{next_url}>; rel="next"'},
+        )
+
+    async def deactivate(request):
+        return web.json_response({"errorCode": "E0000038"}, status=403)
+
+    async def delete(request):
+        return web.Response(status=204)
+
+    async def scenario():
+        runner, base_url = await serve([
+            web.get("/api/v1/users/{id}", get_user),
+            web.get("/api/v1/users", search),
+            web.post("/api/v1/users/{id}/lifecycle/deactivate", deactivate),
+            web.delete("/api/v1/users/{id}", delete),
+        ])
+        okta = AsyncOkta(rate_limiters=RateLimiterPool(), base_url=base_url, backoff_seconds=0)
+        try:
+            user = await okta.get_user("00u1")
+            users = await okta.search_users_by_emails(["a@example.com"])
+            deleted = await okta.delete_user("00u1")
+            try:
+                await okta.deactivate_user("00u1")
+                error = None
+            except OktaApiError as e:
+                error = e
+        finally:
+            await okta.close()
+            await runner.cleanup()
+        return okta, user, users, deleted, error
+
+    okta, user, users, deleted, error = asyncio.run(scenario())
+
+    assert user["status_code"] == 200 and user["json"]["id"] == "00u1"
+    assert [found["id"] for found in users["a@example.com"]] == ["00u1", "00u2"]
+    assert deleted is True
+    assert error.status_code == 403 and error.body == {"errorCode": "E0000038"}
+    assert okta.latency_stats()["retry_count"] == 1
+    stats = {bucket["name"]: bucket for bucket in okta.rate_limit_stats()}
+    assert stats["GET /users/{id}"]["remaining"] == 50
+
+
+def test_email_lookups_in_flight_share_batched_searches():
+    class SearchingOkta:
+        def __init__(self):
+            self.batches = []
+
+        async def search_users_by_emails(self, emails):
+            self.batches.append(list(emails))
+            return {email.casefold(): [{"id": f"id-{email.casefold()}"}] for email in emails}
+
+    async def scenario():
+        okta = SearchingOkta()
+        batcher = EmailSearchBatcher(okta, batch_size=3)
+        results = await asyncio.gather(*(batcher.lookup(f"User{index}@example.com") for index in range(7)))
+        return okta, results
+
+    okta, results = asyncio.run(scenario())
+
+    assert [len(batch) for batch in okta.batches] == [3, 3, 1]
+    assert results[4] == [{"id": "id-user4@example.com"}]
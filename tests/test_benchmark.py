@@ -0,0 +1,58 @@
+import pytest
+
+from benchmarks import okta_api, run
+from benchmarks.mock_okta import MockOktaServer, MockOktaState
+from src.app.utilities.error_util import OktaApiError
+from src.app.utilities.okta_util import Okta, is_already_deprovisioned
+from src.app.utilities.rate_limit_util import RateLimiterPool
+
+
+@pytest.fixture
+def server():
+    users = {"00u1": ("ACTIVE", "a@example.com"), "00u2": ("DEPROVISIONED", "b@example.com")}
+    server = MockOktaServer(MockOktaState(users, limit=5, window_seconds=1)).start()
+    yield server
+    server.stop()
+
+
+def test_mock_server_emulates_the_lifecycle_endpoints(server):
+    okta = Okta(rate_limiters=RateLimiterPool())
+    okta.base_url = server.base_url
+
+    assert okta.get_user("00u1")["json"]["status"] == "ACTIVE"
+    assert okta.get_user("00umissing")["status_code"] == 404
+    assert [user["id"] for user in okta.search_users_by_emails(["B@example.com"])["b@example.com"]] == ["00u2"]
+    assert okta.deactivate_user("00u1") is True
+    with pytest.raises(OktaApiError) as error:
+        okta.deactivate_user("00u2")
+    assert is_already_deprovisioned(error.value)
+    assert okta.delete_user("00u2") is True
+    assert okta.get_user("00u2")["status_code"] == 404
+
+
+def test_mock_server_rate_limits_each_endpoint(server):
+    state = server.state
+    results = [state.take("GET /users/{id}")[0] for _ in range(6)]
+
+    assert results == [True] * 5 + [False]
+    assert state.take("DELETE /users/{id}")[1]["X-Rate-Limit-Remaining"] == "4"
+
+
+def test_benchmark_runs_main_end_to_end(tmp_path):
+    results = run.main(["--users", "50", "--env", "CONCURRENCY=4", "--output", str(tmp_path / "results.json")])
+
+    assert results[0]["rows"] == 51
+    assert results[0]["deleted"] == 50
+    assert results[0]["users_left"] == 0
+    assert results[0]["errors"] == 0
+    assert results[0]["peak_rss_mb"] > 0
+    assert results[0]["import_ms"] > 0
+    # Without TARGET_S3_BUCKET nothing loads boto3
+    assert not results[0]["boto3_loaded"]
+
+
+def test_okta_api_microbenchmark_compares_both_implementations():
+    results = okta_api.main(["--calls", "50"])
+
+    assert [result["scenario"] for result in results] == ["get_user", "deactivate_user", "delete_user"]
+    assert all(result["legacy_us"] > 0 and result["current_us"] > 0 for result in results)
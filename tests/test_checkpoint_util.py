@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from src.app.utilities.checkpoint_util import Checkpoint
+from src.app.utilities.config_util import CONFIG
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, key, data):
+        self.objects[key] = data
+        return True
+
+    def get_object(self, key):
+        return self.objects[key]
+
+    def delete_object(self, key):
+        del self.objects[key]
+        return True
+
+
+@pytest.fixture
+def src_path(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    return tmp_path
+
+
+def test_offset_advances_over_out_of_order_rows(src_path):
+    checkpoint = Checkpoint("data/input/okta_ids/test_ids.csv", flush_rows=100, flush_seconds=3600)
+    for row_number in (2, 3, 5):
+        checkpoint.mark_done(row_number, f"00u{row_number}")
+    assert checkpoint.offset == 0
+
+    checkpoint.mark_done(1, "00u1")
+    assert checkpoint.offset == 3
+    assert checkpoint.done_rows == {5: "00u5"}
+
+
+def test_flushes_in_batches_and_resumes(src_path):
+    s3 = FakeS3()
+    checkpoint = Checkpoint("data/input/okta_ids/test_ids.csv", s3=s3, flush_rows=3, flush_seconds=3600)
+    checkpoint.mark_done(1, "00u1")
+    checkpoint.mark_done(2, "00u2")
+    assert not (src_path / checkpoint.path).exists()
+
+    checkpoint.mark_done(4, "00u4")
+    saved = json.loads((src_path / checkpoint.path).read_text())
+    assert saved["offset"] == 2
+    assert saved["completed"] == {"4": "00u4"}
+    assert json.loads(s3.objects[checkpoint.path]) == saved
+
+    # A local-only restart falls back to the S3 copy
+    (src_path / checkpoint.path).unlink()
+    resumed = Checkpoint("data/input/okta_ids/test_ids.csv", s3=s3)
+    assert resumed.load()
+    assert [row for row in range(1, 6) if not resumed.should_skip(row)] == [3, 5]
+
+    resumed.mark_done(3, "00u3")
+    assert resumed.offset == 4
+
+
+def test_ignores_checkpoint_for_other_input(src_path):
+    Checkpoint("data/input/other/test_ids.csv").flush()
+    assert not Checkpoint("data/input/okta_ids/test_ids.csv").load()
+
+
+def test_ignores_checkpoint_for_a_new_file_with_the_same_name(src_path):
+    Checkpoint("data/input/okta_ids/test_ids.csv", fingerprint="old").flush()
+    assert not Checkpoint("data/input/okta_ids/test_ids.csv", fingerprint="new").load()
+    assert Checkpoint("data/input/okta_ids/test_ids.csv", fingerprint="old").load()
+
+
+def test_complete_removes_the_checkpoint(src_path):
+    s3 = FakeS3()
+    checkpoint = Checkpoint("data/input/okta_ids/test_ids.csv", s3=s3)
+    checkpoint.mark_done(1, "00u1")
+    checkpoint.flush()
+
+    checkpoint.complete()
+    checkpoint.flush()
+
+    assert not (src_path / checkpoint.path).exists()
+    assert s3.objects == {}
+    assert not Checkpoint("data/input/okta_ids/test_ids.csv", s3=s3).load()
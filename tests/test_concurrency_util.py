@@ -0,0 +1,73 @@
+import threading
+import time
+
+from src.app.utilities.concurrency_util import AdaptiveConcurrency
+
+
+def finish(controller, latency=0.05, status_code=200, headroom=0.9, count=1):
+    for _ in range(count):
+        controller.acquire()
+        controller.record(latency, status_code, headroom)
+        controller.release()
+
+
+def test_healthy_rounds_raise_the_limit_up_to_the_maximum():
+    controller = AdaptiveConcurrency(2, maximum=4)
+
+    finish(controller, count=2)
+    assert controller.limit == 3
+    finish(controller, count=3 + 4 + 4)
+
+    assert controller.limit == 4
+    assert controller.stats()["increases"] == 2
+
+
+def test_low_rate_limit_headroom_holds_the_limit():
+    controller = AdaptiveConcurrency(2, maximum=8)
+
+    finish(controller, headroom=0.05, count=10)
+
+    assert controller.limit == 2
+
+
+def test_a_burst_of_429s_backs_off_once():
+    controller = AdaptiveConcurrency(8, maximum=8)
+    for _ in range(8):
+        controller.acquire()
+
+    for _ in range(8):
+        controller.record(0.05, 429)
+        controller.release()
+
+    assert controller.limit == 4
+    assert controller.stats()["decreases"] == 1
+
+
+def test_rising_p95_latency_backs_off():
+    controller = AdaptiveConcurrency(4, maximum=4)
+    finish(controller, latency=0.05, count=4)
+
+    finish(controller, latency=0.5, count=4)
+
+    assert controller.limit == 2
+    assert controller.stats()["lowest"] == 2
+
+
+def test_acquire_waits_for_a_free_slot():
+    controller = AdaptiveConcurrency(1)
+    controller.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        controller.acquire()
+        acquired.set()
+        controller.release()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+
+    controller.release()
+    thread.join(timeout=5)
+    assert acquired.is_set()
@@ -0,0 +1,77 @@
+import csv
+
+import pytest
+
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.error_util import FAILURE_HEADER, FailureSink
+
+
+class FakeS3:
+    def __init__(self):
+        self.uploads = []
+
+    def upload_fileobj(self, key, fileobj):
+        self.uploads.append((key, fileobj.read()))
+
+
+@pytest.fixture
+def src_path(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    return tmp_path
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        rows = list(csv.reader(file))
+    # Every file starts with the header row
+    assert rows[0] == FAILURE_HEADER
+    return rows[1:]
+
+
+def test_buffers_until_size_threshold(src_path):
+    s3 = FakeS3()
+    sink = FailureSink(s3, flush_size=3, flush_seconds=3600)
+    sink.record("00u1", "output/first.csv", "deactivate", 500, "boom")
+    sink.record("00u2", "output/second.csv", "delete", 403, '{"errorCode": "E0000006"}', attempts=2)
+    assert not (src_path / "output/first.csv").exists()
+
+    sink.record("00u3", "output/first.csv", "deactivate")
+    first = read_rows(src_path / "output/first.csv")
+    second = read_rows(src_path / "output/second.csv")
+
+    assert [row[:5] for row in first] == [["00u1", "deactivate", "500", "boom", "1"], ["00u3", "deactivate", "", "", "1"]]
+    assert second[0][:5] == ["00u2", "delete", "403", '{"errorCode": "E0000006"}', "2"]
+    # One upload per changed file per flush, not one per failure
+    assert sorted(key for key, _ in s3.uploads) == ["output/first.csv", "output/second.csv"]
+
+
+def test_final_flush_writes_leftovers(src_path):
+    sink = FailureSink(None, flush_size=100, flush_seconds=3600)
+    sink.record("00u1", "output/first.csv", "deactivate")
+    sink.flush()
+    sink.flush()
+    assert [row[0] for row in read_rows(src_path / "output/first.csv")] == ["00u1"]
+
+
+def test_keeps_the_latest_failure_of_each_id_until_taken(src_path):
+    sink = FailureSink(None, flush_size=100, flush_seconds=3600)
+    sink.record("00u1", "output/first.csv", "deactivate", 503)
+    sink.record("00u1", "output/second.csv", "delete", 500, attempts=2)
+    sink.record("00u2", "output/first.csv", "deactivate")
+
+    assert sink.take_failed() == {"00u1": ("delete", 500, 2), "00u2": ("deactivate", None, 1)}
+    assert sink.take_failed() == {}
+
+
+def test_recovered_rows_are_written_but_not_retried(src_path):
+    sink = FailureSink(None, flush_size=100, flush_seconds=3600)
+    sink.record("00u1", "output/first.csv", "deactivate", 503)
+    sink.take_failed()
+    sink.record_recovered("00u1", "output/first.csv", attempts=2)
+    sink.flush()
+
+    assert sink.take_failed() == {}
+    assert [row[:5] for row in read_rows(src_path / "output/first.csv")] == [
+        ["00u1", "deactivate", "503", "", "1"],
+        ["00u1", "recovered", "", "", "2"],
+    ]
@@ -0,0 +1,73 @@
+from src.app.utilities import exclude_util
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.exclude_util import ExcludeIndex
+
+
+def test_matches_exact_domain_prefix_and_glob_entries():
+    index = ExcludeIndex(
+        ["00uadmin", "*@corp-svc.example.com", "svc-*", "ceo?@example.com", ""],
+        case_insensitive=False,
+    )
+
+    assert "00uadmin" in index
+    assert "robot@corp-svc.example.com" in index
+    assert "svc-backup@example.com" in index
+    assert "ceo1@example.com" in index
+    assert "00uother" not in index
+    assert "robot@example.com" not in index
+    assert len(index) == 4
+
+
+def test_case_insensitive_only_folds_emails():
+    index = ExcludeIndex(["Exec@Example.com", "*@Corp-Svc.Example.com", "00uAdmin"], case_insensitive=True)
+
+    assert "exec@example.COM" in index
+    assert "Robot@corp-svc.example.com" in index
+    assert "00uAdmin" in index
+    assert "00uadmin" not in index
+
+
+def test_from_csv_reuses_cache_for_unchanged_file(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    exclude_csv = tmp_path / "exclude.csv"
+    exclude_csv.write_text("00uadmin\n*@corp-svc.example.com\n")
+
+    index = ExcludeIndex.from_csv(str(exclude_csv), use_cache=True)
+    assert (tmp_path / exclude_util.exclude_index_cache_name(str(exclude_csv))).exists()
+
+    def fail_rebuild(*args, **kwargs):
+        raise AssertionError("index should have been loaded from the cache")
+
+    monkeypatch.setattr(exclude_util.csv, "reader", fail_rebuild)
+    cached = ExcludeIndex.from_csv(str(exclude_csv), use_cache=True)
+    assert cached.exact == index.exact
+    assert "robot@corp-svc.example.com" in cached
+
+    monkeypatch.undo()
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    exclude_csv.write_text("00unew\n")
+    assert "00unew" in ExcludeIndex.from_csv(str(exclude_csv), use_cache=True)
+
+
+def test_from_csv_keeps_a_cache_per_exclude_list(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    first_csv = tmp_path / "first.csv"
+    second_csv = tmp_path / "second.csv"
+    first_csv.write_text("00ufirst\n")
+    second_csv.write_text("00usecnd\n")
+
+    ExcludeIndex.from_csv(str(first_csv), use_cache=True)
+    second = ExcludeIndex.from_csv(str(second_csv), use_cache=True)
+    first = ExcludeIndex.from_csv(str(first_csv), use_cache=True)
+
+    assert "00ufirst" in first and "00usecnd" not in first
+    assert "00usecnd" in second and "00ufirst" not in second
+
+
+def test_from_csv_does_not_cache_by_default(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    exclude_csv = tmp_path / "exclude.csv"
+    exclude_csv.write_text("00uadmin\n")
+
+    assert "00uadmin" in ExcludeIndex.from_csv(str(exclude_csv))
+    assert not (tmp_path / exclude_util.EXCLUDE_INDEX_CACHE_PATH).exists()
@@ -0,0 +1,45 @@
+import pytest
+import requests
+
+from src.app.utilities.http_util import HttpUtil, is_retryable_request
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def make_http(outcomes):
+    """Build an HttpUtil whose session replays the given responses/exceptions"""
+    http = HttpUtil()
+    outcomes = list(outcomes)
+
+    def request(method, url, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    http.session.request = request
+    return http
+
+
+def test_sends_each_request_once_and_counts_the_retries_of_the_caller():
+    http = make_http([FakeResponse(503), requests.exceptions.ConnectionError("reset")])
+
+    assert http.api("https://example.okta.com/api/v1/users/1", "GET").status_code == 503
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http.api("https://example.okta.com/api/v1/users/1", "GET")
+    http.record_retry()
+
+    stats = http.latency_stats()
+    assert stats["request_count"] == 2
+    assert stats["retry_count"] == 1
+
+
+def test_only_lookups_are_retryable():
+    assert is_retryable_request("GET", 503)
+    assert is_retryable_request("get")
+    assert not is_retryable_request("GET", 404)
+    assert not is_retryable_request("POST", 504)
+    assert not is_retryable_request("DELETE")
@@ -0,0 +1,94 @@
+import gzip
+import io
+import os
+from os import environ
+
+import boto3
+from moto import mock_aws
+
+from src.app.utilities.ingest_util import InputStream, PrefetchReader, find_input_path, input_fingerprint, local_parts, s3_parts
+from src.app.utilities.s3_util import S3Util
+from src.app.utilities.stats_util import STATS
+
+
+def test_streams_valid_unique_values_in_one_pass(tmp_path):
+    STATS.reset()
+    path = tmp_path / "ids.csv"
+    path.write_text("00u1\n00u2\n\nnot an id\n00u1\n00u3 \n", encoding="utf-8-sig")
+    skipped = []
+
+    stream = InputStream(local_parts(str(path)), "ids", on_skip=lambda row, value: skipped.append(row))
+    rows = list(stream)
+
+    assert rows == [(1, "00u1"), (2, "00u2"), (6, "00u3")]
+    assert skipped == [3, 4, 5]
+    assert stream.total_rows == 6
+    assert stream.progress() == 1.0
+    assert STATS["TOTAL_ROWS_INVALID"] == 2
+    assert STATS["TOTAL_ROWS_DUPLICATE"] == 1
+
+
+def test_reads_gzip_and_dedupes_emails_case_insensitively(tmp_path):
+    path = tmp_path / "emails.csv.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        file.write("a@example.com\nA@Example.com\nb@example.com\n")
+
+    assert find_input_path(str(tmp_path / "emails.csv")) == str(path)
+    assert [value for _, value in InputStream(local_parts(str(path)), "emails")] == ["a@example.com", "b@example.com"]
+    assert find_input_path(str(tmp_path / "missing.csv")) is None
+
+
+@mock_aws
+def test_streams_single_object_and_shards_from_s3():
+    client = boto3.client("s3", region_name="us-east-1")
+    client.create_bucket(Bucket=environ.get("TARGET_S3_BUCKET"))
+    s3 = S3Util()
+
+    def upload(key, body):
+        client.put_object(Bucket=s3.bucket, Key=f"{s3.prefix}/{key}", Body=body)
+
+    upload("data/input/okta_ids/test_ids.csv", b"00u1\n00u2\n")
+    parts = s3_parts(s3, "data/input/okta_ids/test_ids.csv")
+    assert [value for _, value in InputStream(parts, "ids")] == ["00u1", "00u2"]
+
+    upload("data/input/okta_ids/prod_ids/part-0002.csv.gz", gzip.compress(b"00u4\n00u3\n"))
+    upload("data/input/okta_ids/prod_ids/part-0001.csv", b"00u1\n00u2\n00u3\n")
+    parts = s3_parts(s3, "data/input/okta_ids/prod_ids.csv")
+    assert [part.name for part in parts] == [
+        "data/input/okta_ids/prod_ids/part-0001.csv",
+        "data/input/okta_ids/prod_ids/part-0002.csv.gz",
+    ]
+    stream = InputStream(parts, "ids")
+    assert list(stream) == [(1, "00u1"), (2, "00u2"), (3, "00u3"), (4, "00u4")]
+    assert stream.progress() == 1.0
+
+    assert s3_parts(s3, "data/input/okta_ids/missing.csv") == []
+
+    # Another list of the same size is told apart by its ETag
+    fingerprint = input_fingerprint(s3_parts(s3, "data/input/okta_ids/test_ids.csv"))
+    upload("data/input/okta_ids/test_ids.csv", b"00u8\n00u9\n")
+    assert input_fingerprint(s3_parts(s3, "data/input/okta_ids/test_ids.csv")) != fingerprint
+
+
+def test_prefetch_reader_reassembles_chunks():
+    body = io.BytesIO(b"".join(f"00u{i}\n".encode() for i in range(5000)))
+    reader = PrefetchReader(body, chunk_size=7, max_chunks=2)
+    assert io.BufferedReader(reader).read() == body.getvalue()
+
+
+def test_fingerprint_changes_with_the_content(tmp_path):
+    path = tmp_path / "ids.csv"
+    path.write_text("00u1\n00u2\n", encoding="utf-8")
+    first = input_fingerprint(local_parts(str(path)))
+    assert input_fingerprint(local_parts(str(path))) == first
+
+    path.write_text("00u3\n00u4\n", encoding="utf-8")
+    assert input_fingerprint(local_parts(str(path))) != first
+
+    # Same size and same first bytes, rewritten later
+    head = "".join(f"00u{i:017d}\n" for i in range(4000))
+    path.write_text(head + "00u1\n", encoding="utf-8")
+    first = input_fingerprint(local_parts(str(path)))
+    path.write_text(head + "00u2\n", encoding="utf-8")
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000_000))
+    assert input_fingerprint(local_parts(str(path))) != first
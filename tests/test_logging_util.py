@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from src.app.utilities import logging_util
+from src.app.utilities.logging_util import Logger, LogWriter
+
+
+def test_writes_text_lines_through_one_handle(tmp_path, capsys):
+    path = tmp_path / "logs" / "log.txt"
+    writer = LogWriter(str(path), colors_enabled=True)
+    writer.write(0, "main.py", "INFO", "first")
+    writer.write(0, "main.py", "WARN", "second")
+    writer.flush()
+
+    lines = path.read_text(encoding="utf-8-sig").splitlines()
+    assert lines[0].endswith("(main.py)]: first")
+    assert lines[1].endswith("(main.py)]: [WARN] second")
+    # Colors only go to the console
+    assert "\033[33msecond\033[0m" in capsys.readouterr().out
+
+
+def test_json_lines_format(tmp_path):
+    path = tmp_path / "log.jsonl"
+    writer = LogWriter(str(path), json_format=True)
+    writer.write(0, "okta_util.py", "ERROR", "boom")
+    writer.flush()
+
+    record = json.loads(path.read_text(encoding="utf-8-sig"))
+    assert record["level"] == "ERROR"
+    assert record["logger"] == "okta_util.py"
+    assert record["message"] == "boom"
+
+
+def test_level_filtering(monkeypatch):
+    written = []
+
+    class FakeWriter:
+        log_file_path = "unused"
+
+        def write(self, timestamp, name, level, message):
+            written.append((level, message))
+
+    monkeypatch.setattr(logging_util, "WRITER", FakeWriter())
+    monkeypatch.setenv("DISABLE_LOGGER", "")
+    log = Logger("test")
+    log.level = logging_util.LEVELS["WARN"]
+
+    log.info("skipped")
+    log.http("skipped")
+    log.warn("kept")
+    log.error("kept")
+
+    assert written == [("WARN", "kept"), ("ERROR", "kept")]
+    assert not log.is_enabled("INFO")
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_flush_writes_directly_when_the_writer_thread_died(tmp_path):
+    path = tmp_path / "log.txt"
+    writer = LogWriter(str(path))
+    writer.write(0, "main.py", "INFO", "first")
+    writer.flush()
+    # Stop the writer thread the way an unexpected error would
+    writer.queue.put(None)
+    writer.thread.join(timeout=5)
+    assert not writer.thread.is_alive()
+
+    writer.write(0, "main.py", "INFO", "second")
+    writer.flush()
+
+    lines = path.read_text(encoding="utf-8-sig").splitlines()
+    assert lines[-1].endswith("(main.py)]: second")
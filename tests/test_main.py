@@ -0,0 +1,468 @@
+import asyncio
+import csv
+import threading
+from functools import partial
+
+import pytest
+
+from src.app import main
+from src.app.utilities.config_util import CONFIG
+from src.app.utilities.error_util import FAILURES, OktaApiError, flush_failed_attempts, take_failed_attempts
+from src.app.utilities.plan_util import PlanWriter, load_plan
+from src.app.utilities.result_cache_util import close_result_cache, open_result_cache
+from src.app.utilities.snapshot_util import UserSnapshot
+from src.app.utilities.stats_util import STATS
+
+
+class FakeOkta:
+    """In-memory stand-in for the Okta client"""
+
+    def __init__(self, users):
+        self.users = dict(users)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def _record(self, call):
+        with self.lock:
+            self.calls.append(call)
+
+    def get_user(self, okta_id):
+        self._record(("GET", okta_id))
+        if okta_id not in self.users:
+            return {"status_code": 404, "json": {}}
+        return {"status_code": 200, "json": {"id": okta_id, "status": self.users[okta_id]}}
+
+    def deactivate_user(self, okta_id):
+        self._record(("DEACTIVATE", okta_id))
+        if okta_id not in self.users:
+            raise OktaApiError("Not found", 404, {"errorCode": "E0000007"})
+        if self.users[okta_id] == "DEPROVISIONED":
+            raise OktaApiError("Invalid status", 403, {"errorCode": "E0000038"})
+        self.users[okta_id] = "DEPROVISIONED"
+        return True
+
+    def delete_user(self, okta_id):
+        self._record(("DELETE", okta_id))
+        if okta_id not in self.users:
+            raise OktaApiError("Not found", 404, {"errorCode": "E0000007"})
+        del self.users[okta_id]
+        return True
+
+
+class FakeInputStream:
+    def progress(self):
+        return 0.5
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    """Reset the run counters around each test, without the per-row log lines"""
+    # Loggers read DISABLE_LOGGER when they are created, so main's module logger is switched off directly
+    monkeypatch.setenv("DISABLE_LOGGER", "True")
+    monkeypatch.setattr(main.LOG, "logging_disabled", True)
+    STATS.reset()
+    yield STATS
+
+
+@pytest.mark.parametrize("optimistic", [False, True])
+@pytest.mark.parametrize("concurrency", [1, 8])
+def test_process_id_rows_counts(counters, monkeypatch, concurrency, optimistic):
+    monkeypatch.setitem(CONFIG, "CONCURRENCY", concurrency)
+    monkeypatch.setitem(CONFIG, "OPTIMISTIC_LIFECYCLE", optimistic)
+    users = {f"00u{i}": "ACTIVE" for i in range(50)}
+    users.update({f"00ud{i}": "DEPROVISIONED" for i in range(25)})
+    okta = FakeOkta(users)
+    values = list(users) + [f"00umissing{i}" for i in range(10)] + ["00uexcluded"]
+
+    handler = partial(main.process_id_row, okta, ["00uexcluded"], FakeInputStream())
+    main.run_rows(enumerate(values, start=1), handler)
+
+    assert counters["TOTAL_USERS_DEACTIVATED"] == 50
+    assert counters["TOTAL_USERS_DELETED"] == 75
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 10
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+    # Excluded rows count as processed
+    assert counters["TOTAL_ROWS_PROCESSED"] == 86
+    assert sum(1 for call in okta.calls if call[0] == "DELETE") == 75
+    assert counters["DEACTIVATION_ERROR_COUNT"] == 0
+    assert counters["DELETE_ERROR_COUNT"] == 0
+    assert okta.users == {}
+    # The optimistic mode never looks users up
+    assert any(call[0] == "GET" for call in okta.calls) is not optimistic
+
+
+def test_optimistic_mode_records_real_deactivation_errors(counters, monkeypatch):
+    monkeypatch.setitem(CONFIG, "OPTIMISTIC_LIFECYCLE", True)
+    recorded = []
+    monkeypatch.setattr(main, "record_failed_attempt", lambda user_id, path, stage=None, error=None: recorded.append((user_id, stage)))
+
+    class ForbiddenOkta(FakeOkta):
+        def deactivate_user(self, okta_id):
+            raise OktaApiError("Forbidden", 403, {"errorCode": "E0000006"})
+
+    okta = ForbiddenOkta({"00u1": "ACTIVE"})
+    main.process_id_row(okta, [], FakeInputStream(), 1, "00u1")
+
+    assert recorded == [("00u1", "deactivate")]
+    assert counters["DEACTIVATION_ERROR_COUNT"] == 1
+    assert okta.users == {"00u1": "ACTIVE"}
+
+
+def test_email_rows_are_resolved_in_batches(counters, monkeypatch):
+    monkeypatch.setitem(CONFIG, "EMAIL_SEARCH_BATCH_SIZE", 10)
+
+    class SearchOkta(FakeOkta):
+        searches = []
+
+        def search_users_by_emails(self, emails):
+            self.searches.append(list(emails))
+            return {email.casefold(): [{"id": email, "status": "ACTIVE"}] for email in emails if email.startswith("user")}
+
+    emails = [f"user{i}@example.com" for i in range(15)] + ["nobody@example.com", "skip@example.com"]
+    okta = SearchOkta({email: "ACTIVE" for email in emails})
+    rows = main.resolve_email_rows(okta, ["skip@example.com"], enumerate(emails, start=1))
+    main.run_rows(rows, partial(main.process_email_row, okta, ["skip@example.com"], FakeInputStream()))
+
+    assert [len(batch) for batch in okta.searches] == [10, 6]
+    assert counters["TOTAL_USERS_DELETED"] == 15
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+
+
+def test_snapshot_rows_skip_the_lookups(counters):
+    okta = FakeOkta({"00u1": "ACTIVE", "00u2": "DEPROVISIONED"})
+    snapshot = UserSnapshot()
+    snapshot.add([{"id": okta_id, "status": status} for okta_id, status in okta.users.items()])
+
+    rows = main.resolve_snapshot_rows(snapshot, "ids", okta, ["00u1"], enumerate(["00u1", "00u2", "00u3"], start=1))
+    main.run_rows(rows, partial(main.process_id_row, okta, ["00u1"], FakeInputStream()))
+
+    assert okta.calls == [("DELETE", "00u2")]
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+
+
+def test_stale_snapshot_rows_are_handled_optimistically(counters):
+    okta = FakeOkta({"00u1": "DEPROVISIONED"})
+    snapshot = UserSnapshot()
+    # Since the snapshot, 00u1 was deactivated and 00u2 deleted by someone else
+    snapshot.add([{"id": "00u1", "status": "ACTIVE"}, {"id": "00u2", "status": "DEPROVISIONED"}])
+
+    rows = main.resolve_snapshot_rows(snapshot, "ids", okta, [], enumerate(["00u1", "00u2"], start=1))
+    main.run_rows(rows, partial(main.process_id_row, okta, [], FakeInputStream()))
+
+    assert okta.users == {}
+    assert counters["TOTAL_USERS_DELETED"] == 1
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+    assert counters["DEACTIVATION_ERROR_COUNT"] == 0
+    assert counters["DELETE_ERROR_COUNT"] == 0
+
+
+def test_values_missing_from_a_partial_snapshot_are_not_cached_as_not_found(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    okta = FakeOkta({"00u1": "ACTIVE", "00u2": "SUSPENDED"})
+
+    class ListingOkta:
+        def list_users(self, statuses):
+            yield [{"id": okta_id, "status": status} for okta_id, status in okta.users.items() if status in statuses]
+
+    snapshot = main.build_snapshot(ListingOkta(), ["ACTIVE"])
+    open_result_cache()
+    try:
+        rows = main.resolve_snapshot_rows(snapshot, "ids", okta, [], enumerate(["00u1", "00u2"], start=1))
+        main.run_rows(rows, partial(main.process_id_row, okta, [], FakeInputStream()))
+    finally:
+        close_result_cache()
+    open_result_cache()
+    try:
+        # A later run still looks up the user the snapshot left out
+        assert list(main.unknown_rows(enumerate(["00u1", "00u2"], start=1))) == [(2, "00u2")]
+    finally:
+        close_result_cache()
+
+    assert okta.users == {"00u2": "SUSPENDED"}
+    assert counters["TOTAL_USERS_UNLISTED"] == 1
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 0
+
+
+def test_plan_rows_only_read_and_execute_from_the_plan(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    monkeypatch.setitem(CONFIG, "CONCURRENCY", 4)
+    okta = FakeOkta({"00u1": "ACTIVE", "00u2": "DEPROVISIONED", "00u4": "ACTIVE"})
+    values = ["00u1", "00u2", "00u3", "00u4", "00uexcluded"]
+
+    plan_writer = PlanWriter("data/input/okta_ids/test_ids.csv")
+    handler = partial(main.plan_row, okta, ["00uexcluded"], plan_writer, FakeInputStream(), "ids")
+    main.run_rows(enumerate(values, start=1), handler)
+    plan_writer.commit()
+
+    assert all(call[0] == "GET" for call in okta.calls)
+    assert counters["PLAN_USERS_TO_DEACTIVATE"] == 2
+    assert counters["PLAN_USERS_TO_DELETE"] == 1
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+
+    okta.calls.clear()
+    plan = load_plan("data/input/okta_ids/test_ids.csv")
+    rows = main.resolve_plan_rows(plan, None, okta, ["00uexcluded"], enumerate(values + ["00u5"], start=1))
+    main.run_rows(rows, partial(main.process_id_row, okta, ["00uexcluded"], FakeInputStream()))
+
+    # Only the value that is not in the plan is looked up again
+    assert [call for call in okta.calls if call[0] == "GET"] == [("GET", "00u5")]
+    assert okta.users == {}
+    assert counters["TOTAL_ROWS_FROM_PLAN"] == 4
+
+
+class FlakyOkta(FakeOkta):
+    """FakeOkta whose calls fail with the given status codes, once or (for persistent ones) every time"""
+
+    def __init__(self, users, failures, persistent=()):
+        super().__init__(users)
+        self.failures = dict(failures)
+        self.persistent = persistent
+
+    def _fail(self, call, okta_id):
+        status_code = self.failures.get((call, okta_id))
+        if status_code is not None:
+            if okta_id not in self.persistent:
+                del self.failures[(call, okta_id)]
+            self._record((call, okta_id))
+            raise OktaApiError("Failed", status_code, {})
+
+    def get_user(self, okta_id):
+        # Like the client, a failed lookup is answered with its response rather than raised
+        try:
+            self._fail("GET", okta_id)
+        except OktaApiError as err:
+            return {"status_code": err.status_code, "json": {}}
+        return super().get_user(okta_id)
+
+    def deactivate_user(self, okta_id):
+        self._fail("DEACTIVATE", okta_id)
+        return super().deactivate_user(okta_id)
+
+    def delete_user(self, okta_id):
+        self._fail("DELETE", okta_id)
+        return super().delete_user(okta_id)
+
+
+def test_retry_pass_resumes_transient_failures_from_the_failed_stage(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_ATTEMPTS", 2)
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(FAILURES, "s3", None)
+    take_failed_attempts()
+    okta = FlakyOkta(
+        {"00u1": "ACTIVE", "00u2": "ACTIVE", "00u3": "ACTIVE", "00u4": "ACTIVE"},
+        {("DEACTIVATE", "00u1"): 503, ("DELETE", "00u2"): 429, ("DEACTIVATE", "00u3"): 403, ("DELETE", "00u4"): 500},
+        persistent=("00u4",),
+    )
+    main.run_rows(enumerate(list(okta.users), start=1), partial(main.process_id_row, okta, [], FakeInputStream()))
+    okta.calls.clear()
+
+    main.retry_failed_users(okta, "ids")
+
+    # 00u2 was already deactivated, so it is only deleted again; the 403 is not retried
+    assert [call for call in okta.calls if call[1] == "00u2"] == [("DELETE", "00u2")]
+    assert not [call for call in okta.calls if call[1] == "00u3"]
+    assert okta.users == {"00u3": "ACTIVE", "00u4": "DEPROVISIONED"}
+    assert counters["TOTAL_FAILURES_RETRIED"] == 4
+    assert counters["TOTAL_FAILURES_RECOVERED"] == 2
+    assert take_failed_attempts() == {"00u4": ("delete", 500, 3)}
+    flush_failed_attempts()
+
+
+def test_result_cache_skips_values_an_earlier_run_found_gone(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    okta = FakeOkta({"00u1": "ACTIVE", "00u2": "ACTIVE"})
+    handler = partial(main.process_id_row, okta, [], FakeInputStream())
+
+    open_result_cache()
+    try:
+        main.run_rows(main.unknown_rows(enumerate(["00u1", "00u3"], start=1)), handler)
+    finally:
+        close_result_cache()
+    okta.calls.clear()
+
+    open_result_cache()
+    try:
+        main.run_rows(main.unknown_rows(enumerate(["00u1", "00u2", "00u3"], start=1)), handler)
+    finally:
+        close_result_cache()
+
+    # The deleted and the not found ID are skipped, only the new one is looked up
+    assert [call for call in okta.calls if call[0] == "GET"] == [("GET", "00u2")]
+    assert counters["TOTAL_ROWS_CACHED"] == 2
+
+
+def test_result_cache_skips_emails_whose_users_an_earlier_run_deleted(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+
+    class SearchOkta(FakeOkta):
+        def __init__(self, users):
+            super().__init__(users)
+            self.searches = []
+
+        def search_users_by_emails(self, emails):
+            self.searches.append(list(emails))
+            return {email.casefold(): [{"id": email, "status": self.users[email]}] for email in emails if email in self.users}
+
+    emails = ["a@example.com", "b@example.com", "nobody@example.com"]
+    okta = SearchOkta({"a@example.com": "ACTIVE", "b@example.com": "DEPROVISIONED"})
+    for _ in range(2):
+        open_result_cache()
+        try:
+            rows = main.resolve_email_rows(okta, [], main.unknown_rows(enumerate(emails, start=1)))
+            main.run_rows(rows, partial(main.process_email_row, okta, [], FakeInputStream()))
+        finally:
+            close_result_cache()
+
+    # The rerun finds every email in the cache and searches for none of them
+    assert okta.searches == [emails]
+    assert counters["TOTAL_ROWS_CACHED"] == 3
+
+
+@pytest.mark.parametrize("optimistic", [False, True])
+def test_pipeline_counts_match_the_row_handlers(counters, monkeypatch, optimistic):
+    monkeypatch.setitem(CONFIG, "OPTIMISTIC_LIFECYCLE", optimistic)
+    monkeypatch.setitem(CONFIG, "PIPELINE_WORKERS", {"resolve": 2, "deactivate": 3, "delete": 4})
+    users = {f"00u{i}": "ACTIVE" for i in range(30)}
+    users.update({f"00ud{i}": "DEPROVISIONED" for i in range(10)})
+    okta = FakeOkta(users)
+    values = list(users) + [f"00umissing{i}" for i in range(5)] + ["00uexcluded"]
+    finished = []
+
+    class Recorder:
+        def mark_done(self, current_row, value):
+            finished.append(current_row)
+
+    main.run_pipeline(enumerate(values, start=1), okta, ["00uexcluded"], FakeInputStream(), "ids", Recorder())
+
+    assert counters["TOTAL_USERS_DEACTIVATED"] == 30
+    assert counters["TOTAL_USERS_DELETED"] == 40
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 5
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+    assert counters["TOTAL_ROWS_PROCESSED"] == 46
+    assert sorted(finished) == list(range(1, len(values) + 1))
+    assert okta.users == {}
+
+
+def test_async_rows_match_the_row_handlers(counters):
+    class AsyncFakeOkta(FakeOkta):
+        async def get_user(self, okta_id):
+            return FakeOkta.get_user(self, okta_id)
+
+        async def deactivate_user(self, okta_id):
+            return FakeOkta.deactivate_user(self, okta_id)
+
+        async def delete_user(self, okta_id):
+            return FakeOkta.delete_user(self, okta_id)
+
+    users = {f"00u{i}": "ACTIVE" for i in range(20)}
+    users.update({f"00ud{i}": "DEPROVISIONED" for i in range(5)})
+    okta = AsyncFakeOkta(users)
+    values = list(users) + ["00umissing", "00uexcluded"]
+
+    handler = partial(main.process_row_async, okta, ["00uexcluded"], FakeInputStream(), "ids")
+    asyncio.run(main.run_rows_async(enumerate(values, start=1), handler, concurrency=4))
+
+    assert counters["TOTAL_USERS_DEACTIVATED"] == 20
+    assert counters["TOTAL_USERS_DELETED"] == 25
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+    assert counters["TOTAL_USERS_SKIPPED"] == 1
+    assert okta.users == {}
+
+
+def test_async_rows_keep_going_while_a_checkpoint_write_blocks(counters):
+    finished = []
+    flushing = threading.Event()
+
+    class SlowCheckpoint:
+        def mark_done(self, row_number, value):
+            if row_number == 1:
+                # Stands in for a slow S3 upload, the other rows finish while it runs
+                flushing.set()
+                threading.Event().wait(0.5)
+                assert len(finished) == 3
+
+    async def handler(current_row, value):
+        if current_row > 1:
+            while not flushing.is_set():
+                await asyncio.sleep(0.01)
+        finished.append(current_row)
+
+    asyncio.run(main.run_rows_async(enumerate(["00u1", "00u2", "00u3"], start=1), handler, SlowCheckpoint(), concurrency=3))
+
+    assert sorted(finished) == [1, 2, 3]
+
+
+def test_retry_pass_looks_failed_emails_up_again_in_batches(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    monkeypatch.setitem(CONFIG, "EMAIL_SEARCH_BATCH_SIZE", 2)
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(FAILURES, "s3", None)
+    take_failed_attempts()
+
+    class SearchOkta(FakeOkta):
+        def __init__(self, users):
+            super().__init__(users)
+            self.searches = []
+
+        def search_users_by_emails(self, emails):
+            self.searches.append(list(emails))
+            return {email.casefold(): [{"id": email, "status": self.users[email]}] for email in emails if email in self.users}
+
+    emails = ["a@example.com", "b@example.com", "c@example.com"]
+    okta = SearchOkta({"a@example.com": "ACTIVE", "b@example.com": "DEPROVISIONED"})
+    for email in emails:
+        main.record_lookup_error(email, OktaApiError("Service unavailable", 503))
+
+    main.retry_failed_users(okta, "emails")
+
+    assert okta.searches == [emails[:2], emails[2:]]
+    assert okta.users == {}
+    assert counters["TOTAL_FAILURES_RECOVERED"] == 3
+    assert counters["TOTAL_USERS_NOT_FOUND"] == 1
+    assert take_failed_attempts() == {}
+    flush_failed_attempts()
+
+
+def test_retry_pass_deletes_users_whose_failed_deactivation_went_through(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(FAILURES, "s3", None)
+    take_failed_attempts()
+    okta = FlakyOkta({"00u1": "ACTIVE"}, {("DEACTIVATE", "00u1"): 504})
+    main.process_id_row(okta, [], FakeInputStream(), 1, "00u1")
+    # The gateway timed out, but Okta deactivated the user anyway
+    okta.users["00u1"] = "DEPROVISIONED"
+
+    main.retry_failed_users(okta, "ids")
+    flush_failed_attempts()
+
+    assert okta.users == {}
+    assert counters["TOTAL_FAILURES_RECOVERED"] == 1
+    with open(f"{tmp_path}/{CONFIG['FAILED_FIRST_CALL_CSV_PATH']}", newline="", encoding="utf-8-sig") as file:
+        assert [row[:2] for row in csv.reader(file)][1:] == [["00u1", "deactivate"], ["00u1", "recovered"]]
+
+
+def test_failed_lookups_are_recorded_and_retried(counters, monkeypatch, tmp_path):
+    monkeypatch.setitem(CONFIG, "SRC_PATH", f"{tmp_path}/")
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_ATTEMPTS", 2)
+    monkeypatch.setitem(CONFIG, "FAILURE_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(FAILURES, "s3", None)
+    take_failed_attempts()
+    okta = FlakyOkta({"00u1": "ACTIVE", "00u2": "ACTIVE"}, {("GET", "00u1"): 429, ("GET", "00u2"): 429}, persistent=("00u1",))
+    main.run_rows(enumerate(list(okta.users), start=1), partial(main.process_id_row, okta, [], FakeInputStream()))
+
+    assert counters["LOOKUP_ERROR_COUNT"] == 2
+    assert counters["TOTAL_ROWS_PROCESSED"] == 2
+
+    main.retry_failed_users(okta, "ids")
+
+    # 00u2 is looked up again and deleted, 00u1 keeps being throttled
+    assert okta.users == {"00u1": "ACTIVE"}
+    assert counters["TOTAL_FAILURES_RETRIED"] == 3
+    assert counters["TOTAL_FAILURES_RECOVERED"] == 1
+    assert take_failed_attempts() == {"00u1": ("lookup", 429, 3)}
+    flush_failed_attempts()
@@ -0,0 +1,95 @@
+import json
+import socket
+import urllib.request
+
+from src.app.utilities.metrics_util import Histogram, MetricsExporter, MetricsRegistry, SlidingWindow
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, key, body):
+        self.objects[key] = body
+
+
+def test_histogram_quantiles_interpolate_inside_buckets():
+    histogram = Histogram(buckets=(0.1, 0.2, 0.4))
+    for value in [0.05] * 50 + [0.15] * 45 + [0.3] * 4 + [1.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert abs(histogram.quantile(0.5) - 0.1) < 1e-9
+    assert 0.1 < histogram.quantile(0.95) <= 0.2
+    assert 0.2 < histogram.quantile(0.99) <= 0.4
+    assert histogram.quantile(1.0) == 0.4
+
+
+def test_sliding_window_only_counts_recent_events():
+    clock = FakeClock()
+    window = SlidingWindow(60, clock)
+    clock.now += 60
+    window.add(120)
+    assert window.rate() == 2.0
+
+    clock.now += 61
+    window.add(60)
+    assert window.rate() == 1.0
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.inc("http_retries_total", 2)
+    registry.observe("okta_request_seconds", 0.02, endpoint="GET /users/{id}", status=200)
+    registry.mark("rows_processed", 3)
+    registry.gauge("pipeline_queued", lambda: 7, stage="delete")
+
+    lines = registry.render().splitlines()
+
+    assert "okta_deletion_http_retries_total 2" in lines
+    assert 'okta_deletion_okta_request_seconds_bucket{endpoint="GET /users/{id}",status="200",le="0.025"} 1' in lines
+    assert 'okta_deletion_okta_request_seconds_bucket{endpoint="GET /users/{id}",status="200",le="+Inf"} 1' in lines
+    assert 'okta_deletion_okta_request_seconds_count{endpoint="GET /users/{id}",status="200"} 1' in lines
+    assert "okta_deletion_rows_processed 3" in lines
+    assert any(line.startswith('okta_deletion_rows_processed_per_second{window="60s"}') for line in lines)
+    assert 'okta_deletion_pipeline_queued{stage="delete"} 7' in lines
+
+    registry.remove_gauge("pipeline_queued", stage="delete")
+    assert "pipeline_queued" not in registry.render()
+
+
+def test_exporter_writes_and_uploads_the_metrics(tmp_path):
+    registry = MetricsRegistry()
+    registry.inc("http_retries_total")
+    s3 = FakeS3()
+    path = tmp_path / "metrics.prom"
+    exporter = MetricsExporter(registry, s3=s3, port=0, path=str(path)).start()
+    exporter.stop()
+
+    assert "okta_deletion_http_retries_total 1" in path.read_text(encoding="utf-8")
+    (snapshot,) = s3.objects.values()
+    assert json.loads(snapshot)["counters"][0]["value"] == 1
+
+
+def test_exporter_serves_the_metrics_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    registry = MetricsRegistry()
+    registry.mark("rows_processed")
+    exporter = MetricsExporter(registry, port=port, path=None).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        exporter.stop()
+
+    assert "okta_deletion_rows_processed 1" in body
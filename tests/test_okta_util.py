@@ -0,0 +1,185 @@
+import json
+
+import pytest
+
+from src.app.utilities import okta_util
+from src.app.utilities.error_util import OktaApiError
+from src.app.utilities.okta_util import Okta
+from src.app.utilities.rate_limit_util import RateLimiterPool
+
+
+class FakeResponse:
+    """Minimal stand-in for a requests.Response"""
+
+    def __init__(self, status_code, body=None, headers=None, links=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.links = links or {}
+
+    @property
+    def content(self):
+        return b"" if self.body is None else json.dumps(self.body).encode()
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeHttp:
+    """Returns queued responses and records every request"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.retries = 0
+
+    def api(self, url, method, data=None):
+        self.requests.append((method, url))
+        return self.responses.pop(0)
+
+    def record_retry(self):
+        self.retries += 1
+
+
+def make_okta(responses):
+    okta = Okta(rate_limiters=RateLimiterPool(pool_minimum=0))
+    okta.http = FakeHttp(responses)
+    okta.sleep = lambda seconds: None
+    return okta
+
+
+def test_rate_limit_headers_are_tracked_per_endpoint():
+    limited = {"X-Rate-Limit-Limit": "100", "X-Rate-Limit-Remaining": "10", "X-Rate-Limit-Reset": "4102444800"}
+    okta = make_okta([FakeResponse(200, [], limited), FakeResponse(204)])
+
+    okta.search_users(field="profile.email", value="someone@example.com")
+    okta.delete_user("00u1")
+
+    stats = {bucket["name"]: bucket for bucket in okta.rate_limit_stats()}
+    assert stats[okta_util.SEARCH_USERS_BUCKET]["remaining"] == 10
+    assert stats[okta_util.DELETE_USER_BUCKET]["remaining"] is None
+
+
+def test_lifecycle_calls_raise_with_status_and_body():
+    okta = make_okta([FakeResponse(204), FakeResponse(403, {"errorCode": "E0000006"})])
+
+    assert okta.delete_user("00u1") is True
+    with pytest.raises(OktaApiError) as error:
+        okta.deactivate_user("00u2")
+    assert error.value.status_code == 403
+    assert error.value.body == {"errorCode": "E0000006"}
+
+
+def test_email_filters_respect_the_url_length_limit(monkeypatch):
+    monkeypatch.setattr(okta_util, "OKTA_SEARCH_URL_MAX_LENGTH", 300)
+    okta = make_okta([])
+    emails = [f"user{number}@example.com" for number in range(20)]
+
+    expressions = list(okta._email_filters(emails))
+
+    assert len(expressions) > 1
+    assert sum(expression.count("profile.email eq") for expression in expressions) == 20
+    for expression in expressions:
+        assert len(f"{okta.base_url}/users?limit=200&filter={okta_util.quote(expression)}") <= 300
+
+
+def test_search_users_by_emails_follows_pages_and_groups_by_email():
+    first = [{"id": "00u1", "profile": {"email": "A@example.com"}}]
+    second = [{"id": "00u2", "profile": {"email": "a@example.com"}}]
+    okta = make_okta([
+        FakeResponse(200, first, links={"next": {"url": "https://next-page"}}),
+        FakeResponse(200, second),
+    ])
+
+    users = okta.search_users_by_emails(["a@example.com", "missing@example.com"])
+
+    assert [user["id"] for user in users["a@example.com"]] == ["00u1", "00u2"]
+    assert users["missing@example.com"] == []
+    assert okta.http.requests[1] == ("GET", "https://next-page")
+    assert "profile.email%20eq" in okta.http.requests[0][1]
+
+
+def test_list_users_filters_by_status_and_yields_pages():
+    okta = make_okta([
+        FakeResponse(200, [{"id": "00u1"}], links={"next": {"url": "https://next-page"}}),
+        FakeResponse(200, [{"id": "00u2"}]),
+    ])
+
+    pages = list(okta.list_users(["ACTIVE", "DEPROVISIONED"]))
+
+    assert pages == [[{"id": "00u1"}], [{"id": "00u2"}]]
+    assert "status%20eq%20%22DEPROVISIONED%22" in okta.http.requests[0][1]
+
+
+def test_rate_limited_calls_are_retried_a_bounded_number_of_times(monkeypatch):
+    monkeypatch.setattr(okta_util, "OKTA_MAX_RATE_LIMIT_RETRIES", 2)
+    limited = {"X-Rate-Limit-Limit": "100", "X-Rate-Limit-Remaining": "0", "X-Rate-Limit-Reset": "4102444800"}
+    sleeps = []
+    okta = Okta(rate_limiters=RateLimiterPool(pool_minimum=0, sleep=sleeps.append))
+    okta.http = FakeHttp([FakeResponse(429, {"errorCode": "E0000047"}, limited) for _ in range(4)])
+
+    response = okta.get_user("00u1")
+
+    assert response["status_code"] == 429
+    assert len(okta.http.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_response_bodies_are_only_decoded_when_read():
+    class CountingResponse(FakeResponse):
+        decoded = 0
+
+        def json(self):
+            CountingResponse.decoded += 1
+            return super().json()
+
+    okta = make_okta([CountingResponse(200, {}), CountingResponse(200, {"id": "00u1", "status": "ACTIVE"})])
+
+    assert okta.deactivate_user("00u1") is True
+    assert CountingResponse.decoded == 0
+    response = okta.get_user("00u1")
+    assert response["json"]["status"] == "ACTIVE"
+    assert response.get("next") is None
+    assert CountingResponse.decoded == 1
+
+
+def test_only_lookups_are_retried_after_a_server_error(monkeypatch):
+    monkeypatch.setattr(okta_util, "increment", lambda key, amount=1: calls.append(key))
+    calls = []
+    okta = make_okta([FakeResponse(503), FakeResponse(200, {"id": "00u1"}), FakeResponse(504)])
+
+    assert okta.get_user("00u1")["status_code"] == 200
+    # Okta may have deactivated the user before the 504, so the call is not sent again
+    with pytest.raises(OktaApiError) as error:
+        okta.deactivate_user("00u1")
+
+    assert error.value.status_code == 504
+    assert [method for method, _ in okta.http.requests] == ["GET", "GET", "POST"]
+    assert okta.http.retries == 1
+    assert calls.count("TOTAL_OKTA_API_CALLS") == 3
+
+
+def test_waits_for_a_concurrency_slot_before_reserving_a_rate_limit_slot():
+    events = []
+
+    class RecordingConcurrency:
+        def acquire(self):
+            events.append("concurrency")
+
+        def record(self, latency, status_code, headroom=None):
+            pass
+
+        def release(self):
+            events.append("release")
+
+    okta = make_okta([FakeResponse(204)])
+    okta.concurrency = RecordingConcurrency()
+    okta.rate_limiters.get(okta_util.DELETE_USER_BUCKET).acquire = lambda: events.append("rate limit")
+
+    okta.delete_user("00u1")
+
+    assert events == ["concurrency", "rate limit", "release"]
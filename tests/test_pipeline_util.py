@@ -0,0 +1,47 @@
+import threading
+
+from src.app.utilities.pipeline_util import Pipeline, Stage
+
+
+def test_items_finish_after_everything_they_emitted():
+    handled = []
+    finished = []
+    lock = threading.Lock()
+
+    def split(item, emit):
+        for part in range(item):
+            emit(part, stage="last" if part == 0 else None)
+
+    def double(part, emit):
+        emit(part * 2)
+
+    def record(part, emit):
+        with lock:
+            handled.append(part)
+
+    pipeline = Pipeline(
+        [Stage("split", split, 2), Stage("double", double, 3), Stage("last", record, 2)],
+        queue_size=1,
+        on_done=lambda item, failed: finished.append(item),
+    )
+    pipeline.run([3, 0, 2])
+
+    assert sorted(handled) == [0, 0, 2, 2, 4]
+    assert sorted(finished) == [0, 2, 3]
+    stats = {stage["name"]: stage for stage in pipeline.stats()}
+    assert stats["double"]["processed"] == 3
+    assert stats["last"]["processed"] == 5
+
+
+def test_stage_errors_are_counted_and_do_not_stop_the_pipeline():
+    finished = []
+
+    def fail_on_odd(item, emit):
+        if item % 2:
+            raise ValueError("odd")
+
+    pipeline = Pipeline([Stage("check", fail_on_odd, 2)], on_done=lambda item, failed: finished.append((item, failed)))
+    pipeline.run(range(6))
+
+    assert sorted(finished) == [(item, bool(item % 2)) for item in range(6)]
+    assert pipeline.stats()[0]["errors"] == 3
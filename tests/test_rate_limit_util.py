@@ -0,0 +1,107 @@
+from src.app.utilities.rate_limit_util import RateLimiter, RateLimiterPool
+
+
+class FakeClock:
+    """Clock that only moves when the limiter sleeps"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def headers(limit, remaining, reset):
+    return {
+        "X-Rate-Limit-Limit": str(limit),
+        "X-Rate-Limit-Remaining": str(remaining),
+        "X-Rate-Limit-Reset": str(reset),
+    }
+
+
+def make_limiter(clock, pool_minimum=0):
+    return RateLimiter("test", pool_minimum=pool_minimum, clock=clock.time, sleep=clock.sleep)
+
+
+def test_no_headers_never_throttles():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    assert limiter.acquire() == 0
+    limiter.update({})
+    assert limiter.acquire() == 0
+
+
+def test_paces_budget_evenly_until_reset():
+    clock = FakeClock()
+    limiter = make_limiter(clock, pool_minimum=100)
+    # 600 limit, 200 remaining, 60 seconds left => 100 usable requests, one every 0.6s
+    limiter.update(headers(600, 200, 1060))
+
+    for _ in range(100):
+        limiter.acquire()
+
+    assert clock.now <= 1060
+    assert clock.now >= 1059
+    assert max(clock.slept) < 1
+
+
+def test_waits_for_reset_when_budget_spent():
+    clock = FakeClock()
+    limiter = make_limiter(clock, pool_minimum=100)
+    limiter.update(headers(600, 100, 1030))
+
+    assert limiter.acquire() == 30
+    assert limiter.stats()["throttle_count"] == 1
+    # After the reset the budget is unknown again, so the next request goes straight out
+    assert limiter.acquire() == 0
+
+
+def test_stale_headers_do_not_raise_remaining():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.update(headers(600, 300, 1060))
+    limiter.update(headers(600, 450, 1060))
+    limiter.update(headers(600, 500, 1000))
+    assert limiter.stats()["remaining"] == 300
+
+    limiter.update(headers(600, 599, 1120))
+    assert limiter.stats()["remaining"] == 599
+
+
+def test_exhaust_blocks_until_reset():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    limiter.update(headers(600, 400, 1010))
+    limiter.exhaust()
+    assert limiter.acquire() == 10
+
+
+def test_pool_keeps_buckets_independent():
+    clock = FakeClock()
+    pool = RateLimiterPool(pool_minimum=100, clock=clock.time, sleep=clock.sleep)
+    pool.get("search").update(headers(600, 100, 1030))
+    pool.get("delete").update(headers(600, 599, 1060))
+
+    assert pool.get("delete").acquire() == 0
+    assert pool.get("search").acquire() == 30
+    assert {stats["name"] for stats in pool.stats()} == {"search", "delete"}
+
+
+def test_shares_divide_the_budget():
+    elapsed = {}
+    for shares in (1, 4):
+        clock = FakeClock()
+        limiter = RateLimiter("test", clock=clock.time, sleep=clock.sleep, shares=lambda: shares)
+        # 100 usable requests over 60 seconds: one every ~0.6s alone, every ~2.4s when split four ways
+        limiter.update(headers(600, 100, 1060))
+        for _ in range(10):
+            limiter.acquire()
+        elapsed[shares] = clock.now - 1000
+
+    assert 5 < elapsed[1] < 6
+    assert elapsed[4] > 3 * elapsed[1]
@@ -0,0 +1,8 @@
+from src.app.utilities.reporting_util import redact
+
+
+def test_redacts_credentials_only():
+    assert redact("OKTA_API_TOKEN", "abc") == "[REDACTED]"
+    assert redact("AWS_SECRET_ACCESS_KEY", "abc") == "[REDACTED]"
+    assert redact("db_password", "abc") == "[REDACTED]"
+    assert redact("OKTA_DOMAIN", "example.okta.com") == "example.okta.com"
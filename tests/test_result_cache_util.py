@@ -0,0 +1,63 @@
+from src.app.utilities import result_cache_util
+from src.app.utilities.result_cache_util import ResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_gone_outcomes_expire_after_the_ttl(tmp_path):
+    clock = FakeClock()
+    cache = ResultCache(str(tmp_path / "results.db"), ttl_seconds=60, clock=clock)
+    cache.record("00u1", "deleted", "00u1")
+    cache.record("missing@example.com", "not_found")
+    cache.record("00u2", "deactivated", "00u2")
+    cache.flush()
+
+    assert cache.is_gone("00u1")
+    assert cache.is_gone("missing@example.com")
+    assert not cache.is_gone("00u2")
+    assert not cache.is_gone("00u3")
+
+    clock.now += 61
+    assert not cache.is_gone("00u1")
+    cache.close()
+
+
+def test_merge_keeps_the_newest_outcome(tmp_path):
+    clock = FakeClock()
+    other = ResultCache(str(tmp_path / "shard-1.db"), clock=clock)
+    other.record("00u1", "deleted", "00u1")
+    other.record("00u2", "deactivated", "00u2")
+    clock.now += 10
+    cache = ResultCache(str(tmp_path / "results.db"), clock=clock)
+    cache.record("00u2", "deleted", "00u2")
+    clock.now -= 20
+    cache.record("00u1", "deactivated", "00u1")
+    other.close()
+
+    cache.merge(other.path)
+
+    assert len(cache) == 2
+    assert cache.is_gone("00u1")
+    assert cache.is_gone("00u2")
+    cache.close()
+
+
+def test_results_are_only_recorded_while_the_cache_is_open(monkeypatch, tmp_path):
+    monkeypatch.setitem(result_cache_util.CONFIG, "SRC_PATH", f"{tmp_path}/")
+    result_cache_util.record_result("00u1", "deleted")
+    assert not result_cache_util.is_known_gone("00u1")
+
+    result_cache_util.open_result_cache()
+    result_cache_util.record_result("00u1", "deleted")
+    result_cache_util.close_result_cache()
+    assert not result_cache_util.is_known_gone("00u1")
+
+    result_cache_util.open_result_cache()
+    assert result_cache_util.is_known_gone("00u1")
+    result_cache_util.close_result_cache()
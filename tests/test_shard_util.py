@@ -0,0 +1,90 @@
+from os import environ
+
+import boto3
+from moto import mock_aws
+
+from src.app.utilities import shard_util
+from src.app.utilities.ingest_util import InputStream, local_parts
+from src.app.utilities.s3_util import S3Util
+from src.app.utilities.shard_util import LocalShardStore, S3ShardStore, ShardCoordinator
+from src.app.utilities.stats_util import STATS_DEFAULTS
+
+
+def report(**counters):
+    data = dict(STATS_DEFAULTS, START_TIME=100, END_TIME=200)
+    data.update(counters)
+    return data
+
+
+def check_coordination(store):
+    first = ShardCoordinator(store, 0, 2, lease_seconds=30)
+    second = ShardCoordinator(store, 1, 2, lease_seconds=30)
+    first.refresh()
+    second.refresh()
+    assert second.active_shards() == 2
+
+    assert first.finish(report(TOTAL_USERS_DELETED=3)) is None
+    second.refresh()
+    assert second.active_shards() == 1
+
+    reports = second.finish(report(TOTAL_USERS_DELETED=4))
+    assert [item["TOTAL_USERS_DELETED"] for item in reports] == [3, 4]
+    assert store.list("reports/") == []
+    assert store.list("leases/") == []
+
+    assert store.claim("reports/combined.lock", {"shard": 0})
+    assert not store.claim("reports/combined.lock", {"shard": 1})
+    store.delete("reports/combined.lock")
+
+
+def test_local_store_coordinates_shards(tmp_path):
+    check_coordination(LocalShardStore(str(tmp_path)))
+
+
+@mock_aws
+def test_s3_store_coordinates_shards():
+    boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=environ.get("TARGET_S3_BUCKET"))
+    check_coordination(S3ShardStore(S3Util()))
+
+
+def test_only_one_shard_builds_the_combined_report(tmp_path, monkeypatch):
+    store = LocalShardStore(str(tmp_path))
+    first = ShardCoordinator(store, 0, 2, lease_seconds=30)
+    second = ShardCoordinator(store, 1, 2, lease_seconds=30)
+    store.put("reports/shard-0.json", report(TOTAL_USERS_DELETED=3))
+    warnings = []
+    monkeypatch.setattr(shard_util.LOG, "warn", warnings.append)
+
+    assert store.claim("reports/combined.lock", {"shard": 0})
+    assert second.finish(report(TOTAL_USERS_DELETED=4)) is None
+    store.delete("reports/combined.lock")
+
+    assert [item["TOTAL_USERS_DELETED"] for item in first.finish(report(TOTAL_USERS_DELETED=3))] == [3, 4]
+    # second left its report before first merged it, and only reaches the claim afterwards
+    monkeypatch.setattr(store, "put", lambda name, data: None)
+    assert second.finish(report(TOTAL_USERS_DELETED=4)) is None
+    assert warnings == []
+
+
+def test_expired_leases_are_not_counted(tmp_path):
+    store = LocalShardStore(str(tmp_path))
+    now = [1000.0]
+    stale = ShardCoordinator(store, 0, 2, lease_seconds=30, clock=lambda: now[0])
+    stale.refresh()
+    now[0] += 60
+    live = ShardCoordinator(store, 1, 2, lease_seconds=30, clock=lambda: now[0])
+    live.refresh()
+
+    assert live.active_shards() == 1
+
+
+def test_row_shards_split_the_input_without_overlap(tmp_path):
+    path = tmp_path / "emails.csv"
+    path.write_text("".join(f"user{i}@example.com\n" for i in range(100)) + "USER1@example.com\n", encoding="utf-8")
+
+    streams = [InputStream(local_parts(str(path)), "emails", shard=(index, 3)) for index in range(3)]
+    values = [[value.casefold() for _, value in stream] for stream in streams]
+
+    assert sorted(value for shard in values for value in shard) == sorted(f"user{i}@example.com" for i in range(100))
+    assert sum(stream.total_rows - stream.other_shard_rows for stream in streams) == 101
+
@@ -0,0 +1,45 @@
+import pytest
+
+from src.app.utilities.snapshot_util import SqliteUserSnapshot, UserSnapshot, build_snapshot
+
+USERS = [
+    {"id": "00u1", "status": "ACTIVE", "profile": {"email": "Shared@example.com"}},
+    {"id": "00u2", "status": "DEPROVISIONED", "profile": {"email": "shared@example.com"}},
+    {"id": "00u3", "status": "SUSPENDED", "profile": {}},
+]
+
+
+class ListingOkta:
+    def __init__(self, pages):
+        self.pages = pages
+        self.statuses = None
+
+    def list_users(self, statuses):
+        self.statuses = statuses
+        yield from self.pages
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def snapshot(request, tmp_path):
+    path = str(tmp_path / "snapshot.db") if request.param == "sqlite" else None
+    snapshot = build_snapshot(ListingOkta([USERS[:2], USERS[2:]]), ["ACTIVE"], path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_snapshot_resolves_ids_and_emails(snapshot):
+    assert len(snapshot) == 3
+    assert snapshot.users_for_id("00u3") == [{"id": "00u3", "status": "SUSPENDED"}]
+    assert snapshot.users_for_id("00umissing") == []
+    assert sorted(user["id"] for user in snapshot.users_for_email("SHARED@example.com")) == ["00u1", "00u2"]
+    assert snapshot.users_for_email("nobody@example.com") == []
+
+
+def test_sqlite_snapshot_removes_its_file(tmp_path):
+    path = tmp_path / "snapshot.db"
+    snapshot = SqliteUserSnapshot(str(path))
+    snapshot.add(USERS)
+    snapshot.close()
+
+    assert not path.exists()
+    assert isinstance(build_snapshot(ListingOkta([]), ["ACTIVE"], None), UserSnapshot)
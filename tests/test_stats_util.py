@@ -0,0 +1,49 @@
+import threading
+
+from src.app.utilities.stats_util import STATS_DEFAULTS, RunStats, merge_stats
+
+
+def test_counters_of_every_thread_add_up():
+    stats = RunStats()
+
+    def worker():
+        for _ in range(1000):
+            stats.increment("TOTAL_OKTA_API_CALLS")
+        stats.increment("WORK_TIME", 0.5)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.set("TOTAL_ROWS", 10)
+
+    snapshot = stats.snapshot()
+    assert snapshot["TOTAL_OKTA_API_CALLS"] == 8000
+    assert snapshot["WORK_TIME"] == 4.0
+    assert snapshot["TOTAL_ROWS"] == 10
+    assert snapshot["TOTAL_USERS_DELETED"] == 0
+
+
+def test_reset_drops_the_counts_of_threads_that_keep_running():
+    stats = RunStats()
+    stats.increment("TOTAL_USERS_DELETED", 3)
+    stats.set("RATE_LIMIT_STATS", [{"name": "get_user"}])
+
+    stats.reset()
+    assert stats.snapshot() == STATS_DEFAULTS
+
+    stats.increment("TOTAL_USERS_DELETED")
+    assert stats["TOTAL_USERS_DELETED"] == 1
+
+
+def test_merge_stats_adds_counters_and_latency():
+    merged = merge_stats([
+        dict(STATS_DEFAULTS, TOTAL_ROWS=10, HTTP_LATENCY_STATS={"request_count": 2, "retry_count": 0, "total_latency": 1.0, "max_latency": 0.7}),
+        dict(STATS_DEFAULTS, TOTAL_ROWS=5, HTTP_LATENCY_STATS={"request_count": 3, "retry_count": 1, "total_latency": 2.0, "max_latency": 0.9}),
+    ])
+
+    assert merged["TOTAL_ROWS"] == 15
+    assert merged["HTTP_LATENCY_STATS"]["request_count"] == 5
+    assert merged["HTTP_LATENCY_STATS"]["max_latency"] == 0.9
+    assert merged["HTTP_LATENCY_STATS"]["average_latency"] == 0.6